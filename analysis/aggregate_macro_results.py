@@ -41,7 +41,8 @@ def aggregate_graph_results_from_json(
     # Metadata keys to preserve.
     param_keys = [
         'condition', 'alpha', 'seed', 'top_k', 'bottom_k',
-        'max_samples', 'epochs', 'batch_size', 'lr'
+        'max_samples', 'epochs', 'batch_size', 'lr', 'svr_engine', 'rf_engine',
+        'preprocess', 'preprocess_components', 'eval_sample_size'
     ]
 
     # Find JSON files.
@@ -21,7 +21,8 @@ def aggregate_results_from_json(
 
     param_keys = [
         'condition', 'alpha', 'seed', 'top_k', 'bottom_k', 
-        'max_samples', 'epochs', 'batch_size', 'lr'
+        'max_samples', 'epochs', 'batch_size', 'lr', 'svr_engine', 'rf_engine',
+        'preprocess', 'preprocess_components', 'eval_sample_size'
     ]
 
     # --- Step 1: locate JSON files ---
@@ -0,0 +1,38 @@
+# === bench_data.py ===
+# Training/test data shared by the engine benchmarks: real OD pairs from --data_dir, or a
+# synthetic regression problem of the same width.
+from sklearn.datasets import make_friedman1
+
+
+def add_data_args(parser, test_size):
+    """Data options of the engine benchmarks; test_size is the default synthetic test size."""
+    parser.add_argument('--data_dir', type=str, default=None)
+    parser.add_argument('--train_areas_path', type=str, default=None)
+    parser.add_argument('--test_area', type=str, default=None)
+    parser.add_argument('--n_features', type=int, default=79, help="Width of the synthetic problem.")
+    parser.add_argument('--test_size', type=int, default=test_size, help="Test size of the synthetic problem.")
+
+
+def load_real(args, n_max, extract_fn):
+    with open(args.train_areas_path) as f:
+        areas = [line.strip() for line in f if line.strip()]
+    X_train, y_train = extract_fn(args.data_dir, areas, max_samples=n_max, seed=args.seed)
+    X_test, y_test = extract_fn(args.data_dir, [args.test_area], max_samples=None, seed=args.seed)
+    return X_train, y_train, X_test, y_test
+
+
+def load_synthetic(args, n_max):
+    X, y = make_friedman1(n_samples=n_max + args.test_size, n_features=args.n_features,
+                          noise=1.0, random_state=args.seed)
+    return X[:n_max], y[:n_max], X[n_max:], y[n_max:]
+
+
+def load_bench_data(args, n_max, extract_fn):
+    """(X_train, y_train, X_test, y_test) with up to n_max training samples; prints a summary."""
+    if args.data_dir:
+        X_all, y_all, X_test, y_test = load_real(args, n_max, extract_fn)
+    else:
+        X_all, y_all, X_test, y_test = load_synthetic(args, n_max)
+    print(f"[INFO] {'real' if args.data_dir else 'synthetic'} data: up to {len(X_all)} training samples, "
+          f"{len(X_test)} test pairs, {X_all.shape[1]} features.", flush=True)
+    return X_all, y_all, X_test, y_test
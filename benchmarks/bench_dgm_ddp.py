@@ -0,0 +1,55 @@
+# === bench_dgm_ddp.py ===
+# Throughput of data-parallel DGM training vs. the number of local CPU workers.
+# usage: PYTHONPATH=. python benchmarks/bench_dgm_ddp.py --samples 1000000 --workers 1,2,4,8,16
+import argparse
+import time
+
+import torch
+
+from src.utils.distributed import available_cpus, train_dgm_ddp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DistributedDataParallel DGM training on CPU.")
+    parser.add_argument('--samples', type=int, default=200000, help="Number of synthetic training samples.")
+    parser.add_argument('--input_dim', type=int, default=79, help="Feature width (2F+1).")
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--workers', type=str, default=None, help="Comma-separated worker counts (default: powers of two up to the CPU count).")
+    args = parser.parse_args()
+
+    n_cpus = available_cpus()
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= n_cpus:
+            worker_counts.append(worker_counts[-1] * 2)
+
+    torch.manual_seed(0)
+    X = torch.randn(args.samples, args.input_dim)
+    y = torch.randn(args.samples)
+    config = {
+        "epochs": args.epochs, "batch_size": args.batch_size, "lr": 1e-3, "seed": 0,
+        "patience": 3, "min_delta": 0.0, "eval_chunk_size": 65536, "precision": "fp32",
+    }
+
+    print(f"[INFO] {args.samples} samples x {args.input_dim} features, {args.epochs} epochs, "
+          f"global batch {args.batch_size}, {n_cpus} CPUs available.", flush=True)
+    rows = []
+    for n_workers in worker_counts:
+        # Every configuration uses all available cores: threads are split across workers.
+        n_threads = max(1, n_cpus // n_workers)
+        start = time.perf_counter()
+        _, info = train_dgm_ddp(X, y, None, None, config, n_workers, n_threads=n_threads)
+        wall = time.perf_counter() - start
+        rows.append((n_workers, n_threads, info["train_samples_per_sec"], wall))
+
+    base = rows[0][2]
+    print(f"\n{'workers':>8} {'threads':>8} {'samples/s':>12} {'speedup':>8} {'wall [s]':>9}")
+    for n_workers, n_threads, sps, wall in rows:
+        print(f"{n_workers:>8} {n_threads:>8} {sps:>12.0f} {sps / base:>8.2f} {wall:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# === bench_dgm_export.py ===
+# Latency and throughput of an exported TorchScript DGM artifact vs. the eager model.
+# usage: PYTHONPATH=. python benchmarks/bench_dgm_export.py [--model_path outputs/dgm/.../model.pt]
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from src.experiments.export_dgm import dims_from_state_dict, export_dgm
+from src.models.gravity import DeepGravityReg
+from src.utils.dgm_artifact import load_dgm_artifact
+
+
+def timed(fn, repeats):
+    fn()  # warm-up (TorchScript profiles and optimizes on the first calls)
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exported DGM artifacts against eager mode.")
+    parser.add_argument('--model_path', type=str, default=None, help="Saved DGM state_dict (default: a randomly initialized model).")
+    parser.add_argument('--input_dim', type=int, default=79, help="Input width of the random model.")
+    parser.add_argument('--batch_sizes', type=str, default="1,64,4096,65536")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state_path = args.model_path
+        if state_path is None:
+            state_path = os.path.join(tmp, "dgm_random.pt")
+            torch.save(DeepGravityReg(input_dim=args.input_dim).state_dict(), state_path)
+        state = torch.load(state_path, map_location="cpu")
+        input_dim, hidden_dims = dims_from_state_dict(state)
+
+        eager = DeepGravityReg(input_dim=input_dim, hidden_dims=hidden_dims)
+        eager.load_state_dict(state)
+        eager.eval()
+
+        artifact_file = os.path.join(tmp, "dgm.torchscript.pt")
+        export_dgm(state_path, artifact_file)
+        artifact = load_dgm_artifact(artifact_file)
+
+        print(f"[INFO] input_dim={input_dim}, hidden_dims={hidden_dims}, {torch.get_num_threads()} threads")
+        print(f"\n{'batch':>7} {'eager ms':>10} {'script ms':>10} {'eager pairs/s':>14} {'script pairs/s':>15} {'max |diff|':>11}")
+        for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+            X = np.random.rand(batch_size, input_dim).astype(np.float32)
+            X_t = torch.from_numpy(X)
+
+            def run_eager():
+                with torch.inference_mode():
+                    return eager(X_t).numpy()
+
+            def run_artifact():
+                return artifact.predict(X, batch_size=batch_size)
+
+            t_eager = timed(run_eager, args.repeats)
+            t_script = timed(run_artifact, args.repeats)
+            max_diff = float(np.max(np.abs(run_eager() - run_artifact())))
+            print(f"{batch_size:>7} {t_eager * 1e3:>10.3f} {t_script * 1e3:>10.3f} "
+                  f"{batch_size / t_eager:>14.0f} {batch_size / t_script:>15.0f} {max_diff:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
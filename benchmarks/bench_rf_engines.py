@@ -0,0 +1,62 @@
+# === bench_rf_engines.py ===
+# Fit/predict throughput and test MSE of the tree engines at several training-set sizes.
+# usage (real data):
+#   PYTHONPATH=. python benchmarks/bench_rf_engines.py --data_dir ComOD-dataset/data \
+#       --train_areas_path comod_source_target_lists/sources_seed0.txt --test_area <area_id>
+# Without --data_dir a synthetic regression problem of the same width is used.
+import argparse
+import time
+
+from sklearn.metrics import mean_squared_error
+
+from benchmarks.bench_data import add_data_args, load_bench_data
+from src.experiments.run_selective_rf import extract_xy
+from src.models.tree_engines import RF_ENGINES, BinnedForest, QuantileBinner, make_rf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RF runner's tree engines.")
+    add_data_args(parser, test_size=50000)
+    parser.add_argument('--sizes', type=str, default="5000,20000,50000,200000")
+    parser.add_argument('--engines', type=str, default=",".join(RF_ENGINES))
+    parser.add_argument('--rf_max_bins', type=int, default=255)
+    parser.add_argument('--rf_max_samples', type=float, default=0.5)
+    parser.add_argument('--rf_max_depth', type=int, default=20)
+    parser.add_argument('--rf_n_jobs', type=int, default=-1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.sizes.split(",")]
+    engines = args.engines.split(",")
+    X_all, y_all, X_test, y_test = load_bench_data(args, max(sizes), extract_xy)
+
+    print(f"\n{'samples':>8} {'engine':>8} {'bin s':>7} {'fit s':>8} {'fit/s':>10} {'predict/s':>11} "
+          f"{'MSE':>12} {'fit speedup':>12}")
+    for n in sizes:
+        X_train, y_train = X_all[:n], y_all[:n]
+        base_fit = None
+        for engine in engines:
+            bin_s = 0.0
+            start = time.perf_counter()
+            if engine == "rf_hist":
+                binner = QuantileBinner(max_bins=args.rf_max_bins, seed=args.seed).fit(X_train)
+                X_fit = binner.transform(X_train)
+                bin_s = time.perf_counter() - start
+                model = BinnedForest(binner, make_rf(engine, args))
+            else:
+                model, X_fit = make_rf(engine, args), X_train
+            model.fit(X_fit, y_train)
+            fit_s = time.perf_counter() - start
+            start = time.perf_counter()
+            pred = model.predict(X_test)
+            predict_s = time.perf_counter() - start
+            mse = mean_squared_error(y_test, pred)
+            if engine == "rf":
+                base_fit = fit_s
+            speedup = f"{base_fit / fit_s:.2f}" if base_fit else "-"
+            print(f"{n:>8} {engine:>8} {bin_s:>7.2f} {fit_s:>8.2f} {n / fit_s:>10.0f} {len(X_test) / predict_s:>11.0f} "
+                  f"{mse:>12.4f} {speedup:>12}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# === bench_svr_engines.py ===
+# Fit time, predict time and test MSE of the SVR engines at several training-set sizes.
+# usage (real data):
+#   PYTHONPATH=. python benchmarks/bench_svr_engines.py --data_dir ComOD-dataset/data \
+#       --train_areas_path comod_source_target_lists/sources_seed0.txt --test_area <area_id>
+# Without --data_dir a synthetic regression problem of the same width is used.
+import argparse
+import time
+
+from sklearn.metrics import mean_squared_error
+
+from benchmarks.bench_data import add_data_args, load_bench_data
+from src.experiments.run_selective_svr import extract_xy
+from src.models.svr_engines import SVR_ENGINES, make_svr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact and approximate SVR engines.")
+    add_data_args(parser, test_size=20000)
+    parser.add_argument('--sizes', type=str, default="1000,5000,20000,50000")
+    parser.add_argument('--engines', type=str, default=",".join(SVR_ENGINES))
+    parser.add_argument('--components', type=int, default=1000)
+    parser.add_argument('--exact_max', type=int, default=50000, help="Skip the exact engine above this many samples.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.sizes.split(",")]
+    engines = args.engines.split(",")
+    X_all, y_all, X_test, y_test = load_bench_data(args, max(sizes), extract_xy)
+
+    print(f"\n{'samples':>8} {'engine':>9} {'fit s':>9} {'predict s':>10} {'MSE':>12} {'MSE / exact':>12}")
+    for n in sizes:
+        X_train, y_train = X_all[:n], y_all[:n]
+        exact_mse = None
+        for engine in engines:
+            if engine == "exact" and n > args.exact_max:
+                print(f"{n:>8} {engine:>9} {'skipped':>9}")
+                continue
+            model = make_svr(engine, X_train, n_components=args.components, seed=args.seed)
+            start = time.perf_counter()
+            model.fit(X_train, y_train)
+            fit_s = time.perf_counter() - start
+            start = time.perf_counter()
+            pred = model.predict(X_test)
+            predict_s = time.perf_counter() - start
+            mse = mean_squared_error(y_test, pred)
+            if engine == "exact":
+                exact_mse = mse
+            ratio = f"{mse / exact_mse:.3f}" if exact_mse else "-"
+            print(f"{n:>8} {engine:>9} {fit_s:>9.2f} {predict_s:>10.2f} {mse:>12.4f} {ratio:>12}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
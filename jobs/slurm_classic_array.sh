@@ -4,7 +4,9 @@
 #SBATCH --cpus-per-task=8
 #SBATCH --mem=40G
 #SBATCH --time=40:00:00
-#SBATCH --array=0-9
+#SBATCH --array=0-9 # seed(10) (× N_SHARDS)
+# Target sharding: N_SHARDS=4 sbatch --array=0-39 jobs/slurm_classic_array.sh
+# then merge with: python src/experiments/merge_shards.py --model svr
 
 # Resolve project paths regardless of submission directory.
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -18,20 +20,36 @@ for seed in "${SEEDS[@]}"; do
     PARAMS+=("all 0 ${seed}")  # alpha is unused for the all condition
 done
 
-# Map the task ID to a parameter set.
-read PARAM_COND PARAM_ALPHA PARAM_SEED <<< "${PARAMS[$SLURM_ARRAY_TASK_ID]}"
+# Each configuration is split into N_SHARDS target shards (1 = no sharding).
+N_SHARDS="${N_SHARDS:-1}"
+
+# Map the task ID to a parameter set and a shard.
+PARAM_IDX=$(( SLURM_ARRAY_TASK_ID / N_SHARDS ))
+SHARD_IDX=$(( SLURM_ARRAY_TASK_ID % N_SHARDS ))
+read PARAM_COND PARAM_ALPHA PARAM_SEED <<< "${PARAMS[$PARAM_IDX]}"
+
+SHARD_ARGS=()
+SHARD_TAG=""
+if [ "${N_SHARDS}" -gt 1 ]; then
+    SHARD_ARGS=(--shard "${SHARD_IDX}/${N_SHARDS}")
+    # Every task of the array shares the run id, so reruns never mix with these shards.
+    if [ -n "${SLURM_ARRAY_JOB_ID:-}" ]; then
+        SHARD_ARGS+=(--run_id "${SLURM_ARRAY_JOB_ID}")
+    fi
+    SHARD_TAG="_shard${SHARD_IDX}of${N_SHARDS}"
+fi
 
 # Logging configuration.
 LOG_DIR="${PROJECT_ROOT}/logs/svr_all_exp/${PARAM_COND}"
 mkdir -p "${LOG_DIR}"
-export OUT_FILE="${LOG_DIR}/${SLURM_JOB_ID}_seed${PARAM_SEED}.out"
-export ERR_FILE="${LOG_DIR}/${SLURM_JOB_ID}_seed${PARAM_SEED}.err"
+export OUT_FILE="${LOG_DIR}/${SLURM_JOB_ID}_seed${PARAM_SEED}${SHARD_TAG}.out"
+export ERR_FILE="${LOG_DIR}/${SLURM_JOB_ID}_seed${PARAM_SEED}${SHARD_TAG}.err"
 exec > "${OUT_FILE}" 2> "${ERR_FILE}"
 
 echo "--- SVR 'all' condition experiment ---"
 echo "Job ID: ${SLURM_JOB_ID}, Array Task ID: ${SLURM_ARRAY_TASK_ID}"
 echo "Timestamp: $(date)"
-echo "Parameters: condition=${PARAM_COND}, alpha=${PARAM_ALPHA} (dummy), seed=${PARAM_SEED}"
+echo "Parameters: condition=${PARAM_COND}, alpha=${PARAM_ALPHA} (dummy), seed=${PARAM_SEED}, shard=${SHARD_IDX}/${N_SHARDS}"
 echo "----------------------"
 
 # Paths can be overridden via environment variables to keep the script anonymized.
@@ -64,7 +82,8 @@ PYTHONPATH="${PROJECT_ROOT}" "${PYTHON_BIN}" src/experiments/run_selective_svr.p
     --condition "${PARAM_COND}" \
     --alpha "${PARAM_ALPHA}" \
     --seed "${PARAM_SEED}" \
-    --max_samples 50000
+    --max_samples 50000 \
+    "${SHARD_ARGS[@]}"
 
 echo "--- Job Finished ---"
 echo "Timestamp: $(date)"
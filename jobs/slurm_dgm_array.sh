@@ -5,7 +5,9 @@
 #SBATCH --cpus-per-task=8
 #SBATCH --mem=40G
 #SBATCH --time=3-00:00:00
-#SBATCH --array=0-79 # topk/bottomk × alpha × seed(10) + all + random
+#SBATCH --array=0-79 # topk/bottomk × alpha × seed(10) + all + random (× N_SHARDS)
+# Target sharding: N_SHARDS=8 sbatch --array=0-639 jobs/slurm_dgm_array.sh
+# then merge with: python src/experiments/merge_shards.py --model dgm
 
 # Resolve project paths regardless of submission directory.
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -31,26 +33,43 @@ for seed in "${SEEDS[@]}"; do
     PARAMS+=("random 0 ${seed}")
 done
 
-# Map the task ID to a parameter set.
+# Each configuration is split into N_SHARDS target shards (1 = no sharding).
+N_SHARDS="${N_SHARDS:-1}"
+N_TASKS=$(( ${#PARAMS[@]} * N_SHARDS ))
+
+# Map the task ID to a parameter set and a shard.
 TASK_ID="${SLURM_ARRAY_TASK_ID:-0}"
-if [ "${TASK_ID}" -lt 0 ] || [ "${TASK_ID}" -ge "${#PARAMS[@]}" ]; then
-    echo "[ERROR] TASK_ID ${TASK_ID} is out of range (0-$(( ${#PARAMS[@]} - 1 )))." >&2
+if [ "${TASK_ID}" -lt 0 ] || [ "${TASK_ID}" -ge "${N_TASKS}" ]; then
+    echo "[ERROR] TASK_ID ${TASK_ID} is out of range (0-$(( N_TASKS - 1 )))." >&2
     exit 1
 fi
-read PARAM_COND PARAM_ALPHA PARAM_SEED <<< "${PARAMS[$TASK_ID]}"
+PARAM_IDX=$(( TASK_ID / N_SHARDS ))
+SHARD_IDX=$(( TASK_ID % N_SHARDS ))
+read PARAM_COND PARAM_ALPHA PARAM_SEED <<< "${PARAMS[$PARAM_IDX]}"
 JOB_ID="${SLURM_JOB_ID:-manual}"
 
+SHARD_ARGS=()
+SHARD_TAG=""
+if [ "${N_SHARDS}" -gt 1 ]; then
+    SHARD_ARGS=(--shard "${SHARD_IDX}/${N_SHARDS}")
+    # Every task of the array shares the run id, so reruns never mix with these shards.
+    if [ -n "${SLURM_ARRAY_JOB_ID:-}" ]; then
+        SHARD_ARGS+=(--run_id "${SLURM_ARRAY_JOB_ID}")
+    fi
+    SHARD_TAG="_shard${SHARD_IDX}of${N_SHARDS}"
+fi
+
 # Logging configuration.
 LOG_DIR="${PROJECT_ROOT}/logs/dgm_unified/${PARAM_COND}/alpha${PARAM_ALPHA}"
 mkdir -p "${LOG_DIR}"
-export OUT_FILE="${LOG_DIR}/${JOB_ID}_seed${PARAM_SEED}.out"
-export ERR_FILE="${LOG_DIR}/${JOB_ID}_seed${PARAM_SEED}.err"
+export OUT_FILE="${LOG_DIR}/${JOB_ID}_seed${PARAM_SEED}${SHARD_TAG}.out"
+export ERR_FILE="${LOG_DIR}/${JOB_ID}_seed${PARAM_SEED}${SHARD_TAG}.err"
 exec > "${OUT_FILE}" 2> "${ERR_FILE}"
 
 echo "--- DGM Unified Experiment ---"
 echo "Job ID: ${JOB_ID}, Array Task ID: ${TASK_ID}"
 echo "Timestamp: $(date)"
-echo "Parameters: condition=${PARAM_COND}, alpha=${PARAM_ALPHA}, seed=${PARAM_SEED}"
+echo "Parameters: condition=${PARAM_COND}, alpha=${PARAM_ALPHA}, seed=${PARAM_SEED}, shard=${SHARD_IDX}/${N_SHARDS}"
 echo "----------------------"
 
 # Paths can be overridden via environment variables to keep the script anonymized.
@@ -86,7 +105,8 @@ PYTHONPATH="${PROJECT_ROOT}" "${PYTHON_BIN}" src/experiments/run_selective_dgm.p
     --epochs 20 \
     --max_samples 50000 \
     --lr 0.001 \
-    --batch_size 32
+    --batch_size 32 \
+    "${SHARD_ARGS[@]}"
 
 echo "--- Job Finished ---"
 echo "Timestamp: $(date)"
@@ -0,0 +1,158 @@
+# === export_dgm.py ===
+# Export saved DGM state dicts as self-describing TorchScript artifacts.
+import argparse
+import datetime
+import glob
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src.models.gravity import DeepGravityReg
+from src.utils.dgm_artifact import ARTIFACT_SUFFIX, DGMArtifact, FORMAT_VERSION, SCHEMA_FILE
+
+
+class NormalizedDGM(nn.Module):
+    """
+        DeepGravityReg preceded by a fixed affine feature normalization,
+        (x - feature_mean) / feature_scale. Identity by default, which matches
+        models trained on raw features.
+    """
+    def __init__(self, model, feature_mean, feature_scale):
+        super().__init__()
+        self.model = model
+        self.register_buffer("feature_mean", feature_mean)
+        self.register_buffer("feature_scale", feature_scale)
+
+    def forward(self, x):
+        return self.model((x - self.feature_mean) / self.feature_scale)
+
+
+def dims_from_state_dict(state):
+    """Recover (input_dim, hidden_dims) of a DeepGravityReg state dict."""
+    hidden_dims = []
+    layer = 0
+    while f"feature_extractor.{layer}.weight" in state:
+        hidden_dims.append(state[f"feature_extractor.{layer}.weight"].shape[0])
+        layer += 2
+    input_dim = state["feature_extractor.0.weight"].shape[1]
+    return input_dim, hidden_dims
+
+
+def load_normalization(path, input_dim):
+    """Read feature mean/scale from an .npz with 'mean' and 'scale', or return the identity."""
+    if path is None:
+        return torch.zeros(input_dim), torch.ones(input_dim), "identity"
+    stats = np.load(path)
+    mean = torch.as_tensor(stats["mean"], dtype=torch.float32).reshape(-1)
+    scale = torch.as_tensor(stats["scale"], dtype=torch.float32).reshape(-1)
+    if mean.numel() != input_dim or scale.numel() != input_dim:
+        raise ValueError(f"Normalization in {path} has {mean.numel()} features, model expects {input_dim}.")
+    return mean, scale, "standard"
+
+
+def export_dgm(state_path, output_path, normalization_path=None):
+    """
+    Script one saved DeepGravityReg together with its normalization and schema.
+    :return: the schema dict embedded in the artifact
+    """
+    state = torch.load(state_path, map_location="cpu")
+    input_dim, hidden_dims = dims_from_state_dict(state)
+    model = DeepGravityReg(input_dim=input_dim, hidden_dims=hidden_dims)
+    model.load_state_dict(state)
+    model.eval()
+
+    mean, scale, norm_kind = load_normalization(normalization_path, input_dim)
+    with warnings.catch_warnings():
+        # torch.jit is flagged as deprecated in recent releases but remains the
+        # only offline export format that loads without the model classes.
+        warnings.simplefilter("ignore", FutureWarning)
+        scripted = torch.jit.script(NormalizedDGM(model, mean, scale))
+
+    n_node_features = (input_dim - 1) // 2
+    schema = {
+        "format_version": FORMAT_VERSION,
+        "model": "DeepGravityReg",
+        "input_dim": input_dim,
+        "hidden_dims": hidden_dims,
+        "n_node_features": n_node_features,
+        "feature_layout": [
+            {"name": "feat_o", "start": 0, "stop": n_node_features},
+            {"name": "feat_d", "start": n_node_features, "stop": 2 * n_node_features},
+            {"name": "dis", "start": 2 * n_node_features, "stop": input_dim},
+        ],
+        "normalization": norm_kind,
+        "output": "flow",
+        "source": os.path.abspath(state_path),
+        "torch_version": torch.__version__,
+        "exported_at": datetime.datetime.now().isoformat(),
+    }
+    tmp_path = output_path + ".tmp"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        torch.jit.save(scripted, tmp_path, _extra_files={SCHEMA_FILE: json.dumps(schema)})
+    os.replace(tmp_path, output_path)
+    return schema
+
+
+def artifact_path(state_path, output_dir=None):
+    stem = os.path.basename(state_path)
+    if stem.endswith(".pt"):
+        stem = stem[:-3]
+    return os.path.join(output_dir or os.path.dirname(state_path), stem + ARTIFACT_SUFFIX)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export saved DGM models as TorchScript artifacts")
+    parser.add_argument('--model_path', type=str, required=True, help="A saved DGM state_dict (.pt) or a directory searched recursively for them.")
+    parser.add_argument('--output_dir', type=str, default=None, help="Where to write artifacts (default: next to each model).")
+    parser.add_argument('--normalization', type=str, default=None, help="Optional .npz with 'mean' and 'scale' arrays of the input features.")
+    parser.add_argument('--verify_samples', type=int, default=1024, help="Random inputs used to check the artifact against eager mode (0 disables).")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.model_path):
+        state_paths = sorted(
+            p for p in glob.glob(os.path.join(args.model_path, "**", "*.pt"), recursive=True)
+            if not p.endswith(ARTIFACT_SUFFIX)
+        )
+    else:
+        state_paths = [args.model_path]
+    if not state_paths:
+        print(f"[ERROR] No DGM models found under {args.model_path}.", file=sys.stderr, flush=True)
+        sys.exit(1)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    n_failed = 0
+    for state_path in state_paths:
+        out_path = artifact_path(state_path, args.output_dir)
+        try:
+            schema = export_dgm(state_path, out_path, args.normalization)
+            if args.verify_samples:
+                x = torch.rand(args.verify_samples, schema["input_dim"])
+                model = DeepGravityReg(input_dim=schema["input_dim"], hidden_dims=schema["hidden_dims"])
+                model.load_state_dict(torch.load(state_path, map_location="cpu"))
+                model.eval()
+                mean, scale, _ = load_normalization(args.normalization, schema["input_dim"])
+                with torch.no_grad():
+                    expected = model((x - mean) / scale).numpy()
+                got = DGMArtifact(out_path).predict(x.numpy())
+                max_err = float(np.max(np.abs(got - expected)))
+                if max_err > 1e-4:
+                    raise RuntimeError(f"artifact deviates from eager model (max abs error {max_err:.2e})")
+            print(f"[INFO] Exported {state_path} -> {out_path}", flush=True)
+        except Exception as e:
+            n_failed += 1
+            print(f"[ERROR] Failed to export {state_path}: {e}", file=sys.stderr, flush=True)
+
+    print(f"[INFO] Exported {len(state_paths) - n_failed}/{len(state_paths)} models.", flush=True)
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
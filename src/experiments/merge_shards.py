@@ -0,0 +1,146 @@
+"""
+Merge target-sharded runner outputs into the standard result layout.
+
+Runners started with --shard i/n write partial results to
+    results/<model>/shards/<condition>/alpha<alpha>/seed<seed>/<stem>.run<run_id>.shardIIIofNNN.json
+where the run id (--run_id, or a digest of the run's other arguments) keeps runs and
+configurations that share a stem apart. Before merging, every shard's metadata is checked
+against shard 0; groups mixing runs are reported and not merged.
+This script combines every complete group of shards into
+    results/<model>/raw/<condition>/alpha<alpha>/seed<seed>/<merged_filename>
+which holds the same per-target results an unsharded run would have written (every
+shard selects sources from the full target list), so the aggregation scripts under
+analysis/ consume it unchanged. DGM results match only up to training randomness: torch
+is seeded once per process, so a target's initialisation depends on the targets trained
+before it. benchmarks/check_shard_merge.py verifies the equality for rf, svr and gravity.
+
+Example:
+    PYTHONPATH=$(pwd) python src/experiments/merge_shards.py --results_dir results --model dgm
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+
+from src.utils.sharding import SHARD_FILE_RE, SHARD_LOCAL_KEYS, interleave_shard_results
+
+
+def find_shard_groups(shards_root):
+    """Group shard files by (directory, stem, shard count)."""
+    groups = defaultdict(dict)
+    for path in glob.glob(os.path.join(shards_root, "**", "*.json"), recursive=True):
+        match = SHARD_FILE_RE.match(os.path.basename(path))
+        if not match:
+            continue
+        key = (os.path.dirname(path), match.group("stem"), int(match.group("count")))
+        groups[key][int(match.group("index"))] = path
+    return groups
+
+
+def check_group(shards, paths_by_index):
+    """
+    Raise ValueError unless every shard comes from the same run as shard 0: same
+    metadata apart from SHARD_LOCAL_KEYS, and the same merged file name.
+    """
+    def run_config(shard):
+        return {k: v for k, v in shard.get("metadata", {}).items() if k not in SHARD_LOCAL_KEYS}
+
+    config, merged_filename = run_config(shards[0]), shards[0]["shard"]["merged_filename"]
+    for index, shard in enumerate(shards[1:], start=1):
+        changed = sorted(k for k in set(config) | set(run_config(shard))
+                         if config.get(k) != run_config(shard).get(k))
+        if shard["shard"]["merged_filename"] != merged_filename:
+            changed.append("merged_filename")
+        if changed:
+            raise ValueError(f"{paths_by_index[index]} does not belong to the run of "
+                             f"{paths_by_index[0]} (differs in {', '.join(changed)}).")
+
+
+def merge_group(paths_by_index, count):
+    """Load the shards of one configuration and return the merged JSON object."""
+    shards = []
+    for index in range(count):
+        with open(paths_by_index[index], "r", encoding="utf-8") as f:
+            shards.append(json.load(f))
+    check_group(shards, paths_by_index)
+
+    merged = dict(shards[0])
+    merged.pop("shard", None)
+    merged["results"] = interleave_shard_results([s.get("results", []) for s in shards])
+
+    metadata = dict(merged.get("metadata", {}))
+    metadata["shard"] = None
+    metadata["merged_shards"] = count
+    # Keep the latest execution time wherever the runner records it.
+    if "execution_datetime" in metadata:
+        metadata["execution_datetime"] = max(s["metadata"]["execution_datetime"] for s in shards)
+    if "execution_datetime" in merged:
+        merged["execution_datetime"] = max(s["execution_datetime"] for s in shards)
+    merged["metadata"] = metadata
+
+    return merged, shards[0]["shard"]["merged_filename"]
+
+
+def merge_shards(results_dir, model, allow_partial=False, remove_shards=False):
+    """
+    Merge every complete shard group under results/<model>/shards into results/<model>/raw.
+    Groups whose shards come from different runs are reported and never merged.
+    Returns (written output paths, incomplete group prefixes, conflicting group prefixes).
+    """
+    shards_root = os.path.join(results_dir, model, "shards")
+    raw_root = os.path.join(results_dir, model, "raw")
+    groups = find_shard_groups(shards_root)
+
+    if not groups:
+        print(f"[WARN] No shard files found under '{shards_root}'.")
+        return [], [], []
+
+    written, incomplete, conflicting = [], [], []
+    for (shard_dir, stem, count), paths_by_index in sorted(groups.items()):
+        missing = [i for i in range(count) if i not in paths_by_index]
+        if missing:
+            level = "WARN" if allow_partial else "ERROR"
+            print(f"[{level}] {shard_dir}/{stem}: missing shard(s) {missing} of {count}. Skipping.",
+                  file=sys.stderr, flush=True)
+            incomplete.append(os.path.join(shard_dir, stem))
+            continue
+
+        try:
+            merged, merged_filename = merge_group(paths_by_index, count)
+        except ValueError as e:
+            print(f"[ERROR] {shard_dir}/{stem}: {e} Skipping.", file=sys.stderr, flush=True)
+            conflicting.append(os.path.join(shard_dir, stem))
+            continue
+        out_dir = os.path.join(raw_root, os.path.relpath(shard_dir, shards_root))
+        os.makedirs(out_dir, exist_ok=True)
+        output_path = os.path.join(out_dir, merged_filename)
+        with open(output_path, "w") as f:
+            json.dump(merged, f, indent=4)
+        print(f"[INFO] Merged {count} shards ({len(merged['results'])} targets) -> {output_path}")
+        written.append(output_path)
+
+        if remove_shards:
+            for path in paths_by_index.values():
+                os.remove(path)
+
+    return written, incomplete, conflicting
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge target-sharded results into results/<model>/raw.")
+    parser.add_argument('--results_dir', type=str, default='results', help="Root results directory.")
+    parser.add_argument('--model', type=str, required=True, help="Model name, e.g. dgm, rf or svr.")
+    parser.add_argument('--allow_partial', action='store_true', help="Do not fail when some shard groups are incomplete.")
+    parser.add_argument('--remove_shards', action='store_true', help="Delete shard files once they are merged.")
+    args = parser.parse_args()
+
+    written, incomplete, conflicting = merge_shards(args.results_dir, args.model, args.allow_partial, args.remove_shards)
+    print(f"[INFO] Wrote {len(written)} merged result file(s).")
+    if conflicting or (incomplete and not args.allow_partial):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
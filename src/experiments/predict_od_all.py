@@ -0,0 +1,267 @@
+# === predict_od_all.py ===
+# Generate full predicted OD matrices for every area from one saved model.
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from src.experiments.export_dgm import dims_from_state_dict
+from src.models.gravity import DeepGravityReg
+from src.utils.dataset import iter_pair_feature_blocks, load_area_features
+from src.utils.dgm_artifact import ARTIFACT_SUFFIX, load_dgm_artifact
+from src.utils.model_store import REF_SUFFIX, load_model
+
+MANIFEST_FILE = "manifest.jsonl"
+RUN_INFO_FILE = "run_info.json"
+
+# Set once per worker process by init_worker().
+_PREDICTOR = None
+
+
+def infer_model_type(model_path):
+    if model_path.endswith(ARTIFACT_SUFFIX):
+        return "dgm_artifact"
+    if model_path.endswith(".pt"):
+        return "dgm"
+    if model_path.endswith(".joblib") or model_path.endswith(REF_SUFFIX):
+        return "sklearn"
+    raise ValueError(f"Cannot infer the model type of {model_path}; pass --model_type.")
+
+
+def load_predictor(model_path, model_type, n_threads):
+    """
+    Load a saved model and return predict(feat, dis, chunk_pairs), which yields
+    (row_start, (rows, N) float32 predictions) over the origin rows of one area.
+    """
+    torch.set_num_threads(n_threads)
+
+    if model_type == "dgm":
+        # Factorized path: per-node first-layer projections, no pair features at all.
+        state = torch.load(model_path, map_location="cpu")
+        input_dim, hidden_dims = dims_from_state_dict(state)
+        model = DeepGravityReg(input_dim=input_dim, hidden_dims=hidden_dims)
+        model.load_state_dict(state)
+        model.eval()
+
+        def predict(feat, dis, chunk_pairs):
+            rows = max(1, chunk_pairs // len(feat))
+            with torch.no_grad():
+                feat_t, dis_t = torch.from_numpy(feat), torch.from_numpy(dis)
+                for start, block in model.iter_od_blocks(feat_t, dis_t, rows):
+                    yield start, block.numpy()
+        return predict
+
+    if model_type == "dgm_artifact":
+        model = load_dgm_artifact(model_path)
+    elif model_type == "sklearn":
+        model = load_model(model_path) if model_path.endswith(REF_SUFFIX) else joblib.load(model_path)
+        if hasattr(model, "n_jobs"):
+            model.n_jobs = n_threads
+    else:
+        raise ValueError(f"Unknown model type {model_type!r}.")
+
+    def predict(feat, dis, chunk_pairs):
+        N = len(feat)
+        rows = max(1, chunk_pairs // N)
+        for start, X in iter_pair_feature_blocks(feat, dis, rows):
+            yield start, np.asarray(model.predict(X), dtype=np.float32).reshape(-1, N)
+    return predict
+
+
+def init_worker(model_path, model_type, n_threads):
+    global _PREDICTOR
+    _PREDICTOR = load_predictor(model_path, model_type, n_threads)
+
+
+def output_path(output_dir, area, fmt):
+    return os.path.join(output_dir, f"{area}.{fmt}")
+
+
+def predict_area(area, data_dir, output_dir, fmt, chunk_pairs):
+    """
+    Predict one area's OD matrix and write it atomically.
+    :return: manifest record for the area
+    """
+    start_time = time.perf_counter()
+    try:
+        feat, dis, _ = load_area_features(data_dir, area)
+        N = len(feat)
+        final_path = output_path(output_dir, area, fmt)
+        # The temporary name keeps the extension so numpy does not append another one.
+        tmp_path = os.path.join(output_dir, f".{area}.tmp.{fmt}")
+
+        if fmt == "npy":
+            # Written block by block into a memory map: memory stays at one chunk.
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(N, N))
+        else:
+            out = np.empty((N, N), dtype=np.float32)
+        for row_start, block in _PREDICTOR(feat, dis, chunk_pairs):
+            out[row_start:row_start + len(block)] = block
+        pred_sum = float(out.sum(dtype=np.float64))
+
+        if fmt == "npy":
+            out.flush()
+            del out
+        else:
+            np.savez_compressed(tmp_path, od_pred=out)
+        os.replace(tmp_path, final_path)
+
+        return {
+            "area": area, "status": "done", "file": os.path.basename(final_path),
+            "shape": [N, N], "pred_sum": pred_sum,
+            "seconds": round(time.perf_counter() - start_time, 3),
+        }
+    except Exception as e:
+        return {
+            "area": area, "status": "error", "error_message": str(e),
+            "seconds": round(time.perf_counter() - start_time, 3),
+        }
+
+
+def read_manifest(output_dir):
+    """Latest manifest record per area."""
+    records = {}
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run.
+                continue
+            records[record["area"]] = record
+    return records
+
+
+def file_sha256(path, chunk_bytes=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def check_resume(output_dir, run_info):
+    """
+    Raise ValueError if output_dir holds predictions of a different model or settings.
+    Older run_info.json files without model_sha256 are compared by model path.
+    """
+    path = os.path.join(output_dir, RUN_INFO_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        previous = json.load(f)
+    keys = ["model_type", "format"] + (["model_sha256"] if "model_sha256" in previous else ["model_path"])
+    changed = [k for k in keys if previous.get(k) != run_info[k]]
+    if changed:
+        details = ", ".join(f"{k}: {previous.get(k)!r} -> {run_info[k]!r}" for k in changed)
+        raise ValueError(f"{output_dir} holds predictions of another run ({details}). "
+                         f"Use a new --output_dir, or pass --restart to predict every area again.")
+
+
+def list_areas(data_dir, areas_path=None):
+    if areas_path:
+        with open(areas_path) as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(
+        name for name in os.listdir(data_dir)
+        if os.path.isfile(os.path.join(data_dir, name, "dis.npy"))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict full OD matrices for every area from a saved model")
+    parser.add_argument('--model_path', type=str, required=True, help="Saved DGM state_dict (.pt), exported DGM artifact (.torchscript.pt) or RF/SVR model (.joblib, or .ref.json from a model store).")
+    parser.add_argument('--model_type', type=str, default=None, choices=['dgm', 'dgm_artifact', 'sklearn'], help="Defaults to the type implied by the file extension.")
+    parser.add_argument('--data_dir', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--areas_path', type=str, default=None, help="Optional list of area ids (default: every area under data_dir).")
+    parser.add_argument('--format', type=str, default='npy', choices=['npy', 'npz'], help="npy: memory-mappable float32 matrix; npz: compressed (key 'od_pred').")
+    parser.add_argument('--chunk_pairs', type=int, default=262144, help="OD pairs per prediction chunk (whole origin rows).")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes; each loads the model once.")
+    parser.add_argument('--threads_per_worker', type=int, default=1)
+    parser.add_argument('--retry_errors', action='store_true', help="Also redo areas that failed in a previous run.")
+    parser.add_argument('--restart', action='store_true', help="Ignore the manifest of a previous run in --output_dir and predict every area again.")
+    args = parser.parse_args()
+
+    model_type = args.model_type or infer_model_type(args.model_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    run_info = {
+        "model_path": os.path.abspath(args.model_path), "model_sha256": file_sha256(args.model_path),
+        "model_type": model_type, "data_dir": os.path.abspath(args.data_dir), "format": args.format,
+        "execution_datetime": datetime.datetime.now().isoformat(),
+    }
+
+    # --- Resume: skip areas whose output is already recorded and present ---
+    # Only outputs of the same model file and settings are reused.
+    if args.restart:
+        open(os.path.join(args.output_dir, MANIFEST_FILE), "w").close()
+    else:
+        try:
+            check_resume(args.output_dir, run_info)
+        except ValueError as e:
+            parser.error(str(e))
+    areas = list_areas(args.data_dir, args.areas_path)
+    previous = read_manifest(args.output_dir)
+    todo = []
+    for area in areas:
+        record = previous.get(area)
+        if record and record["status"] == "done" and os.path.exists(os.path.join(args.output_dir, record["file"])):
+            continue
+        if record and record["status"] == "error" and not args.retry_errors:
+            continue
+        todo.append(area)
+    print(f"[INFO] {len(areas)} areas, {len(areas) - len(todo)} already processed, {len(todo)} to do.", flush=True)
+
+    with open(os.path.join(args.output_dir, RUN_INFO_FILE), "w") as f:
+        json.dump(run_info, f, indent=4)
+
+    n_errors = 0
+    with open(os.path.join(args.output_dir, MANIFEST_FILE), "a") as manifest:
+        def record(result):
+            nonlocal n_errors
+            if result["status"] != "done":
+                n_errors += 1
+                print(f"[ERROR] {result['area']}: {result['error_message']}", file=sys.stderr, flush=True)
+            manifest.write(json.dumps(result) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+        task_args = (args.data_dir, args.output_dir, args.format, args.chunk_pairs)
+        if args.workers <= 1:
+            init_worker(args.model_path, model_type, args.threads_per_worker)
+            for area in tqdm(todo, desc="Predicting areas"):
+                record(predict_area(area, *task_args))
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(
+                max_workers=args.workers, mp_context=ctx, initializer=init_worker,
+                initargs=(args.model_path, model_type, args.threads_per_worker)
+            ) as pool:
+                futures = [pool.submit(predict_area, area, *task_args) for area in todo]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Predicting areas"):
+                    record(future.result())
+
+    print(f"[INFO] Finished: {len(todo) - n_errors} written, {n_errors} failed. Manifest: "
+          f"{os.path.join(args.output_dir, MANIFEST_FILE)}", flush=True)
+    if n_errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,27 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 from torch.utils.data import DataLoader, TensorDataset
-from sklearn.metrics import mean_squared_error
-from src.utils.dataset import CommutingODPairDataset
+from src.utils.dataset import CommutingODPairDataset, load_area_features
+from src.utils.eval_sampling import eval_sample_suffix, load_sampled_test_set
+from src.utils.metrics_torch import od_metrics_from_pairs_torch
+from src.utils.streaming_metrics import ODMetricsAccumulator
+from src.models.ensemble import DeepGravityEnsemble, MemberAdam
 from src.models.gravity import DeepGravityReg
+from src.utils.batching import TensorBatchIterator
+from src.utils.distributed import train_dgm_ddp
+from src.utils.planning import plan_sweep
+from src.utils.precision import PRECISIONS, autocast
+from src.utils.selection import build_id_index, build_selection_table, source_indices
+from src.utils.shared_arrays import as_tensor
+from src.utils.sharding import parse_shard, shard_filename, shard_run_id, shard_targets
+from src.utils.train_cache import TrainingSetCache, load_training_set
 from tqdm import tqdm
 import random
 import os
 import sys
 import datetime
 import json
+import time
 
 
 def load_fgw_distances(fgw_dir, alpha):
@@ -89,68 +101,473 @@ def extract_xy(data_dir, areas, max_samples=None, seed=42):
     return X, y
 
 
-def train_and_evaluate_dgm(X_train, y_train, X_test, y_test, target_id, args):
-    """Train the Deep Gravity Model and evaluate it on the target city."""
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"    [INFO] Using device: {device}", flush=True)
+def compile_for_training(model, example_batch):
+    """
+    Wrap the model with torch.compile and run one forward pass to trigger compilation.
+    Falls back to the eager model when no compiler backend is usable.
+    """
+    try:
+        compiled = torch.compile(model)
+        compiled(example_batch)
+        print("    [INFO] Training with torch.compile.", flush=True)
+        return compiled
+    except Exception as e:
+        print(f"    [WARN] torch.compile unavailable ({e}). Using eager mode.", flush=True)
+        return model
+
 
-    X_train_tensor = torch.from_numpy(X_train).float()
-    y_train_tensor = torch.from_numpy(y_train).float()
-    X_test_tensor = torch.from_numpy(X_test).float()
+def split_validation(X, y, val_fraction, seed=42):
+    """
+    Hold out a random val_fraction of the training set.
+    Returns (X_train, y_train, X_val, y_val); X_val and y_val are None when no
+    validation split is requested or the set is too small to spare one.
+    """
+    n_val = int(len(X) * val_fraction)
+    if val_fraction <= 0 or n_val == 0 or n_val >= len(X):
+        return X, y, None, None
+    perm = np.random.RandomState(seed).permutation(len(X))
+    val_idx, train_idx = np.sort(perm[:n_val]), np.sort(perm[n_val:])
+    return X[train_idx], y[train_idx], X[val_idx], y[val_idx]
+
+
+def train_dgm_distributed(X_train, y_train, X_val, y_val, args, device):
+    """Train with DistributedDataParallel over --ddp_workers local CPU processes."""
+    print(f"    [Train] Starting data-parallel DGM training on {args.ddp_workers} CPU workers "
+          f"for {args.epochs} epochs...", flush=True)
+    config = {
+        "epochs": args.epochs, "batch_size": args.batch_size, "lr": args.lr, "seed": args.seed,
+        "patience": args.patience, "min_delta": args.min_delta, "eval_chunk_size": args.eval_chunk_size,
+        "precision": args.precision,
+    }
+    state, train_info = train_dgm_ddp(
+        as_tensor(X_train).float(), as_tensor(y_train).float(),
+        as_tensor(X_val).float() if X_val is not None else None,
+        as_tensor(y_val).float() if y_val is not None else None,
+        config, args.ddp_workers
+    )
+    model = DeepGravityReg(input_dim=X_train.shape[1])
+    model.load_state_dict(state)
+    return model.to(device), train_info
 
-    train_dataset = TensorDataset(X_train_tensor, y_train_tensor)
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+
+def train_dgm(X_train, y_train, args, device):
+    """
+    Train one Deep Gravity Model. Returns (model, train_info).
+    With --val_fraction a held-out split is scored after every epoch; training stops
+    once it has not improved by --min_delta for --patience epochs and the best
+    checkpoint is restored.
+    """
+    X_train, y_train, X_val, y_val = split_validation(X_train, y_train, args.val_fraction, args.seed)
+    if args.ddp_workers > 1:
+        return train_dgm_distributed(X_train, y_train, X_val, y_val, args, device)
+    # Zero-copy views; X_train may be a read-only shared memory map.
+    X_train_tensor = as_tensor(X_train).float()
+    y_train_tensor = as_tensor(y_train).float()
+
+    if args.fast_batches:
+        # Slice contiguous batches out of one shuffled copy per epoch.
+        train_loader = TensorBatchIterator(
+            X_train_tensor.to(device), y_train_tensor.to(device), batch_size=args.batch_size, shuffle=True
+        )
+    else:
+        train_dataset = TensorDataset(X_train_tensor, y_train_tensor)
+        train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+    n_train = len(X_train_tensor)
 
     input_dim = X_train.shape[1]
     model = DeepGravityReg(input_dim=input_dim).to(device)
     optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
 
     model.train()
+    train_model = model
+    if args.compile:
+        train_model = compile_for_training(model, X_train_tensor[:args.batch_size].to(device))
+
     print(f"    [Train] Starting DGM training for {args.epochs} epochs...", flush=True)
+    samples_per_sec = []
+    best_val_loss, best_epoch, best_state, bad_epochs = float("inf"), None, None, 0
+    epochs_run = 0
     for epoch in range(args.epochs):
+        epochs_run = epoch + 1
         epoch_loss = 0.0
+        epoch_start = time.perf_counter()
         for x_batch, y_batch in train_loader:
             x_batch, y_batch = x_batch.to(device), y_batch.to(device)
             optimizer.zero_grad()
-            y_pred = model(x_batch)
-            loss = F.mse_loss(y_pred, y_batch)
+            with autocast(args.precision, device.type):
+                y_pred = train_model(x_batch)
+                loss = F.mse_loss(y_pred, y_batch)
             loss.backward()
             optimizer.step()
             epoch_loss += loss.item() * x_batch.size(0)
-        
-        avg_epoch_loss = epoch_loss / len(train_loader.dataset)
-        print(f"    Epoch {epoch+1}/{args.epochs}, Train Loss: {avg_epoch_loss:.6f}", flush=True)
 
+        samples_per_sec.append(n_train / (time.perf_counter() - epoch_start))
+        avg_epoch_loss = epoch_loss / n_train
+        if X_val is None:
+            print(f"    Epoch {epoch+1}/{args.epochs}, Train Loss: {avg_epoch_loss:.6f}, "
+                  f"{samples_per_sec[-1]:.0f} samples/s", flush=True)
+            continue
+
+        val_loss = evaluate_dgm(model, X_val, y_val, device, args.eval_chunk_size, args.precision)
+        model.train()
+        print(f"    Epoch {epoch+1}/{args.epochs}, Train Loss: {avg_epoch_loss:.6f}, Val Loss: {val_loss:.6f}, "
+              f"{samples_per_sec[-1]:.0f} samples/s", flush=True)
+        if val_loss < best_val_loss - args.min_delta:
+            best_val_loss, best_epoch, bad_epochs = val_loss, epoch + 1, 0
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        else:
+            bad_epochs += 1
+            if bad_epochs >= args.patience:
+                print(f"    [Train] Early stopping at epoch {epoch+1}; best epoch {best_epoch}.", flush=True)
+                break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+
+    train_info = {
+        "train_samples_per_sec": float(np.mean(samples_per_sec)) if samples_per_sec else None,
+        "epochs_run": epochs_run,
+    }
+    if X_val is not None:
+        train_info.update({
+            "best_epoch": best_epoch,
+            "best_val_loss": float(best_val_loss) if best_epoch is not None else None,
+            "val_samples": len(y_val),
+        })
+    return model, train_info
+
+
+def ensemble_member_losses(ensemble, X, y, valid, chunk_size, precision="fp32"):
+    """Per-member MSE of a stacked ensemble over padded (M, n, in) data, in no-grad chunks."""
+    sq_err_sum = torch.zeros(X.shape[0], dtype=torch.float64, device=X.device)
+    with torch.no_grad():
+        for start in range(0, X.shape[1], chunk_size):
+            sl = slice(start, start + chunk_size)
+            with autocast(precision, X.device.type):
+                pred = ensemble(X[:, sl])
+            diff = (pred.double() - y[:, sl].double()) * valid[:, sl]
+            sq_err_sum += (diff ** 2).sum(1)
+    return sq_err_sum / valid.sum(1).clamp(min=1)
+
+
+def pad_member_sets(tensors, input_dim, device):
+    """Stack per-member (X, y) tensors into zero-padded (M, n_max, ...) tensors and a validity mask."""
+    n_max = max(len(y) for _, y in tensors)
+    X_pad = torch.zeros(len(tensors), n_max, input_dim, device=device)
+    y_pad = torch.zeros(len(tensors), n_max, device=device)
+    valid = torch.zeros(len(tensors), n_max, dtype=torch.bool, device=device)
+    for m, (X, y) in enumerate(tensors):
+        X_pad[m, :len(y)] = X.to(device)
+        y_pad[m, :len(y)] = y.to(device)
+        valid[m, :len(y)] = True
+    return X_pad, y_pad, valid
+
+
+def train_dgm_ensemble(train_sets, args, device):
+    """
+    Train one Deep Gravity Model per training set as a single stacked ensemble.
+    Every member walks its own shuffled data stream with its own epoch length and
+    optimizer state; steps only run as one batched matmul per layer. With
+    --val_fraction each member early-stops on its own validation split and drops
+    out of later steps, and training ends once every member has stopped.
+    :param train_sets: list of (X_train, y_train)
+    :return: list of (model, train_info), one per training set
+    """
+    n_models = len(train_sets)
+    input_dim = train_sets[0][0].shape[1]
+    splits = [split_validation(X, y, args.val_fraction, args.seed) for X, y in train_sets]
+    use_val = all(X_val is not None for _, _, X_val, _ in splits)
+    sizes = [len(y) for _, y, _, _ in splits]
+    bs = args.batch_size
+    n_steps = (max(sizes) + bs - 1) // bs
+    padded = n_steps * bs
+
+    X_all = [as_tensor(X).float() for X, _, _, _ in splits]
+    y_all = [as_tensor(y).float() for _, y, _, _ in splits]
+    X_shuf = torch.zeros(n_models, padded, input_dim, device=device)
+    y_shuf = torch.zeros(n_models, padded, device=device)
+    valid = torch.zeros(n_models, padded, dtype=torch.bool, device=device)
+    for m, n in enumerate(sizes):
+        valid[m, :n] = True
+    sizes_t = torch.tensor(sizes, device=device)
+
+    if use_val:
+        X_val, y_val, val_valid = pad_member_sets(
+            [(as_tensor(Xv).float(), as_tensor(yv).float()) for _, _, Xv, yv in splits], input_dim, device)
+
+    ensemble = DeepGravityEnsemble(n_models, input_dim).to(device)
+    optimizer = MemberAdam(ensemble.parameters(), lr=args.lr)
+
+    training = torch.ones(n_models, dtype=torch.bool, device=device)
+    epochs_run = [0] * n_models
+    best_val_loss = [float("inf")] * n_models
+    best_epoch = [None] * n_models
+    best_state = [None] * n_models
+    bad_epochs = [0] * n_models
+
+    print(f"    [Train] Starting batched DGM training of {n_models} models for {args.epochs} epochs...", flush=True)
+    samples_per_sec = []
+    for epoch in range(args.epochs):
+        if not training.any():
+            break
+        for m in range(n_models):
+            if training[m]:
+                epochs_run[m] = epoch + 1
+            perm = torch.randperm(sizes[m])
+            X_shuf[m, :sizes[m]] = X_all[m][perm].to(device)
+            y_shuf[m, :sizes[m]] = y_all[m][perm].to(device)
+
+        epoch_loss = torch.zeros(n_models, device=device)
+        epoch_start = time.perf_counter()
+        for step in range(n_steps):
+            sl = slice(step * bs, (step + 1) * bs)
+            mask = (valid[:, sl] & training[:, None]).float()
+            counts = mask.sum(1)
+            active = counts > 0
+            if not active.any():
+                continue
+
+            optimizer.zero_grad()
+            with autocast(args.precision, device.type):
+                y_pred = ensemble(X_shuf[:, sl])
+            sq_err = (y_pred.float() - y_shuf[:, sl]) ** 2 * mask
+            # Sum of per-member batch means: each member's gradient is exactly its own.
+            member_loss = sq_err.sum(1) / counts.clamp(min=1)
+            member_loss.sum().backward()
+            optimizer.step(active)
+            epoch_loss += member_loss.detach() * counts
+
+        n_trained = sum(n for n, on in zip(sizes, training.tolist()) if on)
+        samples_per_sec.append(n_trained / (time.perf_counter() - epoch_start))
+        avg_loss = (epoch_loss / sizes_t)[training].tolist()
+        message = (f"    Epoch {epoch+1}/{args.epochs}, Train Loss (mean of {len(avg_loss)}): {np.mean(avg_loss):.6f}")
+
+        if use_val:
+            val_loss = ensemble_member_losses(ensemble, X_val, y_val, val_valid, args.eval_chunk_size, args.precision).tolist()
+            message += f", Val Loss: {np.mean([v for v, on in zip(val_loss, training.tolist()) if on]):.6f}"
+            for m in range(n_models):
+                if not training[m]:
+                    continue
+                if val_loss[m] < best_val_loss[m] - args.min_delta:
+                    best_val_loss[m], best_epoch[m], bad_epochs[m] = val_loss[m], epoch + 1, 0
+                    best_state[m] = ensemble.member_state_dict(m)
+                else:
+                    bad_epochs[m] += 1
+                    if bad_epochs[m] >= args.patience:
+                        training[m] = False
+        print(f"{message}, {samples_per_sec[-1]:.0f} samples/s", flush=True)
+        if use_val and not training.all():
+            print(f"    [Train] {int(training.sum())}/{n_models} members still training.", flush=True)
+
+    results = []
+    for m in range(n_models):
+        model = DeepGravityReg(input_dim=input_dim).to(device)
+        model.load_state_dict(best_state[m] if best_state[m] is not None else ensemble.member_state_dict(m))
+        train_info = {
+            "train_samples_per_sec": float(np.mean(samples_per_sec)) if samples_per_sec else None,
+            "ensemble_size": n_models,
+            "epochs_run": epochs_run[m],
+        }
+        if use_val:
+            train_info.update({
+                "best_epoch": best_epoch[m],
+                "best_val_loss": float(best_val_loss[m]) if best_epoch[m] is not None else None,
+                "val_samples": len(splits[m][3]),
+            })
+        results.append((model, train_info))
+    return results
+
+
+def load_test_set(target, args):
+    """
+    Load every OD pair of the target as the test set; returns (X_test, y_test, sample).
+    With --factorized_eval the (N, N, 2F+1) pair features are never built; X_test is
+    then the target's node representation (feat, dis) and y_test is the flattened OD
+    matrix in the same row-major order as CommutingODPairDataset.
+    With --eval_sample_size only a stratified PairSample of the pairs is loaded and
+    y_test holds its flows; sample is None otherwise.
+    """
+    if args.eval_sample_size:
+        return load_sampled_test_set(args.data_dir, target, args.eval_sample_size, args.seed,
+                                     factorized=args.factorized_eval)
+    if args.factorized_eval:
+        feat, dis, od = load_area_features(args.data_dir, target)
+        return (feat, dis), od.reshape(-1).astype(np.float32), None
+    return (*extract_xy(args.data_dir, [target], max_samples=None, seed=args.seed), None)
+
+
+def iter_dgm_prediction_tensors(model, X_test, device, chunk_size, precision="fp32"):
+    """
+    Yield (offset, predictions) over the flattened test set, one chunk at a time, as
+    float32 tensors on device. Chunks hold at most chunk_size pairs (whole origin rows
+    on the factorized path), so activations never scale with the full N^2 of the target.
+    """
+    if isinstance(X_test, tuple):
+        feat, dis = X_test
+        N = feat.shape[0]
+        rows_per_block = max(1, chunk_size // max(N, 1))
+        feat_t, dis_t = torch.from_numpy(feat).to(device), torch.from_numpy(dis).to(device)
+        with autocast(precision, device.type):
+            for row_start, block in model.iter_od_blocks(feat_t, dis_t, rows_per_block):
+                yield row_start * N, block.reshape(-1).float()
+    else:
+        for start in range(0, len(X_test), chunk_size):
+            x_chunk = torch.from_numpy(np.ascontiguousarray(X_test[start:start + chunk_size])).float()
+            with autocast(precision, device.type):
+                pred = model(x_chunk.to(device))
+            yield start, pred.float()
+
+
+def iter_dgm_predictions(model, X_test, device, chunk_size, precision="fp32"):
+    """iter_dgm_prediction_tensors with every chunk copied to a numpy array."""
+    for start, pred in iter_dgm_prediction_tensors(model, X_test, device, chunk_size, precision):
+        yield start, pred.cpu().numpy()
+
+
+def evaluate_dgm(model, X_test, y_test, device, chunk_size, precision="fp32", metrics=None):
+    """
+    Return the test MSE of a trained model.
+    Inference runs chunk by chunk under no_grad and the squared error is accumulated
+    in float64, so peak memory is bounded by chunk_size regardless of target size.
+    If an ODMetricsAccumulator is given, every chunk is also added to it.
+    """
     model.eval()
+    sq_err_sum = 0.0
     with torch.no_grad():
-        pred_tensor = model(X_test_tensor.to(device))
-        pred = pred_tensor.cpu().numpy()
+        for start, pred in iter_dgm_predictions(model, X_test, device, chunk_size, precision):
+            if metrics is not None:
+                metrics.update_pairs(pred, y_test[start:start + len(pred)], start)
+            diff = pred.astype(np.float64) - y_test[start:start + len(pred)]
+            sq_err_sum += float(np.dot(diff, diff))
+
+    return sq_err_sum / len(y_test)
 
-    mse = float(mean_squared_error(y_test, pred))
+
+def evaluate_dgm_on_device(model, X_test, y_test, device, chunk_size, precision="fp32"):
+    """
+    Return (mse, od_metrics) of a trained model without moving predictions to the host.
+    The chunks are written into one preallocated (N^2,) tensor on device, which is then
+    scored in place by the torch metric suite; only the results are transferred.
+    """
+    model.eval()
+    y_t = torch.from_numpy(np.ascontiguousarray(y_test)).to(device)
+    pred_all = torch.empty(len(y_test), dtype=torch.float32, device=device)
+    sq_err_sum = torch.zeros((), dtype=torch.float64, device=device)
+    with torch.no_grad():
+        for start, pred in iter_dgm_prediction_tensors(model, X_test, device, chunk_size, precision):
+            pred_all[start:start + len(pred)] = pred
+            diff = pred.double() - y_t[start:start + len(pred)]
+            sq_err_sum += torch.dot(diff, diff)
+        od_metrics = od_metrics_from_pairs_torch(pred_all, y_t, inplace=True)
+
+    return float(sq_err_sum) / len(y_test), od_metrics
+
+
+def evaluate_dgm_sample(model, X_test, y_test, sample, device, chunk_size, precision="fp32"):
+    """
+    Return (mse, sample_info): the stratified MSE estimate from the sampled test pairs.
+    On the factorized path X_test is (feat, dis) and the sampled pairs are predicted with
+    forward_pairs from per-node projections computed once.
+    """
+    model.eval()
+    preds = []
+    with torch.no_grad():
+        if isinstance(X_test, tuple):
+            feat, dis = X_test
+            o_idx, d_idx = sample.origins_destinations(feat.shape[0])
+            feat_t = torch.from_numpy(feat).to(device)
+            with autocast(precision, device.type):
+                projections = model.node_projections(feat_t)
+                for start in range(0, len(sample), chunk_size):
+                    o, d = o_idx[start:start + chunk_size], d_idx[start:start + chunk_size]
+                    pred = model.forward_pairs(
+                        feat_t, torch.from_numpy(dis[o, d]).to(device),
+                        torch.from_numpy(o).to(device), torch.from_numpy(d).to(device), projections=projections)
+                    preds.append(pred.float().cpu().numpy())
+        else:
+            preds = [pred for _, pred in iter_dgm_predictions(model, X_test, device, chunk_size, precision)]
+
+    return sample.estimate_mse(np.concatenate(preds), y_test)
+
+
+def evaluate_target(model, X_test, y_test, device, args, sample=None):
+    """
+    Return (mse, eval_info) for one target at --precision.
+    With --full_metrics eval_info also holds the full OD metric suite, accumulated
+    over the same prediction chunks (numpy backend) or computed on device (torch backend).
+    With a PairSample the MSE is its stratified estimate, with the sample size and
+    confidence interval in eval_info.
+    Under bf16 the model is also scored in float32, and both the float32 MSE and
+    the bf16 - fp32 difference are recorded so the precision loss can be judged
+    per target.
+    """
+    eval_info = {"precision": args.precision}
+    if sample is not None:
+        mse, sample_info = evaluate_dgm_sample(
+            model, X_test, y_test, sample, device, args.eval_chunk_size, args.precision)
+        eval_info.update(sample_info)
+    elif args.full_metrics and args.metrics_backend == "torch":
+        mse, eval_info["od_metrics"] = evaluate_dgm_on_device(
+            model, X_test, y_test, device, args.eval_chunk_size, args.precision)
+    else:
+        metrics = None
+        if args.full_metrics:
+            metrics = ODMetricsAccumulator(int(round(np.sqrt(len(y_test)))), clip_negative=True)
+        mse = evaluate_dgm(model, X_test, y_test, device, args.eval_chunk_size, args.precision, metrics=metrics)
+        if metrics is not None:
+            eval_info["od_metrics"] = metrics.finalize()
+    if args.precision != "fp32":
+        if sample is not None:
+            mse_fp32, _ = evaluate_dgm_sample(model, X_test, y_test, sample, device, args.eval_chunk_size)
+        else:
+            mse_fp32 = evaluate_dgm(model, X_test, y_test, device, args.eval_chunk_size)
+        eval_info.update({"mse_fp32": mse_fp32, "mse_bf16_delta": mse - mse_fp32})
+        relative = f"{(mse - mse_fp32) / mse_fp32:+.3%}" if mse_fp32 != 0 else "n/a"
+        print(f"    [INFO] MSE {args.precision}: {mse:.6f}, fp32: {mse_fp32:.6f}, "
+              f"delta: {mse - mse_fp32:+.6f} ({relative})", flush=True)
+    return mse, eval_info
+
+
+def save_dgm(model, target_id, args):
+    """Persist the model state_dict under model_output_dir."""
+    model_save_dir = os.path.join(
+        args.model_output_dir,
+        "dgm",
+        args.condition,
+        f"alpha{args.alpha}",
+        f"seed{args.seed}"
+    )
+    os.makedirs(model_save_dir, exist_ok=True)
+
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    fname = (
+        f"dgm_target{target_id}"
+        f"_alpha{args.alpha}"
+        f"_{args.condition}"
+        f"_seed{args.seed}"
+        f"_{now}.pt"
+    )
+    save_path = os.path.join(model_save_dir, fname)
+
+    torch.save(model.state_dict(), save_path)
+    print(f"    [INFO] Saved model -> {save_path}", flush=True)
+
+
+def train_and_evaluate_dgm(X_train, y_train, X_test, y_test, target_id, args, sample=None):
+    """
+    Train the Deep Gravity Model and evaluate it on the target city.
+    Returns (mse, train_info) where train_info holds per-run training statistics.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"    [INFO] Using device: {device}", flush=True)
+
+    model, train_info = train_dgm(X_train, y_train, args, device)
+    mse, eval_info = evaluate_target(model, X_test, y_test, device, args, sample=sample)
+    train_info = {**train_info, **eval_info}
     if args.model_output_dir:
-        model_save_dir = os.path.join(
-            args.model_output_dir,
-            "dgm",
-            args.condition,
-            f"alpha{args.alpha}",
-            f"seed{args.seed}"
-        )
-        os.makedirs(model_save_dir, exist_ok=True)
-        
-        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")        
-        fname = (
-            f"dgm_target{target_id}"
-            f"_alpha{args.alpha}"
-            f"_{args.condition}"
-            f"_seed{args.seed}"
-            f"_{now}.pt"
-        )
-        save_path = os.path.join(model_save_dir, fname)
-        
-        torch.save(model.state_dict(), save_path)
-        print(f"    [INFO] Saved model -> {save_path}", flush=True)
+        save_dgm(model, target_id, args)
 
-    return mse
+    return mse, train_info
 
 
 def run_all_targets(area_ids, dist_mat, source_ids, args):
@@ -163,7 +580,23 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
 
     with open(args.targets_path) as f:
         targets_raw = [line.strip() for line in f if line.strip()]
-    targets = [t for t in targets_raw if t in area_ids]
+    id_index = build_id_index(area_ids)
+    targets = [t for t in targets_raw if t in id_index]
+    # Select the source areas of every target in one vectorized pass. The table is built
+    # over the full target list before sharding: the random condition draws by position
+    # in that list, so each shard must select exactly what an unsharded run would.
+    selection = build_selection_table(
+        area_ids, dist_mat, source_ids, targets, args.condition,
+        top_k=args.top_k, bottom_k=args.bottom_k, seed=args.seed, id_index=id_index
+    )
+    if args.shard:
+        targets = shard_targets(targets, args.shard)
+        print(f"[INFO] Shard {args.shard}: {len(targets)} targets.", flush=True)
+
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_max_gb * 1024 ** 3) if args.cache_max_gb else None
+        cache = TrainingSetCache(args.cache_dir, max_bytes=max_bytes)
 
     # Pre-load the training data once for the all condition.
     X_train_all, y_train_all = None, None
@@ -172,50 +605,44 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
 
         print("[INFO] Condition is 'all'. Pre-loading training data once...", flush=True)
 
-        # Select every area ID from the source list.
-        sidx_all = np.array([np.where(area_ids == sid)[0][0] for sid in source_ids if sid in area_ids])
-        selected_areas_all = area_ids[sidx_all]
+        # Every target shares the full list of source areas.
+        selected_areas_all = area_ids[source_indices(source_ids, id_index)]
 
         # Extract training samples ahead of time.
-        X_train_all, y_train_all = extract_xy(args.data_dir, selected_areas_all, args.max_samples, seed=args.seed)
+        # With --shm_dir the matrices are published once in shared memory and concurrent
+        # jobs with the same sources, max_samples and seed attach to the same pages.
+        X_train_all, y_train_all = load_training_set(
+            extract_xy, args.data_dir, selected_areas_all, args.max_samples, args.seed,
+            cache=cache, shm_dir=args.shm_dir, shm_keep=args.shm_keep)
 
         if len(X_train_all) == 0:
             print("[ERROR] Pre-loading failed for 'all' condition. No training data found. Aborting.", file=sys.stderr, flush=True)
             return []
 
+    if args.ensemble_size > 1:
+        return run_ensemble_targets(targets, selection, X_train_all, y_train_all, cache, args)
+
     results_list = []
     print(f"[INFO] Evaluating {len(targets)} targets...", flush=True)
 
-    # Pre-compute source indices once instead of inside the loop.
-    sidx = np.array([np.where(area_ids == sid)[0][0] for sid in source_ids if sid in area_ids])
-
     for target in tqdm(targets, desc="Evaluating Targets"):
 
         print(f"--- Evaluating target: {target} ---", flush=True)
 
         try:
+            train_info = {}
+
             # --- 1. Load test data for the current target ---
-            X_test, y_test = extract_xy(args.data_dir, [target], max_samples=None, seed=args.seed)
+            X_test, y_test, sample = load_test_set(target, args)
 
             # --- 2. Prepare training data based on the strategy ---
             if args.condition == "all":
                 X_train, y_train = X_train_all, y_train_all
 
-            else:                
-                tidx = np.where(area_ids == target)[0][0]
-                dists = dist_mat[tidx, sidx]
-
-                if args.condition == "topk":
-                    selected_indices = sidx[np.argsort(dists)[:args.top_k]]
-                elif args.condition == "bottomk":
-                    selected_indices = sidx[np.argsort(-dists)[:args.bottom_k]]
-                elif args.condition == "random":
-                    selected_indices = np.random.choice(sidx, args.top_k, replace=False)
-                else:
-                    raise ValueError(f"Unknown condition: {args.condition}")
-                
-                selected_areas = area_ids[selected_indices]
-                X_train, y_train = extract_xy(args.data_dir, selected_areas, args.max_samples, seed=args.seed)
+            else:
+                selected_areas = selection[target]
+                X_train, y_train = load_training_set(
+                    extract_xy, args.data_dir, selected_areas, args.max_samples, args.seed, cache=cache)
 
             # --- 3. Train and evaluate if data is available ---
             if len(X_train) == 0 or len(y_train) == 0:
@@ -225,17 +652,18 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
                 print(f"   [WARN] No test data for target {target}. Skipping.", flush=True)
                 status, mse_val = "skipped_no_test_data", None
             else:
-                mse_val = train_and_evaluate_dgm(X_train, y_train, X_test, y_test, target, args)
+                mse_val, train_info = train_and_evaluate_dgm(X_train, y_train, X_test, y_test, target, args, sample=sample)
                 status = "success" if not np.isnan(mse_val) else "skipped_nan_mse"
 
             # --- 4. Store the metrics ---
             result_item = {
                 "target_id": target,
                 "mse": float(mse_val) if mse_val is not None else None,
-                "test_samples": len(y_test),
+                "test_samples": len(y_test) if sample is None else sample.n_pairs,
                 "train_samples": len(y_train),
                 "status": status
             }
+            result_item.update(train_info)
             results_list.append(result_item)
 
             if status == "success":
@@ -254,8 +682,129 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
     return results_list
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Selective Transfer Learning with Deep Gravity Model")
+def run_ensemble_targets(targets, selection, X_train_all, y_train_all, cache, args):
+    """
+    Evaluate targets in groups of args.ensemble_size, training the models of a
+    group together as one batched ensemble. Results keep the target order.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"[INFO] Evaluating {len(targets)} targets in ensembles of {args.ensemble_size} on {device}...", flush=True)
+
+    def error_item(target, e):
+        print(f"   [ERROR] Failed on target {target}: {e}\n", file=sys.stderr, flush=True)
+        return {
+            "target_id": target, "mse": None, "test_samples": 0,
+            "train_samples": 0, "status": "error", "error_message": str(e)
+        }
+
+    results_by_target = {}
+    for start in tqdm(range(0, len(targets), args.ensemble_size), desc="Evaluating Target Groups"):
+        group = targets[start:start + args.ensemble_size]
+
+        # --- 1. Load test and training data of every target in the group ---
+        jobs = []
+        for target in group:
+            print(f"--- Preparing target: {target} ---", flush=True)
+            try:
+                X_test, y_test, sample = load_test_set(target, args)
+                if args.condition == "all":
+                    X_train, y_train = X_train_all, y_train_all
+                else:
+                    X_train, y_train = load_training_set(
+                        extract_xy, args.data_dir, selection[target], args.max_samples, args.seed, cache=cache)
+
+                if len(X_train) == 0 or len(y_test) == 0:
+                    status = "skipped_no_train_data" if len(X_train) == 0 else "skipped_no_test_data"
+                    print(f"   -> Skipped: {status}\n", flush=True)
+                    results_by_target[target] = {
+                        "target_id": target, "mse": None,
+                        "test_samples": len(y_test) if sample is None else sample.n_pairs,
+                        "train_samples": len(y_train), "status": status
+                    }
+                else:
+                    jobs.append((target, X_train, y_train, X_test, y_test, sample))
+            except Exception as e:
+                results_by_target[target] = error_item(target, e)
+
+        if not jobs:
+            continue
+
+        # --- 2. Train the group together ---
+        try:
+            trained = train_dgm_ensemble([(job[1], job[2]) for job in jobs], args, device)
+        except Exception as e:
+            for job in jobs:
+                results_by_target[job[0]] = error_item(job[0], e)
+            continue
+
+        # --- 3. Evaluate every member on its own target ---
+        for (target, X_train, y_train, X_test, y_test, sample), (model, train_info) in zip(jobs, trained):
+            try:
+                mse_val, eval_info = evaluate_target(model, X_test, y_test, device, args, sample=sample)
+                train_info = {**train_info, **eval_info}
+                if args.model_output_dir:
+                    save_dgm(model, target, args)
+                status = "success" if not np.isnan(mse_val) else "skipped_nan_mse"
+                result_item = {
+                    "target_id": target,
+                    "mse": float(mse_val),
+                    "test_samples": len(y_test) if sample is None else sample.n_pairs,
+                    "train_samples": len(y_train),
+                    "status": status
+                }
+                result_item.update(train_info)
+                results_by_target[target] = result_item
+                print(f"   -> {target} MSE: {mse_val:.4f} (train_n={len(y_train)}, test_n={len(y_test)})", flush=True)
+            except Exception as e:
+                results_by_target[target] = error_item(target, e)
+
+    return [results_by_target[t] for t in targets]
+
+
+def save_results(evaluation_results, args):
+    """Write the results JSON of one run under results_dir and return its path."""
+    execution_time = datetime.datetime.now()
+    final_output = {
+        "metadata": vars(args),
+        "results": evaluation_results
+    }
+    final_output["metadata"]["execution_datetime"] = execution_time.isoformat()
+
+    # Shard outputs are kept out of raw/ until merge_shards.py combines them.
+    layout_dir = "shards" if args.shard else "raw"
+    results_save_dir = os.path.join(
+        args.results_dir, "dgm", layout_dir,
+        args.condition, 
+        f"alpha{args.alpha}", 
+        f"seed{args.seed}"
+    )
+    os.makedirs(results_save_dir, exist_ok=True)
+
+    param_str = (
+        f"ms{args.max_samples}"
+        f"_bs{args.batch_size}"
+        f"_ep{args.epochs}"
+        f"{eval_sample_suffix(args)}"
+    )
+    timestamp_str = execution_time.strftime("%Y%m%d_%H%M%S")
+    fname = f"{param_str}_{timestamp_str}.json"
+    if args.shard:
+        # Every shard of a run must name the same merged file, so the run id replaces the timestamp.
+        run_id = shard_run_id(args)
+        final_output["shard"] = {"spec": args.shard, "run_id": run_id, "merged_filename": f"{param_str}_{run_id}.json"}
+        fname = shard_filename(param_str, args.shard, run_id)
+
+    output_path = os.path.join(results_save_dir, fname)
+
+    with open(output_path, 'w') as f:
+        json.dump(final_output, f, indent=4)
+
+    print(f"\n[INFO] Successfully saved evaluation results to: {output_path}")
+    return output_path
+
+
+def build_parser(add_help=True):
+    parser = argparse.ArgumentParser(description="Selective Transfer Learning with Deep Gravity Model", add_help=add_help)
     # --- Path Arguments ---
     parser.add_argument('--data_dir', type=str, required=True, help="Path to the data directory.")
     parser.add_argument('--fgw_dir', type=str, required=True, help="Path to the directory containing FGW distances.")
@@ -275,11 +824,53 @@ def main():
     parser.add_argument('--epochs', type=int, default=10, help="Number of training epochs.")
     parser.add_argument('--batch_size', type=int, default=32, help="Batch size for training.")
     parser.add_argument('--lr', type=float, default=1e-3, help="Learning rate for Adam optimizer.")
+    parser.add_argument('--fast_batches', action='store_true', help="Slice batches from a shuffled in-memory copy instead of using a DataLoader.")
+    parser.add_argument('--val_fraction', type=float, default=0.0, help="Fraction of each training set held out for early stopping (0 trains for all --epochs).")
+    parser.add_argument('--patience', type=int, default=3, help="Epochs without validation improvement before training stops.")
+    parser.add_argument('--min_delta', type=float, default=0.0, help="Minimum decrease of the validation loss that counts as an improvement.")
+    parser.add_argument('--eval_chunk_size', type=int, default=65536, help="Number of test pairs per no-grad inference chunk; bounds evaluation memory.")
+    parser.add_argument('--full_metrics', action='store_true', help="Also record the full OD metric suite (cal_od_metrics) of every target under od_metrics, accumulated over the evaluation chunks.")
+    parser.add_argument('--metrics_backend', type=str, default="numpy", choices=["numpy", "torch"], help="Backend of --full_metrics: numpy streams the chunks through ODMetricsAccumulator on the host; torch keeps the target's OD matrix on the evaluation device and scores it there.")
+    parser.add_argument('--eval_sample_size', type=int, default=None, help="Score a stratified sample of this many test pairs (nonzero/zero flows) instead of all N^2; the MSE becomes an unbiased estimate with a 95%% confidence interval.")
+    parser.add_argument('--factorized_eval', action='store_true', help="Predict target OD matrices from per-node first-layer projections instead of building (N, N, 2F+1) pair features.")
+    parser.add_argument('--precision', type=str, default="fp32", choices=PRECISIONS, help="Numeric precision of training and inference; bf16 uses CPU/CUDA autocast.")
+    parser.add_argument('--ddp_workers', type=int, default=1, help="Train each model with DistributedDataParallel (gloo) across this many local CPU processes.")
+    parser.add_argument('--ensemble_size', type=int, default=1, help="Train the models of this many targets together as one batched ensemble.")
+    parser.add_argument('--compile', action='store_true', help="Train through torch.compile (falls back to eager mode if unavailable).")
     
     # --- Reproducibility Arguments ---
     parser.add_argument('--seed', type=int, default=42, help="Random seed for reproducibility.")
-    
+
+    # --- Execution Arguments ---
+    parser.add_argument('--cache_dir', type=str, default=None, help="Persistent cache of extracted training sets, reused across runs and model families.")
+    parser.add_argument('--cache_max_gb', type=float, default=50, help="Size cap of --cache_dir; least recently used entries are evicted (0 = unbounded).")
+    parser.add_argument('--shm_dir', type=str, default=None, help="Publish the 'all' training matrices in this tmpfs directory (e.g. /dev/shm) and share them read-only across processes.")
+    parser.add_argument('--shm_keep', action='store_true', help="Keep the --shm_dir entry after the last process using it exits (default: it is removed).")
+    parser.add_argument('--shard', type=str, default=None, help="Process only shard i of n of the targets, given as i/n (e.g. 0/8).")
+    parser.add_argument('--run_id', type=str, default=None, help="Id shared by the shards of one run, part of their file names (default: a digest of the other arguments); pass e.g. the array job id to keep reruns apart.")
+
+    # --- Planning Arguments ---
+    parser.add_argument('--plan', action='store_true', help="Only print the predicted per-target cost and sweep budget; nothing is trained.")
+    parser.add_argument('--plan_mem_limit_gb', type=float, default=40, help="Flag targets whose predicted peak memory exceeds this limit.")
+    return parser
+
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
+    try:
+        parse_shard(args.shard)
+        shard_run_id(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.ddp_workers > 1 and args.ensemble_size > 1:
+        parser.error("--ddp_workers cannot be combined with --ensemble_size.")
+    if not 0 <= args.val_fraction < 1:
+        parser.error("--val_fraction must be in [0, 1).")
+    if args.eval_sample_size is not None and args.eval_sample_size < 2:
+        parser.error("--eval_sample_size must be at least 2.")
+    if args.eval_sample_size and args.full_metrics:
+        parser.error("--full_metrics needs every test pair and cannot be combined with --eval_sample_size.")
 
     # --- Setup ---
     random.seed(args.seed)
@@ -294,39 +885,15 @@ def main():
     with open(args.sources_path) as f:
         source_ids = [line.strip() for line in f if line.strip()]
 
+    if args.plan:
+        plan_sweep(area_ids, dist_mat, source_ids, args, "dgm", mem_limit_gb=args.plan_mem_limit_gb)
+        return
+
     # --- Run Evaluation ---
     evaluation_results = run_all_targets(area_ids, dist_mat, source_ids, args)
 
     # --- Save Results ---
-    execution_time = datetime.datetime.now()
-    final_output = {
-        "metadata": vars(args),
-        "results": evaluation_results
-    }
-    final_output["metadata"]["execution_datetime"] = execution_time.isoformat()
-
-    results_save_dir = os.path.join(
-        args.results_dir, "dgm", "raw", 
-        args.condition, 
-        f"alpha{args.alpha}", 
-        f"seed{args.seed}"
-    )
-    os.makedirs(results_save_dir, exist_ok=True)
-
-    param_str = (
-        f"ms{args.max_samples}"
-        f"_bs{args.batch_size}"
-        f"_ep{args.epochs}"
-    )
-    timestamp_str = execution_time.strftime("%Y%m%d_%H%M%S")
-    fname = f"{param_str}_{timestamp_str}.json"
-
-    output_path = os.path.join(results_save_dir, fname)
-
-    with open(output_path, 'w') as f:
-        json.dump(final_output, f, indent=4)
-
-    print(f"\n[INFO] Successfully saved evaluation results to: {output_path}")
+    save_results(evaluation_results, args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+# === run_selective_gravity.py ===
+import argparse
+import numpy as np
+import torch
+import json
+import datetime
+import os
+import random
+import sys
+import time
+from tqdm import tqdm
+from src.models.gravity import (
+    gravity_from_coefficients, gravity_normal_equations, solve_gravity
+)
+from src.utils.dataset import load_area_features
+from src.utils.selection import build_id_index, build_selection_table
+from src.utils.sharding import parse_shard, shard_filename, shard_run_id, shard_targets
+
+
+def load_fgw_distances(fgw_dir, alpha):
+    """Load FGW distance data from disk."""
+    print(f"[INFO] Loading FGW distances for alpha={alpha}...", flush=True)
+    area_ids_path = os.path.join(fgw_dir, "fgw_area_ids.npy")
+    dist_mat_path = os.path.join(fgw_dir, f"fgw_dist_{alpha:02d}.dat")
+
+    area_ids = np.load(area_ids_path)
+    dist_mat = np.memmap(dist_mat_path, dtype=np.float32, mode="r", shape=(len(area_ids), len(area_ids)))
+    return area_ids, dist_mat
+
+
+def load_area_gravity(data_dir, area, pop_col):
+    """Return (pop (N,), dis (N, N), od (N, N)) of one area."""
+    feat, dis, od = load_area_features(data_dir, area)
+    return feat[:, pop_col].astype(np.float64), dis.astype(np.float64), od
+
+
+def collect_area_statistics(data_dir, areas, form, pop_col):
+    """
+    Normal equations of every area, read once each.
+    :return: (gram (S, 4, 4), rhs (S, 4), n_nonzero (S,)) in the order of areas
+    """
+    gram = np.zeros((len(areas), 4, 4))
+    rhs = np.zeros((len(areas), 4))
+    n_nonzero = np.zeros(len(areas), dtype=np.int64)
+    for s, area in enumerate(tqdm(areas, desc="Area statistics")):
+        pop, dis, od = load_area_gravity(data_dir, area, pop_col)
+        gram[s], rhs[s], n_nonzero[s] = gravity_normal_equations(pop, dis, od, form)
+    return gram, rhs, n_nonzero
+
+
+def fit_all_targets(targets, selection, area_index, stats):
+    """
+    Fit one gravity model per target with a single batched least-squares solve.
+    The normal equations of each target are the sum over its selected sources.
+    :param area_index: dict area id -> row of the stacked statistics
+    :return: (coefficients (T, 4), nonzero training pairs per target (T,))
+    """
+    gram, rhs, n_nonzero = stats
+    rows = [np.array([area_index[str(a)] for a in selection[t]], dtype=np.int64) for t in targets]
+    target_gram = np.stack([gram[r].sum(0) for r in rows])
+    target_rhs = np.stack([rhs[r].sum(0) for r in rows])
+    n_train = np.array([n_nonzero[r].sum() for r in rows], dtype=np.int64)
+    return solve_gravity(target_gram, target_rhs), n_train
+
+
+def evaluate_gravity(model, pop, dis, od):
+    """Return the MSE of predicted flows over every OD pair of the target."""
+    N = len(pop)
+    pop_o = np.repeat(pop, N)
+    pop_d = np.tile(pop, N)
+    x = torch.from_numpy(np.stack([pop_o, pop_d, dis.reshape(-1)], axis=1))
+    with torch.no_grad():
+        pred = model.predict_flow(x).numpy()
+    diff = pred - od.reshape(-1).astype(np.float64)
+    return float(np.dot(diff, diff) / len(diff))
+
+
+def save_gravity(model, target_id, args):
+    """Persist a fitted gravity model's state dict."""
+    model_save_dir = os.path.join(
+        args.model_output_dir, f"gravity_{args.form}", args.condition,
+        f"alpha{args.alpha}", f"seed{args.seed}"
+    )
+    os.makedirs(model_save_dir, exist_ok=True)
+
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    fname = f"gravity_{args.form}_target{target_id}_topk{args.top_k}_{now}.pt"
+    save_path = os.path.join(model_save_dir, fname)
+    torch.save(model.state_dict(), save_path)
+    print(f"    [INFO] Saved model -> {save_path}", flush=True)
+
+
+def run_all_targets(area_ids, dist_mat, source_ids, args):
+    """Fit and evaluate the gravity baseline for every target area."""
+    print(f"[INFO] Loading targets from {args.targets_path}", flush=True)
+    with open(args.targets_path) as f:
+        targets_raw = [line.strip() for line in f if line.strip()]
+    id_index = build_id_index(area_ids)
+    targets = [t for t in targets_raw if t in id_index]
+    # Select the source areas of every target in one vectorized pass. The table is built
+    # over the full target list before sharding: the random condition draws by position
+    # in that list, so each shard must select exactly what an unsharded run would.
+    selection = build_selection_table(
+        area_ids, dist_mat, source_ids, targets, args.condition,
+        top_k=args.top_k, bottom_k=args.bottom_k, seed=args.seed, id_index=id_index
+    )
+    if args.shard:
+        targets = shard_targets(targets, args.shard)
+        print(f"[INFO] Shard {args.shard}: {len(targets)} targets.", flush=True)
+
+    # --- 1. Per-area normal equations, each source area read once ---
+    needed = sorted({str(area) for areas in selection.values() for area in areas})
+    print(f"[INFO] Collecting gravity statistics of {len(needed)} source areas...", flush=True)
+    stats = collect_area_statistics(args.data_dir, needed, args.form, args.pop_col)
+    area_index = {area: s for s, area in enumerate(needed)}
+
+    # --- 2. One batched solve for all targets ---
+    fit_start = time.perf_counter()
+    coefs, n_train = fit_all_targets(targets, selection, area_index, stats)
+    fit_seconds = time.perf_counter() - fit_start
+    print(f"[INFO] Fitted {len(targets)} gravity_{args.form} models in {fit_seconds:.3f}s.", flush=True)
+
+    results_list = []
+    print(f"[INFO] Evaluating {len(targets)} targets...", flush=True)
+    for t, target in enumerate(tqdm(targets, desc="Evaluating Targets")):
+        print(f"--- Evaluating target: {target} ---", flush=True)
+        try:
+            pop, dis, od = load_area_gravity(args.data_dir, target, args.pop_col)
+            test_samples = od.size
+            coef_info = {}
+            if n_train[t] == 0:
+                status, mse_val = "skipped_no_train_data", None
+            elif test_samples == 0:
+                status, mse_val = "skipped_no_test_data", None
+            else:
+                model = gravity_from_coefficients(args.form, coefs[t])
+                mse_val = evaluate_gravity(model, pop, dis, od)
+                status = "success" if np.isfinite(mse_val) else "skipped_nan_mse"
+                coef_info = {
+                    "log_k": model.log_k.item(), "alpha_o": model.alpha.item(),
+                    "beta_d": model.beta.item(), "gamma": model.gamma.item(),
+                }
+                if args.model_output_dir:
+                    save_gravity(model, target, args)
+
+            result_item = {
+                "target_id": target,
+                "mse": float(mse_val) if mse_val is not None else None,
+                "test_samples": int(test_samples),
+                "train_samples": int(n_train[t]),
+                "status": status
+            }
+            result_item.update(coef_info)
+            results_list.append(result_item)
+
+            if status == "success": print(f"    -> MSE: {mse_val:.4f}\n", flush=True)
+            else: print(f"    -> Skipped: {status}\n", flush=True)
+
+        except Exception as e:
+            print(f"    [ERROR] Failed on target {target}: {e}\n", file=sys.stderr, flush=True)
+            results_list.append({
+                "target_id": target, "mse": None, "test_samples": 0,
+                "train_samples": 0, "status": "error", "error_message": str(e)
+            })
+
+    return results_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Selective Transfer Learning with closed-form gravity baselines")
+    parser.add_argument('--data_dir', type=str, required=True)
+    parser.add_argument('--fgw_dir', type=str, required=True)
+    parser.add_argument('--targets_path', type=str, required=True)
+    parser.add_argument('--sources_path', type=str, required=True)
+    parser.add_argument('--results_dir', type=str, default='results')
+    parser.add_argument('--model_output_dir', type=str, default='outputs', help="Directory to save fitted models, as in the other runners; pass '' to skip saving.")
+    parser.add_argument('--condition', type=str, required=True, choices=['topk', 'bottomk', 'random', 'all'])
+    parser.add_argument('--top_k', type=int, default=100)
+    parser.add_argument('--bottom_k', type=int, default=100)
+    parser.add_argument('--alpha', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--form', type=str, default='power', choices=['power', 'exponential'], help="GravityPower (log distance) or GravityExponential (linear distance).")
+    parser.add_argument('--pop_col', type=int, default=0, help="Column of the node features used as population.")
+    parser.add_argument('--shard', type=str, default=None, help="Process only shard i of n of the targets, given as i/n.")
+    parser.add_argument('--run_id', type=str, default=None, help="Id shared by the shards of one run, part of their file names (default: a digest of the other arguments); pass e.g. the array job id to keep reruns apart.")
+    args = parser.parse_args()
+    try:
+        parse_shard(args.shard)
+        shard_run_id(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    os.environ['PYTHONHASHSEED'] = str(args.seed)
+
+    area_ids, dist_mat = load_fgw_distances(args.fgw_dir, args.alpha)
+    with open(args.sources_path) as f:
+        source_ids = [line.strip() for line in f if line.strip()]
+
+    evaluation_results = run_all_targets(area_ids, dist_mat, source_ids, args)
+
+    final_output = {
+        "metadata": vars(args),
+        "results": evaluation_results,
+        "execution_datetime": datetime.datetime.now().isoformat()
+    }
+
+    # Shard outputs are kept out of raw/ until merge_shards.py combines them.
+    layout_dir = "shards" if args.shard else "raw"
+    results_save_dir = os.path.join(
+        args.results_dir, f"gravity_{args.form}", layout_dir,
+        args.condition,
+        f"alpha{args.alpha}",
+        f"seed{args.seed}"
+    )
+    os.makedirs(results_save_dir, exist_ok=True)
+
+    param_str = f"topk{args.top_k}"
+    fname = f"{param_str}.json"
+    if args.shard:
+        run_id = shard_run_id(args)
+        final_output["shard"] = {"spec": args.shard, "run_id": run_id, "merged_filename": fname}
+        fname = shard_filename(param_str, args.shard, run_id)
+
+    output_path = os.path.join(results_save_dir, fname)
+
+    with open(output_path, 'w') as f:
+        json.dump(final_output, f, indent=4)
+
+    print(f"\n[INFO] Successfully saved evaluation results to: {output_path}")
+
+if __name__ == "__main__":
+    main()
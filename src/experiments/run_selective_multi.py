@@ -0,0 +1,253 @@
+# === run_selective_multi.py ===
+# Train several model families on one extraction of every target's training and test data.
+import argparse
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from src.experiments import run_selective_dgm, run_selective_rf, run_selective_svr
+from src.experiments.run_selective_rf import extract_xy, load_fgw_distances
+from src.utils.distributed import available_cpus
+from src.utils.eval_sampling import load_sampled_test_set
+from src.utils.model_store import ModelStore
+from src.utils.planning import plan_sweep
+from src.utils.selection import build_id_index, build_selection_table, source_indices
+from src.utils.sharding import parse_shard, shard_run_id, shard_targets
+from src.utils.train_cache import TrainingSetCache, load_training_set
+
+# Runner module of every family; each provides build_parser, train_and_evaluate_<family>
+# and save_results, so results land exactly where the single-family runner puts them.
+FAMILIES = {
+    "dgm": run_selective_dgm,
+    "rf": run_selective_rf,
+    "svr": run_selective_svr,
+}
+
+
+def family_namespace(args, family):
+    """The subset of args the single-family runner accepts, i.e. its own metadata."""
+    dests = {action.dest for action in FAMILIES[family].build_parser()._actions if action.dest != "help"}
+    return argparse.Namespace(**{dest: getattr(args, dest) for dest in sorted(dests)})
+
+
+def evaluate_family(family, target, X_train, y_train, X_test, y_test, args, store=None, sample=None):
+    """
+    Fit and score one family on one target; returns its result item and never raises.
+    With a PairSample every family is scored on the same sampled pairs.
+    """
+    try:
+        if family == "dgm":
+            if args.factorized_eval and sample is None:
+                # The factorized path needs the target's node representation, not pair features.
+                X_test, y_test, _ = run_selective_dgm.load_test_set(target, args)
+            mse_val, train_info = run_selective_dgm.train_and_evaluate_dgm(
+                X_train, y_train, X_test, y_test, target, args, sample=sample)
+        elif family == "rf":
+            mse_val, train_info = run_selective_rf.train_and_evaluate_rf(
+                X_train, y_train, X_test, y_test, target, args, store=store, sample=sample)
+        else:
+            mse_val, train_info = run_selective_svr.train_and_evaluate_svr(
+                X_train, y_train, X_test, y_test, target, args, store=store, sample=sample)
+        status = "success" if not np.isnan(mse_val) else "skipped_nan_mse"
+        result_item = {
+            "target_id": target,
+            "mse": float(mse_val),
+            "test_samples": len(y_test) if sample is None else sample.n_pairs,
+            "train_samples": len(y_train),
+            "status": status
+        }
+        result_item.update(train_info)
+        print(f"    -> [{family}] MSE: {mse_val:.4f}", flush=True)
+        return result_item
+    except Exception as e:
+        print(f"    [ERROR] [{family}] Failed on target {target}: {e}", file=sys.stderr, flush=True)
+        return {
+            "target_id": target, "mse": None, "test_samples": 0,
+            "train_samples": 0, "status": "error", "error_message": str(e)
+        }
+
+
+def run_all_targets(area_ids, dist_mat, source_ids, args, family_args, stores):
+    """
+    Evaluate every requested family on every target and return {family: results}.
+    Training and test data are extracted once per target and shared by all families;
+    with --family_workers > 1 the families of a target are fitted concurrently.
+    """
+    print(f"[INFO] Loading targets from {args.targets_path}", flush=True)
+    with open(args.targets_path) as f:
+        targets_raw = [line.strip() for line in f if line.strip()]
+    id_index = build_id_index(area_ids)
+    targets = [t for t in targets_raw if t in id_index]
+    # Select the source areas of every target in one vectorized pass. The table is built
+    # over the full target list before sharding: the random condition draws by position
+    # in that list, so each shard must select exactly what an unsharded run would.
+    selection = build_selection_table(
+        area_ids, dist_mat, source_ids, targets, args.condition,
+        top_k=args.top_k, bottom_k=args.bottom_k, seed=args.seed, id_index=id_index
+    )
+    if args.shard:
+        targets = shard_targets(targets, args.shard)
+        print(f"[INFO] Shard {args.shard}: {len(targets)} targets.", flush=True)
+
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_max_gb * 1024 ** 3) if args.cache_max_gb else None
+        cache = TrainingSetCache(args.cache_dir, max_bytes=max_bytes)
+
+    results = {family: [] for family in family_args}
+
+    X_train_all, y_train_all = None, None
+    if args.condition == "all":
+        print("[INFO] Condition is 'all'. Pre-loading training data once...", flush=True)
+        selected_areas_all = area_ids[source_indices(source_ids, id_index)]
+        X_train_all, y_train_all = load_training_set(
+            extract_xy, args.data_dir, selected_areas_all, args.max_samples, args.seed,
+            cache=cache, shm_dir=args.shm_dir, shm_keep=args.shm_keep)
+        if len(X_train_all) == 0:
+            print("[ERROR] Pre-loading failed for 'all' condition. Aborting.", file=sys.stderr, flush=True)
+            return results
+
+    pool = ThreadPoolExecutor(max_workers=args.family_workers) if args.family_workers > 1 else None
+    print(f"[INFO] Evaluating {len(targets)} targets with {', '.join(family_args)}...", flush=True)
+
+    try:
+        for target in tqdm(targets, desc="Evaluating Targets"):
+            print(f"--- Evaluating target: {target} ---", flush=True)
+            try:
+                # --- 1. Extract test and training data once for all families ---
+                sample = None
+                if args.eval_sample_size:
+                    X_test, y_test, sample = load_sampled_test_set(
+                        args.data_dir, target, args.eval_sample_size, args.seed)
+                else:
+                    X_test, y_test = extract_xy(args.data_dir, [target], max_samples=None, seed=args.seed)
+                if args.condition == "all":
+                    X_train, y_train = X_train_all, y_train_all
+                else:
+                    X_train, y_train = load_training_set(
+                        extract_xy, args.data_dir, selection[target], args.max_samples, args.seed, cache=cache)
+            except Exception as e:
+                print(f"    [ERROR] Failed to load data for target {target}: {e}\n", file=sys.stderr, flush=True)
+                for family in family_args:
+                    results[family].append({
+                        "target_id": target, "mse": None, "test_samples": 0,
+                        "train_samples": 0, "status": "error", "error_message": str(e)
+                    })
+                continue
+
+            if len(X_train) == 0 or len(X_test) == 0:
+                status = "skipped_no_train_data" if len(X_train) == 0 else "skipped_no_test_data"
+                print(f"    -> Skipped: {status}\n", flush=True)
+                for family in family_args:
+                    results[family].append({
+                        "target_id": target, "mse": None,
+                        "test_samples": len(y_test) if sample is None else sample.n_pairs,
+                        "train_samples": len(y_train), "status": status
+                    })
+                continue
+
+            # --- 2. Fit every family on the shared arrays ---
+            jobs = {
+                family: (family, target, X_train, y_train, X_test, y_test, fargs, stores.get(family), sample)
+                for family, fargs in family_args.items()
+            }
+            if pool is None:
+                items = {family: evaluate_family(*job) for family, job in jobs.items()}
+            else:
+                futures = {family: pool.submit(evaluate_family, *job) for family, job in jobs.items()}
+                items = {family: future.result() for family, future in futures.items()}
+            for family in family_args:
+                results[family].append(items[family])
+            print("", flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return results
+
+
+def build_parser():
+    # Every option of the single-family runners is accepted; shared options are identical.
+    parents = [module.build_parser(add_help=False) for module in FAMILIES.values()]
+    parser = argparse.ArgumentParser(
+        description="Selective Transfer Learning with several model families on shared data",
+        parents=parents, conflict_handler="resolve"
+    )
+    parser.add_argument('--models', type=str, default="dgm,rf,svr", help="Comma-separated model families to train on every target.")
+    parser.add_argument('--family_workers', type=int, default=1, help="Fit up to this many families of a target concurrently (threads).")
+    parser.add_argument('--threads', type=int, default=0, help="Total thread budget shared by the concurrent families (0 = library defaults).")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    try:
+        parse_shard(args.shard)
+        shard_run_id(args)
+    except ValueError as e:
+        parser.error(str(e))
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    unknown = [m for m in models if m not in FAMILIES]
+    if not models or unknown:
+        parser.error(f"--models must list families from {sorted(FAMILIES)}; got {args.models!r}.")
+    if "dgm" in models and args.ensemble_size > 1:
+        parser.error("--ensemble_size is not supported by the combined runner; use run_selective_dgm.py.")
+    if not 0 <= args.val_fraction < 1:
+        parser.error("--val_fraction must be in [0, 1).")
+    if args.family_workers < 1:
+        parser.error("--family_workers must be at least 1.")
+    if args.eval_sample_size is not None and args.eval_sample_size < 2:
+        parser.error("--eval_sample_size must be at least 2.")
+    if args.eval_sample_size and args.full_metrics:
+        parser.error("--full_metrics needs every test pair and cannot be combined with --eval_sample_size.")
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(args.seed)
+    os.environ['PYTHONHASHSEED'] = str(args.seed)
+
+    # Split the thread budget between the families that can run at the same time.
+    if args.threads > 0:
+        share = max(1, args.threads // min(args.family_workers, len(models)))
+        torch.set_num_threads(share)
+        args.rf_n_jobs = share
+        print(f"[INFO] Thread budget {args.threads} ({available_cpus()} CPUs available): "
+              f"{share} threads per family.", flush=True)
+
+    area_ids, dist_mat = load_fgw_distances(args.fgw_dir, args.alpha)
+    with open(args.sources_path) as f:
+        source_ids = [line.strip() for line in f if line.strip()]
+
+    family_args = {family: family_namespace(args, family) for family in models}
+
+    if args.plan:
+        for family, fargs in family_args.items():
+            print(f"\n===== {family} =====", flush=True)
+            plan_sweep(area_ids, dist_mat, source_ids, fargs, family, mem_limit_gb=args.plan_mem_limit_gb)
+        return
+
+    stores = {}
+    if args.model_store and args.model_output_dir:
+        # One store per family: shared object directory, separate statistics.
+        stores = {family: ModelStore(args.model_store, fmt=args.model_store_format)
+                  for family in models if family in ("rf", "svr")}
+
+    evaluation_results = run_all_targets(area_ids, dist_mat, source_ids, args, family_args, stores)
+
+    for family, fargs in family_args.items():
+        if family == "dgm":
+            FAMILIES[family].save_results(evaluation_results[family], fargs)
+        else:
+            FAMILIES[family].save_results(evaluation_results[family], fargs, store=stores.get(family))
+
+
+if __name__ == "__main__":
+    main()
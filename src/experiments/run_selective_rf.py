@@ -7,10 +7,21 @@ import os
 import random
 import sys
 import joblib
+import time
 from tqdm import tqdm
-from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 from src.utils.dataset import CommutingODPairDataset
+from src.utils.eval_sampling import eval_sample_suffix, load_sampled_test_set
+from src.utils.metrics import od_metrics_from_pairs
+from src.models.preprocessing import (
+    PREPROCESSORS, PreprocessedModel, preprocess_suffix, preprocessed_training_set, training_set_digest
+)
+from src.models.tree_engines import RF_ENGINES, BinnedForest, QuantileBinner, make_rf
+from src.utils.planning import plan_sweep
+from src.utils.selection import build_id_index, build_selection_table, source_indices
+from src.utils.model_store import STORE_FORMATS, ModelStore
+from src.utils.sharding import parse_shard, shard_filename, shard_run_id, shard_targets
+from src.utils.train_cache import TrainingSetCache, load_training_set
 
 
 def load_fgw_distances(fgw_dir, alpha):
@@ -87,15 +98,70 @@ def extract_xy(data_dir, areas, max_samples=None, seed=42):
     return X, y
 
 
-def train_and_evaluate_rf(X_train, y_train, X_test, y_test, target_id, args):
-    """Train, evaluate, and optionally persist the RandomForest model."""
+def engine_suffix(args):
+    """File-name suffix of non-default engines, so their results never overwrite the plain forest."""
+    return "" if args.rf_engine == "rf" else f"_{args.rf_engine}"
 
-    print(f"    [Train] Starting RandomForest training...", flush=True)
-    model = RandomForestRegressor(n_estimators=100, n_jobs=-1, random_state=args.seed)
-    model.fit(X_train, y_train)
-    
+
+# Binned copy of the most recent training set, keyed by its content. Targets whose selections
+# load the same training set (cache hits and shared-memory sets are new array objects each time)
+# reuse the bins; the 'all' condition passes the same object and skips even the digest.
+_binned_train = {"X": None, "key": None, "binner": None, "X_binned": None}
+
+
+def binned_training_set(X_train, y_train, args):
+    """Fit quantile bins once per training set and return (binner, binned X_train)."""
+    if _binned_train["X"] is not X_train:
+        key = (training_set_digest(X_train, y_train), args.rf_max_bins, args.seed)
+        if _binned_train["key"] != key:
+            binner = QuantileBinner(max_bins=args.rf_max_bins, seed=args.seed).fit(X_train)
+            _binned_train.update(key=key, binner=binner, X_binned=binner.transform(X_train))
+        _binned_train["X"] = X_train
+    return _binned_train["binner"], _binned_train["X_binned"]
+
+
+def train_and_evaluate_rf(X_train, y_train, X_test, y_test, target_id, args, store=None, sample=None):
+    """
+    Train, evaluate, and optionally persist the RandomForest model.
+    With a PairSample, X_test/y_test are its sampled pairs and mse is the stratified
+    estimate of the full-matrix MSE.
+    Returns (mse, train_info) with the engine, timings and throughput.
+    """
+    preprocess_info = {}
+    if args.preprocess != "none":
+        preprocessor, X_train, preprocess_info = preprocessed_training_set(X_train, y_train, args)
+
+    print(f"    [Train] Starting RandomForest training (engine={args.rf_engine})...", flush=True)
+    fit_start = time.perf_counter()
+    if args.rf_engine == "rf_hist":
+        binner, X_fit = binned_training_set(X_train, y_train, args)
+        model = BinnedForest(binner, make_rf(args.rf_engine, args))
+    else:
+        model, X_fit = make_rf(args.rf_engine, args), X_train
+    if args.preprocess != "none":
+        model = PreprocessedModel(preprocessor, model)
+    model.fit(X_fit, y_train)
+    fit_seconds = time.perf_counter() - fit_start
+
+    predict_start = time.perf_counter()
     pred = model.predict(X_test)
-    mse = float(mean_squared_error(y_test, pred))
+    predict_seconds = time.perf_counter() - predict_start
+    sample_info = {}
+    if sample is None:
+        mse = float(mean_squared_error(y_test, pred))
+    else:
+        mse, sample_info = sample.estimate_mse(pred, y_test)
+    train_info = {
+        "rf_engine": args.rf_engine,
+        "fit_seconds": fit_seconds,
+        "predict_seconds": predict_seconds,
+        "fit_samples_per_sec": len(y_train) / fit_seconds if fit_seconds > 0 else None,
+        "predict_samples_per_sec": len(y_test) / predict_seconds if predict_seconds > 0 else None,
+        **preprocess_info,
+        **sample_info,
+    }
+    if args.full_metrics:
+        train_info["od_metrics"] = od_metrics_from_pairs(pred, y_test)
 
     if args.model_output_dir:
         model_save_dir = os.path.join(
@@ -106,62 +172,77 @@ def train_and_evaluate_rf(X_train, y_train, X_test, y_test, target_id, args):
         
         now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         param_str = f"topk{args.top_k}_ms{args.max_samples}"
-        fname = f"rf_target{target_id}_{param_str}_{now}.joblib"
+        fname = f"rf_target{target_id}_{param_str}{engine_suffix(args)}{preprocess_suffix(args)}_{now}.joblib"
         save_path = os.path.join(model_save_dir, fname)
         
-        joblib.dump(model, save_path)
+        if store is not None:
+            meta = {"family": "rf", "target_id": target_id, "condition": args.condition,
+                    "alpha": args.alpha, "seed": args.seed, "engine": args.rf_engine}
+            save_path = store.save(model, save_path, meta=meta)
+        else:
+            joblib.dump(model, save_path)
         print(f"    [INFO] Saved model -> {save_path}", flush=True)
 
-    return mse
+    return mse, train_info
 
 
-def run_all_targets(area_ids, dist_mat, source_ids, args):
+def run_all_targets(area_ids, dist_mat, source_ids, args, store=None):
     """Evaluate the selective transfer configuration for every target area."""
     print(f"[INFO] Loading targets from {args.targets_path}", flush=True)
     with open(args.targets_path) as f:
         targets_raw = [line.strip() for line in f if line.strip()]
-    targets = [t for t in targets_raw if t in area_ids]
+    id_index = build_id_index(area_ids)
+    targets = [t for t in targets_raw if t in id_index]
+    # Select the source areas of every target in one vectorized pass. The table is built
+    # over the full target list before sharding: the random condition draws by position
+    # in that list, so each shard must select exactly what an unsharded run would.
+    selection = build_selection_table(
+        area_ids, dist_mat, source_ids, targets, args.condition,
+        top_k=args.top_k, bottom_k=args.bottom_k, seed=args.seed, id_index=id_index
+    )
+    if args.shard:
+        targets = shard_targets(targets, args.shard)
+        print(f"[INFO] Shard {args.shard}: {len(targets)} targets.", flush=True)
+
+    cache = None
+    if args.cache_dir:
+        max_bytes = int(args.cache_max_gb * 1024 ** 3) if args.cache_max_gb else None
+        cache = TrainingSetCache(args.cache_dir, max_bytes=max_bytes)
 
     X_train_all, y_train_all = None, None
     if args.condition == "all":
         print("[INFO] Condition is 'all'. Pre-loading training data once...", flush=True)
-        sidx_all = np.array([np.where(area_ids == sid)[0][0] for sid in source_ids if sid in area_ids])
-        selected_areas_all = area_ids[sidx_all]
-        X_train_all, y_train_all = extract_xy(args.data_dir, selected_areas_all, args.max_samples, seed=args.seed)
+        selected_areas_all = area_ids[source_indices(source_ids, id_index)]
+        # With --shm_dir the matrices are published once in shared memory and concurrent
+        # jobs with the same sources, max_samples and seed attach to the same pages.
+        X_train_all, y_train_all = load_training_set(
+            extract_xy, args.data_dir, selected_areas_all, args.max_samples, args.seed,
+            cache=cache, shm_dir=args.shm_dir, shm_keep=args.shm_keep)
         if len(X_train_all) == 0:
             print("[ERROR] Pre-loading failed for 'all' condition. Aborting.", file=sys.stderr, flush=True)
             return []
 
     results_list = []
     print(f"[INFO] Evaluating {len(targets)} targets...", flush=True)
-    
-    # Pre-compute source indices once instead of inside the loop.
-    sidx = np.array([np.where(area_ids == sid)[0][0] for sid in source_ids if sid in area_ids])
 
     for target in tqdm(targets, desc="Evaluating Targets"):
         print(f"--- Evaluating target: {target} ---", flush=True)
         try:
+            train_info = {}
             # --- 1. Load test data for the current target ---
-            X_test, y_test = extract_xy(args.data_dir, [target], max_samples=None, seed=args.seed)
+            sample = None
+            if args.eval_sample_size:
+                X_test, y_test, sample = load_sampled_test_set(args.data_dir, target, args.eval_sample_size, args.seed)
+            else:
+                X_test, y_test = extract_xy(args.data_dir, [target], max_samples=None, seed=args.seed)
 
             # --- 2. Prepare training data based on the selection strategy ---
             if args.condition == "all":
                 X_train, y_train = X_train_all, y_train_all
             else:
-                tidx = np.where(area_ids == target)[0][0]
-                dists = dist_mat[tidx, sidx]
-
-                if args.condition == "topk":
-                    selected_indices = sidx[np.argsort(dists)[:args.top_k]]
-                elif args.condition == "bottomk":
-                    selected_indices = sidx[np.argsort(-dists)[:args.bottom_k]]
-                elif args.condition == "random":
-                    selected_indices = np.random.choice(sidx, args.top_k, replace=False)
-                else:
-                    raise ValueError(f"Unknown condition: {args.condition}")
-                
-                selected_areas = area_ids[selected_indices]
-                X_train, y_train = extract_xy(args.data_dir, selected_areas, args.max_samples, seed=args.seed)
+                selected_areas = selection[target]
+                X_train, y_train = load_training_set(
+                    extract_xy, args.data_dir, selected_areas, args.max_samples, args.seed, cache=cache)
 
             # --- 3. Train and evaluate if data is available ---
             if len(X_train) == 0:
@@ -169,17 +250,18 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
             elif len(X_test) == 0:
                 status, mse_val = "skipped_no_test_data", None
             else:
-                mse_val = train_and_evaluate_rf(X_train, y_train, X_test, y_test, target, args)
+                mse_val, train_info = train_and_evaluate_rf(X_train, y_train, X_test, y_test, target, args, store=store, sample=sample)
                 status = "success" if not np.isnan(mse_val) else "skipped_nan_mse"
 
             # --- 4. Persist results ---
             result_item = {
                 "target_id": target,
                 "mse": float(mse_val) if mse_val is not None else None,
-                "test_samples": len(y_test),
+                "test_samples": len(y_test) if sample is None else sample.n_pairs,
                 "train_samples": len(y_train),
                 "status": status
             }
+            result_item.update(train_info)
             results_list.append(result_item)
             
             if status == "success": print(f"    -> MSE: {mse_val:.4f}\n", flush=True)
@@ -195,40 +277,21 @@ def run_all_targets(area_ids, dist_mat, source_ids, args):
     return results_list
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Selective Transfer Learning with RandomForest")
-    parser.add_argument('--data_dir', type=str, required=True)
-    parser.add_argument('--fgw_dir', type=str, required=True)
-    parser.add_argument('--targets_path', type=str, required=True)
-    parser.add_argument('--sources_path', type=str, required=True)
-    parser.add_argument('--results_dir', type=str, default='results')
-    parser.add_argument('--model_output_dir', type=str, default='outputs')
-    parser.add_argument('--condition', type=str, required=True, choices=['topk', 'bottomk', 'random', 'all'])
-    parser.add_argument('--top_k', type=int, default=100)
-    parser.add_argument('--bottom_k', type=int, default=100)
-    parser.add_argument('--alpha', type=int, default=50)
-    parser.add_argument('--max_samples', type=int, default=5000)
-    parser.add_argument('--seed', type=int, default=42)
-    args = parser.parse_args()
-
-    random.seed(args.seed)
-    np.random.seed(args.seed)
-    os.environ['PYTHONHASHSEED'] = str(args.seed)
-
-    area_ids, dist_mat = load_fgw_distances(args.fgw_dir, args.alpha)
-    with open(args.sources_path) as f:
-        source_ids = [line.strip() for line in f if line.strip()]
-
-    evaluation_results = run_all_targets(area_ids, dist_mat, source_ids, args)
-
+def save_results(evaluation_results, args, store=None):
+    """Write the results JSON of one run under results_dir and return its path."""
     final_output = {
         "metadata": vars(args),
         "results": evaluation_results,
         "execution_datetime": datetime.datetime.now().isoformat()
     }
+    if store is not None:
+        store.report()
+        final_output["model_store"] = store.stats()
     
+    # Shard outputs are kept out of raw/ until merge_shards.py combines them.
+    layout_dir = "shards" if args.shard else "raw"
     results_save_dir = os.path.join(
-        args.results_dir, "rf", "raw",
+        args.results_dir, "rf", layout_dir,
         args.condition,
         f"alpha{args.alpha}",
         f"seed{args.seed}"
@@ -238,8 +301,15 @@ def main():
     param_str = (
         f"topk{args.top_k}"
         f"_ms{args.max_samples}"
+        f"{engine_suffix(args)}"
+        f"{preprocess_suffix(args)}"
+        f"{eval_sample_suffix(args)}"
     )
     fname = f"{param_str}.json"
+    if args.shard:
+        run_id = shard_run_id(args)
+        final_output["shard"] = {"spec": args.shard, "run_id": run_id, "merged_filename": fname}
+        fname = shard_filename(param_str, args.shard, run_id)
     
     output_path = os.path.join(results_save_dir, fname)
 
@@ -247,6 +317,77 @@ def main():
         json.dump(final_output, f, indent=4)
         
     print(f"\n[INFO] Successfully saved evaluation results to: {output_path}")
+    return output_path
+
+
+def build_parser(add_help=True):
+    parser = argparse.ArgumentParser(description="Selective Transfer Learning with RandomForest", add_help=add_help)
+    parser.add_argument('--data_dir', type=str, required=True)
+    parser.add_argument('--fgw_dir', type=str, required=True)
+    parser.add_argument('--targets_path', type=str, required=True)
+    parser.add_argument('--sources_path', type=str, required=True)
+    parser.add_argument('--results_dir', type=str, default='results')
+    parser.add_argument('--model_output_dir', type=str, default='outputs')
+    parser.add_argument('--condition', type=str, required=True, choices=['topk', 'bottomk', 'random', 'all'])
+    parser.add_argument('--top_k', type=int, default=100)
+    parser.add_argument('--bottom_k', type=int, default=100)
+    parser.add_argument('--alpha', type=int, default=50)
+    parser.add_argument('--max_samples', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rf_engine', type=str, default='rf', choices=RF_ENGINES, help="rf: forest on raw features; rf_hist: subsampled, depth-bounded forest on binned features; hgb: HistGradientBoostingRegressor.")
+    parser.add_argument('--rf_max_bins', type=int, default=255, help="Quantile bins per feature for rf_hist/hgb.")
+    parser.add_argument('--rf_max_samples', type=float, default=0.5, help="Bootstrap sample fraction per tree for rf_hist.")
+    parser.add_argument('--rf_max_depth', type=int, default=20, help="Maximum tree depth for rf_hist.")
+    parser.add_argument('--rf_n_jobs', type=int, default=-1, help="Worker threads of the rf/rf_hist forests (-1 = all cores).")
+    parser.add_argument('--preprocess', type=str, default='none', choices=PREPROCESSORS, help="Feature preprocessing fitted once per training set: standardization, standardization + PCA, or univariate feature selection.")
+    parser.add_argument('--preprocess_components', type=float, default=None, help="pca: variance fraction (<1) or number of components; select: fraction (<1) or number of features. Defaults: pca 0.95, select 0.5.")
+    parser.add_argument('--full_metrics', action='store_true', help="Also record the full OD metric suite (cal_od_metrics) of every target under od_metrics.")
+    parser.add_argument('--eval_sample_size', type=int, default=None, help="Score a stratified sample of this many test pairs (nonzero/zero flows) instead of all N^2; the MSE becomes an unbiased estimate with a 95%% confidence interval.")
+    parser.add_argument('--model_store', type=str, default=None, help="Save models into this content-addressed store (deduplicated) and write .ref.json references under model_output_dir.")
+    parser.add_argument('--model_store_format', type=str, default='compressed', choices=STORE_FORMATS, help="compressed joblib, plain joblib, or plain joblib loaded with mmap_mode='r' (shares SVR arrays; forest trees are still copied on load).")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Persistent cache of extracted training sets.")
+    parser.add_argument('--cache_max_gb', type=float, default=50)
+    parser.add_argument('--shm_dir', type=str, default=None, help="Share the 'all' training matrices read-only through this tmpfs directory.")
+    parser.add_argument('--shm_keep', action='store_true', help="Keep the --shm_dir entry after the last process using it exits (default: it is removed).")
+    parser.add_argument('--shard', type=str, default=None, help="Process only shard i of n of the targets, given as i/n.")
+    parser.add_argument('--run_id', type=str, default=None, help="Id shared by the shards of one run, part of their file names (default: a digest of the other arguments); pass e.g. the array job id to keep reruns apart.")
+    parser.add_argument('--plan', action='store_true', help="Only print the predicted per-target cost and sweep budget.")
+    parser.add_argument('--plan_mem_limit_gb', type=float, default=40)
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    try:
+        parse_shard(args.shard)
+        shard_run_id(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.eval_sample_size is not None and args.eval_sample_size < 2:
+        parser.error("--eval_sample_size must be at least 2.")
+    if args.eval_sample_size and args.full_metrics:
+        parser.error("--full_metrics needs every test pair and cannot be combined with --eval_sample_size.")
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    os.environ['PYTHONHASHSEED'] = str(args.seed)
+
+    area_ids, dist_mat = load_fgw_distances(args.fgw_dir, args.alpha)
+    with open(args.sources_path) as f:
+        source_ids = [line.strip() for line in f if line.strip()]
+
+    if args.plan:
+        plan_sweep(area_ids, dist_mat, source_ids, args, "rf", mem_limit_gb=args.plan_mem_limit_gb)
+        return
+
+    store = None
+    if args.model_store and args.model_output_dir:
+        store = ModelStore(args.model_store, fmt=args.model_store_format)
+
+    evaluation_results = run_all_targets(area_ids, dist_mat, source_ids, args, store=store)
+
+    save_results(evaluation_results, args, store=store)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,95 @@
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class DeepGravityEnsemble(nn.Module):
+    """
+        M independent DeepGravityReg models trained side by side.
+        Layer weights are stacked as (M, in_dim, out_dim) and biases as (M, 1, out_dim),
+        so one forward pass over x of shape (M, B, input_dim) is a single batched
+        matmul per layer instead of M tiny ones.
+        n_models: number of stacked members
+        input_dim, hidden_dims: same meaning as in DeepGravityReg
+    """
+    def __init__(self, n_models, input_dim, hidden_dims=[64, 64]):
+        super().__init__()
+        self.n_models = n_models
+        self.input_dim = input_dim
+        self.hidden_dims = list(hidden_dims)
+        dims = [input_dim] + self.hidden_dims + [1]
+
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for in_dim, out_dim in zip(dims[:-1], dims[1:]):
+            # Same distribution as nn.Linear's default initialization, drawn per member.
+            bound = 1 / math.sqrt(in_dim)
+            self.weights.append(nn.Parameter(torch.empty(n_models, in_dim, out_dim).uniform_(-bound, bound)))
+            self.biases.append(nn.Parameter(torch.empty(n_models, 1, out_dim).uniform_(-bound, bound)))
+
+    def forward(self, x):
+        """x: (M, B, input_dim) -> (M, B)"""
+        h = x
+        last = len(self.weights) - 1
+        for layer, (w, b) in enumerate(zip(self.weights, self.biases)):
+            h = torch.baddbmm(b, h, w)
+            if layer < last:
+                h = F.leaky_relu(h)
+        return h.squeeze(-1)
+
+    def member_state_dict(self, m):
+        """State dict of member m, loadable into DeepGravityReg(input_dim, hidden_dims)."""
+        state = {}
+        n_hidden = len(self.hidden_dims)
+        for layer in range(n_hidden):
+            state[f"feature_extractor.{2 * layer}.weight"] = self.weights[layer][m].detach().t().clone()
+            state[f"feature_extractor.{2 * layer}.bias"] = self.biases[layer][m, 0].detach().clone()
+        state["output_layer.weight"] = self.weights[n_hidden][m].detach().t().clone()
+        state["output_layer.bias"] = self.biases[n_hidden][m, 0].detach().clone()
+        return state
+
+
+class MemberAdam:
+    """
+        Adam over stacked ensemble parameters with independent per-member state.
+        Adam's moments are elementwise and therefore already per member; the step
+        count is kept per member as well, and members masked out of a step are left
+        untouched. Each member thus follows exactly the trajectory torch.optim.Adam
+        would give it if it were trained on its own.
+    """
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8):
+        self.params = list(params)
+        self.lr = lr
+        self.beta1, self.beta2 = betas
+        self.eps = eps
+        n_models = self.params[0].shape[0]
+        self.steps = torch.zeros(n_models, device=self.params[0].device)
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self, active):
+        """active: (M,) bool tensor of members that took part in this step."""
+        self.steps += active.to(self.steps.dtype)
+        # Inactive members keep step 0 until their first update; clamp avoids 0/0.
+        t = self.steps.clamp(min=1)
+        bias_c1 = 1 - self.beta1 ** t
+        bias_c2_sqrt = torch.sqrt(1 - self.beta2 ** t)
+
+        for p, m, v in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            if p.grad is None:
+                continue
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            mask = active.view(shape)
+            g = p.grad
+            m.copy_(torch.where(mask, self.beta1 * m + (1 - self.beta1) * g, m))
+            v.copy_(torch.where(mask, self.beta2 * v + (1 - self.beta2) * g * g, v))
+            denom = v.sqrt() / bias_c2_sqrt.view(shape) + self.eps
+            update = (self.lr / bias_c1).view(shape) * m / denom
+            p.sub_(torch.where(mask, update, torch.zeros_like(update)))
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -29,6 +30,63 @@ class DeepGravityReg(nn.Module):
         flow_pred = self.output_layer(features).squeeze(-1)
         return flow_pred
 
+    # --- Factorized path ---
+    # The input is [feat_o (F), feat_d (F), dis (1)], so the first layer splits into
+    # W_o @ feat_o + W_d @ feat_d + w_dis * dis + b. Projecting every node once per
+    # area costs O(N*F*H); combining the projections per pair costs O(N^2*H), and the
+    # (N, N, 2F+1) pair feature tensor is never built.
+
+    def node_projections(self, feat):
+        """
+            feat: (N, F) node features of one area
+            :return: (P_o, P_d), each (N, H); the first-layer bias is folded into P_o
+        """
+        first = self.feature_extractor[0]
+        n_feat = (first.in_features - 1) // 2
+        W = first.weight
+        P_o = feat @ W[:, :n_feat].T + first.bias
+        P_d = feat @ W[:, n_feat:2 * n_feat].T
+        return P_o, P_d
+
+    def _forward_from_first_layer(self, h1):
+        """Run the network from the first layer's pre-activations onward."""
+        features = self.feature_extractor[1:](h1)
+        return self.output_layer(features).squeeze(-1)
+
+    def forward_pairs(self, feat, dis_pairs, o_idx, d_idx, projections=None):
+        """
+            Predict flows for selected pairs of one area from node features.
+            feat: (N, F) node features
+            dis_pairs: (P,) distance of every pair
+            o_idx, d_idx: (P,) origin and destination node indices
+            projections: optional (P_o, P_d) from node_projections, to reuse across calls
+            :return: (P,) predicted flows, equal to forward() on the concatenated features
+        """
+        P_o, P_d = self.node_projections(feat) if projections is None else projections
+        w_dis = self.feature_extractor[0].weight[:, -1]
+        h1 = P_o[o_idx] + P_d[d_idx] + dis_pairs[:, None] * w_dis
+        return self._forward_from_first_layer(h1)
+
+    def iter_od_blocks(self, feat, dis, rows_per_block=None):
+        """
+            Yield the predicted OD matrix of one area in blocks of origin rows.
+            feat: (N, F) node features, dis: (N, N) distances
+            rows_per_block: origins per block (None = all rows at once)
+            :return: iterator of (row_start, (rows, N) predictions)
+        """
+        N = feat.shape[0]
+        rows_per_block = N if rows_per_block is None else max(1, rows_per_block)
+        P_o, P_d = self.node_projections(feat)
+        w_dis = self.feature_extractor[0].weight[:, -1]
+        for start in range(0, N, rows_per_block):
+            stop = min(start + rows_per_block, N)
+            h1 = P_o[start:stop, None, :] + P_d[None, :, :] + dis[start:stop, :, None] * w_dis
+            yield start, self._forward_from_first_layer(h1)
+
+    def predict_od(self, feat, dis, rows_per_block=None):
+        """Full (N, N) predicted OD matrix of one area via the factorized path."""
+        return torch.cat([block for _, block in self.iter_od_blocks(feat, dis, rows_per_block)], dim=0)
+
 
 # --- 2. DeepGravity_tsinghua benchmark implementation ---
 class DeepGravity_tsinghua(nn.Module):
@@ -74,9 +132,14 @@ class OD_normer():
 
 
 class GravityPower(nn.Module):
-    """Classical gravity model that follows a power-law formulation."""
+    """
+        Classical gravity model that follows a power-law formulation.
+        log(flow) = log_k + alpha * log(pop_o) + beta * log(pop_d) - gamma * log(distance)
+        log_k starts at 0, which reproduces the original model without a scale term.
+    """
     def __init__(self):
         super().__init__()
+        self.log_k = nn.Parameter(torch.tensor(0.0))
         self.alpha = nn.Parameter(torch.tensor(1.0))
         self.beta = nn.Parameter(torch.tensor(1.0))
         self.gamma = nn.Parameter(torch.tensor(1.0))
@@ -86,7 +149,8 @@ class GravityPower(nn.Module):
         # Expected input x: [origin_pop, dest_pop, distance]
         origin_pop, dest_pop, distance = x[:, 0], x[:, 1], x[:, 2]
         eps = 1e-8
-        log_y = (self.alpha * torch.log(origin_pop + eps) +
+        log_y = (self.log_k +
+                 self.alpha * torch.log(origin_pop + eps) +
                  self.beta * torch.log(dest_pop + eps) -
                  self.gamma * torch.log(distance + eps))
         return log_y
@@ -97,9 +161,14 @@ class GravityPower(nn.Module):
 
 
 class GravityExponential(nn.Module):
-    """Classical gravity model that follows an exponential formulation."""
+    """
+        Classical gravity model that follows an exponential formulation.
+        log(flow) = log_k + alpha * log(pop_o) + beta * log(pop_d) - gamma * distance
+        log_k starts at 0, which reproduces the original model without a scale term.
+    """
     def __init__(self):
         super().__init__()
+        self.log_k = nn.Parameter(torch.tensor(0.0))
         self.alpha = nn.Parameter(torch.tensor(1.0))
         self.beta = nn.Parameter(torch.tensor(1.0))
         self.gamma = nn.Parameter(torch.tensor(0.01))
@@ -108,7 +177,69 @@ class GravityExponential(nn.Module):
         # Expected input x: [origin_pop, dest_pop, distance]
         origin_pop, dest_pop, distance = x[:, 0], x[:, 1], x[:, 2]
         eps = 1e-8
-        log_y = (self.alpha * torch.log(origin_pop + eps) + 
+        log_y = (self.log_k +
+                 self.alpha * torch.log(origin_pop + eps) + 
                  self.beta * torch.log(dest_pop + eps) - 
                  self.gamma * distance)
         return torch.exp(log_y)
+
+    def predict_flow(self, x):
+        """Same as forward(); mirrors GravityPower.predict_flow."""
+        return self.forward(x)
+
+
+# --- 3. Closed-form fitting of the classical gravity models ---
+# Both models are linear in log space: log(flow) = a . [1, log pop_o, log pop_d, g(d)]
+# with g = log for GravityPower and the identity for GravityExponential. A least-squares
+# fit over a set of areas therefore only needs the per-area normal equations
+# (A^T A, A^T b) over nonzero flows, which add up across areas.
+
+GRAVITY_MODELS = {"power": GravityPower, "exponential": GravityExponential}
+GRAVITY_EPS = 1e-8
+
+
+def gravity_design(pop_o, pop_d, distance, form):
+    """
+        Design matrix of the log-linear gravity regression.
+        pop_o, pop_d, distance: (P,) arrays of the pairs
+        :return: (P, 4) float64 array [1, log pop_o, log pop_d, g(distance)]
+    """
+    dist_term = np.log(distance + GRAVITY_EPS) if form == "power" else distance
+    return np.stack([
+        np.ones_like(pop_o, dtype=np.float64),
+        np.log(pop_o + GRAVITY_EPS),
+        np.log(pop_d + GRAVITY_EPS),
+        dist_term,
+    ], axis=1).astype(np.float64)
+
+
+def gravity_normal_equations(pop, dis, od, form):
+    """
+        Normal equations of one area over its nonzero flows.
+        pop: (N,) node populations, dis: (N, N) distances, od: (N, N) flows
+        :return: (A^T A (4, 4), A^T log(flow) (4,), number of nonzero pairs)
+    """
+    o_idx, d_idx = np.nonzero(od > 0)
+    A = gravity_design(pop[o_idx], pop[d_idx], dis[o_idx, d_idx], form)
+    b = np.log(od[o_idx, d_idx].astype(np.float64))
+    return A.T @ A, A.T @ b, len(b)
+
+
+def solve_gravity(gram, rhs):
+    """
+        Batched least-squares solve of stacked normal equations.
+        gram: (T, 4, 4), rhs: (T, 4) -> (T, 4) coefficients [log_k, alpha, beta, -gamma].
+        The pseudo-inverse keeps rank-deficient systems (e.g. constant distances) finite.
+    """
+    return np.einsum("tij,tj->ti", np.linalg.pinv(gram), rhs)
+
+
+def gravity_from_coefficients(form, coef):
+    """Build a GravityPower/GravityExponential model from solve_gravity() coefficients."""
+    model = GRAVITY_MODELS[form]()
+    with torch.no_grad():
+        model.log_k.fill_(float(coef[0]))
+        model.alpha.fill_(float(coef[1]))
+        model.beta.fill_(float(coef[2]))
+        model.gamma.fill_(-float(coef[3]))
+    return model
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import joblib
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.feature_selection import SelectKBest, VarianceThreshold, f_regression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.utils.shared_arrays import ENTRY_PREFIX, array_key, entry_dir
+
+
+PREPROCESSORS = ("none", "standard", "pca", "select")
+
+# Default --preprocess_components: variance kept by pca, fraction of features kept by select.
+DEFAULT_COMPONENTS = {"pca": 0.95, "select": 0.5}
+
+# Bump whenever make_preprocessor changes, so stale cache entries are never reused.
+PREPROCESS_VERSION = 1
+PREPROCESSOR_FILE = "preprocessor.joblib"
+
+
+def resolve_components(kind, n_components):
+    return DEFAULT_COMPONENTS.get(kind) if n_components is None else n_components
+
+
+def preprocess_suffix(args):
+    """File-name suffix of a preprocessing stage, e.g. _pca0.95 or _select20; empty without one."""
+    if args.preprocess == "none":
+        return ""
+    if args.preprocess == "standard":
+        return "_standard"
+    return f"_{args.preprocess}{resolve_components(args.preprocess, args.preprocess_components):g}"
+
+
+def make_preprocessor(kind, n_features, n_components=None, seed=42):
+    """
+        Build an unfitted preprocessing pipeline for [feat_o, feat_d, dis] features.
+        standard: per-feature standardization
+        pca:      standardization + PCA; n_components < 1 is the fraction of variance kept
+        select:   constant columns dropped, standardization, then the k features with the
+                  highest univariate F-score; n_components < 1 is the fraction of features kept
+    """
+    n_components = resolve_components(kind, n_components)
+    if kind == "standard":
+        return make_pipeline(StandardScaler())
+    if kind == "pca":
+        if n_components >= 1:
+            n_components = min(int(n_components), n_features)
+        return make_pipeline(StandardScaler(), PCA(n_components=n_components, random_state=seed))
+    if kind == "select":
+        k = max(1, int(round(n_components * n_features))) if n_components < 1 else int(n_components)
+        # A k above the number of non-constant columns keeps them all (sklearn warns).
+        return make_pipeline(VarianceThreshold(), StandardScaler(), SelectKBest(f_regression, k=k))
+    raise ValueError(f"Unknown preprocessing {kind!r}; expected one of {PREPROCESSORS}.")
+
+
+class PreprocessedModel:
+    """
+        Estimator fitted on preprocessed features.
+        The preprocessor is fitted once per training set and shared by every model
+        trained on that set; predict() applies it to raw test features.
+    """
+    def __init__(self, preprocessor, model):
+        self.preprocessor = preprocessor
+        self.model = model
+
+    def fit(self, X_preprocessed, y):
+        self.model.fit(X_preprocessed, y)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(self.preprocessor.transform(X))
+
+
+def training_set_digest(X, y, rows_per_block=65536):
+    """sha256 of the training arrays, streamed block by block (works on memory maps)."""
+    h = hashlib.sha256()
+    h.update(str((X.shape, X.dtype.str)).encode("utf-8"))
+    for start in range(0, len(X), rows_per_block):
+        h.update(np.ascontiguousarray(X[start:start + rows_per_block]).data)
+    h.update(np.ascontiguousarray(y).data)
+    return h.hexdigest()
+
+
+def _load_or_fit(X, y, kind, n_components, seed, cache_dir):
+    """Fitted preprocessor for (X, y), read from or written to cache_dir when given."""
+    if not cache_dir:
+        return make_preprocessor(kind, X.shape[1], n_components, seed).fit(X, y), False
+
+    key = array_key("prep", PREPROCESS_VERSION, kind, resolve_components(kind, n_components), seed,
+                    training_set_digest(X, y))
+    path = os.path.join(entry_dir(cache_dir, key), PREPROCESSOR_FILE)
+    if os.path.exists(path):
+        os.utime(entry_dir(cache_dir, key), None)
+        return joblib.load(path), True
+
+    preprocessor = make_preprocessor(kind, X.shape[1], n_components, seed).fit(X, y)
+    # Written to a temporary entry and renamed into place, like the training-set entries,
+    # so it is evicted together with them by TrainingSetCache.
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{ENTRY_PREFIX}{key}.", dir=cache_dir)
+    try:
+        joblib.dump(preprocessor, os.path.join(tmp_path, PREPROCESSOR_FILE))
+        os.rename(tmp_path, entry_dir(cache_dir, key))
+    except OSError:
+        # Another process stored the same entry first.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return preprocessor, False
+
+
+# Preprocessed copy of the most recent training set. The 'all' condition and the combined
+# runner hand the same array object to every target and family, so it is fitted once.
+_fitted = {"X": None, "config": None, "preprocessor": None, "X_out": None, "info": None}
+_fitted_lock = threading.Lock()
+
+
+def preprocessed_training_set(X_train, y_train, args):
+    """
+        Fit the --preprocess stage once per training set.
+        Returns (preprocessor, transformed X_train, info); info records the input and
+        output widths, the fit time and whether the fit came from --cache_dir.
+    """
+    config = (args.preprocess, resolve_components(args.preprocess, args.preprocess_components), args.seed)
+    with _fitted_lock:
+        if _fitted["X"] is not X_train or _fitted["config"] != config:
+            start = time.perf_counter()
+            preprocessor, cached = _load_or_fit(
+                X_train, y_train, args.preprocess, args.preprocess_components, args.seed,
+                getattr(args, "cache_dir", None))
+            X_out = np.ascontiguousarray(preprocessor.transform(X_train))
+            info = {
+                "preprocess": args.preprocess,
+                "n_features_in": int(X_train.shape[1]),
+                "n_features_out": int(X_out.shape[1]),
+                "preprocess_seconds": time.perf_counter() - start,
+                "preprocess_cached": cached,
+            }
+            print(f"    [Preprocess] {args.preprocess}: {info['n_features_in']} -> {info['n_features_out']} "
+                  f"features ({'cached' if cached else 'fitted'}, {info['preprocess_seconds']:.2f}s).", flush=True)
+            _fitted.update(X=X_train, config=config, preprocessor=preprocessor, X_out=X_out, info=info)
+        return _fitted["preprocessor"], _fitted["X_out"], dict(_fitted["info"])
@@ -0,0 +1,40 @@
+import numpy as np
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVR, LinearSVR
+
+
+SVR_ENGINES = ("exact", "linear", "nystroem", "rff")
+
+
+def scale_gamma(X):
+    """gamma='scale' of sklearn's SVR: 1 / (n_features * X.var())."""
+    var = float(np.var(X))
+    return 1.0 / (X.shape[1] * var) if var > 0 else 1.0
+
+
+def make_svr(engine, X_train, n_components=1000, seed=42, max_iter=5000):
+    """
+        Build an unfitted SVR estimator for the given engine.
+        exact:    kernel SVR (RBF, gamma='scale'); O(n^2)-O(n^3) fit
+        linear:   standardized features + LinearSVR; O(n) fit, no kernel
+        nystroem: Nystroem RBF features + LinearSVR; O(n * n_components^2)
+        rff:      random Fourier RBF features + LinearSVR; O(n * n_components * d)
+        The approximate engines use the same RBF kernel and gamma as the exact SVR
+        (computed from X_train) and the same epsilon-insensitive loss with C=1.
+    """
+    if engine == "exact":
+        return SVR()
+    if engine == "linear":
+        return make_pipeline(StandardScaler(), LinearSVR(random_state=seed, max_iter=max_iter))
+
+    n_components = min(n_components, len(X_train)) if engine == "nystroem" else n_components
+    gamma = scale_gamma(X_train)
+    if engine == "nystroem":
+        features = Nystroem(kernel="rbf", gamma=gamma, n_components=n_components, random_state=seed)
+    elif engine == "rff":
+        features = RBFSampler(gamma=gamma, n_components=n_components, random_state=seed)
+    else:
+        raise ValueError(f"Unknown SVR engine {engine!r}; expected one of {SVR_ENGINES}.")
+    return make_pipeline(features, LinearSVR(random_state=seed, max_iter=max_iter))
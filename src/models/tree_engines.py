@@ -0,0 +1,73 @@
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+
+RF_ENGINES = ("rf", "rf_hist", "hgb")
+
+
+class QuantileBinner:
+    """
+        Per-feature quantile binning into at most max_bins uint8 codes.
+        Edges are fitted on up to subsample rows, so fitting stays cheap on large sets.
+    """
+    def __init__(self, max_bins=255, subsample=200000, seed=42):
+        if not 2 <= max_bins <= 256:
+            raise ValueError("max_bins must be in [2, 256].")
+        self.max_bins = max_bins
+        self.subsample = subsample
+        self.seed = seed
+
+    def fit(self, X):
+        X = np.asarray(X)
+        if len(X) > self.subsample:
+            rows = np.random.RandomState(self.seed).choice(len(X), self.subsample, replace=False)
+            X = X[np.sort(rows)]
+        quantiles = np.linspace(0, 1, self.max_bins + 1)[1:-1]
+        self.edges_ = [np.unique(np.quantile(X[:, f], quantiles)) for f in range(X.shape[1])]
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X)
+        out = np.empty(X.shape, dtype=np.uint8)
+        for f, edges in enumerate(self.edges_):
+            out[:, f] = np.searchsorted(edges, X[:, f], side="right")
+        return out
+
+
+class BinnedForest:
+    """
+        RandomForestRegressor trained on quantile-binned features.
+        The binner is fitted once per training set and shared by every forest trained
+        on that set; predict() bins raw features with the same edges.
+    """
+    def __init__(self, binner, forest):
+        self.binner = binner
+        self.forest = forest
+
+    def fit(self, X_binned, y):
+        self.forest.fit(X_binned, y)
+        return self
+
+    def predict(self, X):
+        return self.forest.predict(self.binner.transform(X))
+
+
+def make_rf(engine, args):
+    """
+        Build an unfitted tree model for the given engine.
+        rf:      the original 100-tree RandomForestRegressor on raw features
+        rf_hist: 100-tree RandomForestRegressor on binned features, bootstrap
+                 subsampling (--rf_max_samples) and bounded depth (--rf_max_depth)
+        Both forests fit with --rf_n_jobs threads.
+        hgb:     HistGradientBoostingRegressor, which bins internally (--rf_max_bins)
+    """
+    if engine == "rf":
+        return RandomForestRegressor(n_estimators=100, n_jobs=args.rf_n_jobs, random_state=args.seed)
+    if engine == "rf_hist":
+        return RandomForestRegressor(
+            n_estimators=100, n_jobs=args.rf_n_jobs, random_state=args.seed,
+            max_samples=args.rf_max_samples, max_depth=args.rf_max_depth
+        )
+    if engine == "hgb":
+        return HistGradientBoostingRegressor(max_bins=min(args.rf_max_bins, 255), random_state=args.seed)
+    raise ValueError(f"Unknown RF engine {engine!r}; expected one of {RF_ENGINES}.")
@@ -0,0 +1,33 @@
+import torch
+
+
+class TensorBatchIterator:
+    """
+        Minibatch iterator over tensors that are already in memory.
+        Replaces TensorDataset + DataLoader for small models: every epoch draws one
+        index permutation, gathers each tensor once in that order and yields
+        contiguous slices, so there is no per-sample indexing or collation.
+    """
+    def __init__(self, *tensors, batch_size=32, shuffle=True, generator=None):
+        if not tensors:
+            raise ValueError("At least one tensor is required.")
+        n = tensors[0].shape[0]
+        if any(t.shape[0] != n for t in tensors):
+            raise ValueError("All tensors must have the same first dimension.")
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = generator
+        self.num_samples = n
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            perm = torch.randperm(self.num_samples, generator=self.generator)
+            tensors = [t[perm] for t in self.tensors]
+        else:
+            tensors = self.tensors
+        for start in range(0, self.num_samples, self.batch_size):
+            yield tuple(t[start:start + self.batch_size] for t in tensors)
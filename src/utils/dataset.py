@@ -3,6 +3,43 @@ import random
 import numpy as np
 import torch
 
+def load_area_features(root, area, toy_flag=False):
+    """
+        Load one area as node features instead of pair features.
+        :return: feat (N, F) float32, dis (N, N) float32, od (N, N)
+                 with the same F as CommutingODPairDataset (demos + pois, or the
+                 first demographic column when toy_flag is set)
+    """
+    prefix = os.path.join(root, area)
+    demos = np.load(f"{prefix}/demos.npy")
+    pois  = np.load(f"{prefix}/pois.npy")
+    dis   = np.load(f"{prefix}/dis.npy")
+    od    = np.load(f"{prefix}/od.npy")
+    if toy_flag:
+        feat = demos[:, [0]]
+    else:
+        feat = np.concatenate([demos, pois], axis=1)
+    return feat.astype(np.float32), dis.astype(np.float32), od
+
+
+def iter_pair_feature_blocks(feat, dis, rows_per_block):
+    """
+        Yield the pair features of one area in blocks of origin rows, with the same
+        [feat_o, feat_d, dis] layout and row-major (i, j) order as CommutingODPairDataset.
+        Only one block of rows_per_block * N pairs is materialized at a time.
+        :return: iterator of (row_start, (rows * N, 2F+1) float32 array)
+    """
+    N, F = feat.shape
+    rows_per_block = max(1, rows_per_block)
+    for start in range(0, N, rows_per_block):
+        stop = min(start + rows_per_block, N)
+        X = np.empty((stop - start, N, 2 * F + 1), dtype=np.float32)
+        X[:, :, :F] = feat[start:stop, None, :]
+        X[:, :, F:2 * F] = feat[None, :, :]
+        X[:, :, 2 * F] = dis[start:stop]
+        yield start, X.reshape(-1, 2 * F + 1)
+
+
 class CommutingODPairDataset(torch.utils.data.Dataset):
     """
         Dataset that treats every intra-area pair (i, j) as a sample.
@@ -0,0 +1,62 @@
+import json
+import warnings
+
+import numpy as np
+import torch
+
+
+# Exported DGM artifacts are TorchScript archives with the input schema stored as an
+# extra file. Loading one needs only torch: no model classes, no training code.
+SCHEMA_FILE = "schema.json"
+ARTIFACT_SUFFIX = ".torchscript.pt"
+FORMAT_VERSION = 1
+
+
+def _jit_load(path, extra_files):
+    # Recent torch releases flag torch.jit as deprecated; the archives still load fine.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+
+
+class DGMArtifact:
+    """
+        Standalone batched CPU inference on an exported DGM artifact.
+        The artifact applies its embedded feature normalization itself, so inputs are
+        the raw [feat_o (F), feat_d (F), dis] pair features described by schema.
+    """
+    def __init__(self, path, n_threads=None):
+        if n_threads is not None:
+            torch.set_num_threads(n_threads)
+        extra_files = {SCHEMA_FILE: ""}
+        self.module = _jit_load(path, extra_files)
+        self.module.eval()
+        self.schema = json.loads(extra_files[SCHEMA_FILE])
+        self.input_dim = self.schema["input_dim"]
+
+    def predict(self, X, batch_size=65536):
+        """
+            X: (P, input_dim) array of pair features
+            :return: (P,) float32 predicted flows
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.input_dim:
+            raise ValueError(f"Expected input of shape (P, {self.input_dim}), got {X.shape}.")
+        out = np.empty(len(X), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(X), batch_size):
+                batch = torch.from_numpy(X[start:start + batch_size])
+                out[start:start + len(batch)] = self.module(batch).numpy()
+        return out
+
+
+def load_dgm_artifact(path, n_threads=None):
+    """Load an exported DGM artifact for inference."""
+    return DGMArtifact(path, n_threads=n_threads)
+
+
+def read_schema(path):
+    """Read only the schema of an exported artifact."""
+    extra_files = {SCHEMA_FILE: ""}
+    _jit_load(path, extra_files)
+    return json.loads(extra_files[SCHEMA_FILE])
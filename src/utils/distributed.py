@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
+
+from src.models.gravity import DeepGravityReg
+from src.utils.precision import autocast
+
+
+def available_cpus():
+    """Number of CPUs this process may run on (respects Slurm/cgroup CPU sets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def train_dgm_ddp(X_train, y_train, X_val, y_val, config, n_workers, n_threads=None):
+    """
+        Train one DeepGravityReg with DistributedDataParallel over local CPU processes.
+        The training tensors are moved to shared memory once and every worker reads
+        its own shard of each epoch's permutation from them; gradients are averaged
+        with the gloo backend, so no GPU or network setup is needed.
+        X_val, y_val: optional validation split for early stopping (scored in parallel)
+        config: dict with epochs, batch_size, lr, seed, patience, min_delta, eval_chunk_size, precision
+        n_threads: torch threads per worker (default: available CPUs / n_workers)
+        :return: (state_dict, train_info)
+    """
+    if n_threads is None:
+        n_threads = max(1, available_cpus() // n_workers)
+    tensors = tuple(t.share_memory_() if t is not None else None for t in (X_train, y_train, X_val, y_val))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        init_method = f"file://{os.path.join(tmp, 'rendezvous')}"
+        out_path = os.path.join(tmp, "result.pt")
+        mp.spawn(
+            _worker, args=(n_workers, n_threads, init_method, tensors, config, out_path),
+            nprocs=n_workers, join=True
+        )
+        result = torch.load(out_path)
+    return result["state"], result["info"]
+
+
+def _sq_err_sum(model, X, y, chunk_size, precision):
+    total = 0.0
+    with torch.no_grad(), autocast(precision):
+        for start in range(0, len(X), chunk_size):
+            diff = model(X[start:start + chunk_size]).double() - y[start:start + chunk_size].double()
+            total += float((diff ** 2).sum())
+    return total
+
+
+def _worker(rank, world_size, n_threads, init_method, tensors, config, out_path):
+    torch.set_num_threads(n_threads)
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        X, y, X_val, y_val = tensors
+        torch.manual_seed(config["seed"])
+        model = DeepGravityReg(input_dim=X.shape[1])
+        ddp_model = DistributedDataParallel(model)
+        optimizer = torch.optim.Adam(ddp_model.parameters(), lr=config["lr"])
+
+        # Every rank draws the same permutation and takes an equal-sized slice, so all
+        # ranks run the same number of steps and each step averages one global batch.
+        n_local = len(X) // world_size
+        local_bs = max(1, config["batch_size"] // world_size)
+        generator = torch.Generator().manual_seed(config["seed"])
+
+        best_val_loss, best_epoch, best_state, bad_epochs = float("inf"), None, None, 0
+        epochs_run = 0
+        samples_per_sec = []
+        for epoch in range(config["epochs"]):
+            epochs_run = epoch + 1
+            model.train()
+            perm = torch.randperm(len(X), generator=generator)
+            idx = perm[rank * n_local:(rank + 1) * n_local]
+            X_local, y_local = X[idx], y[idx]
+
+            epoch_start = time.perf_counter()
+            epoch_loss = 0.0
+            for start in range(0, n_local, local_bs):
+                x_batch, y_batch = X_local[start:start + local_bs], y_local[start:start + local_bs]
+                optimizer.zero_grad()
+                with autocast(config["precision"]):
+                    loss = F.mse_loss(ddp_model(x_batch), y_batch)
+                loss.backward()
+                optimizer.step()
+                epoch_loss += loss.item() * x_batch.size(0)
+
+            stats = torch.tensor([epoch_loss, 0.0], dtype=torch.float64)
+            if X_val is not None:
+                model.eval()
+                # Each rank scores a strided share of the validation set.
+                stats[1] = _sq_err_sum(model, X_val[rank::world_size], y_val[rank::world_size],
+                                       config["eval_chunk_size"], config["precision"])
+            dist.all_reduce(stats)
+            samples_per_sec.append(n_local * world_size / (time.perf_counter() - epoch_start))
+            avg_epoch_loss = stats[0].item() / (n_local * world_size)
+
+            if X_val is None:
+                if rank == 0:
+                    print(f"    Epoch {epoch+1}/{config['epochs']}, Train Loss: {avg_epoch_loss:.6f}, "
+                          f"{samples_per_sec[-1]:.0f} samples/s ({world_size} workers)", flush=True)
+                continue
+
+            # The reduced loss is identical on every rank, so all ranks stop together.
+            val_loss = stats[1].item() / len(y_val)
+            if rank == 0:
+                print(f"    Epoch {epoch+1}/{config['epochs']}, Train Loss: {avg_epoch_loss:.6f}, "
+                      f"Val Loss: {val_loss:.6f}, {samples_per_sec[-1]:.0f} samples/s ({world_size} workers)",
+                      flush=True)
+            if val_loss < best_val_loss - config["min_delta"]:
+                best_val_loss, best_epoch, bad_epochs = val_loss, epoch + 1, 0
+                best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            else:
+                bad_epochs += 1
+                if bad_epochs >= config["patience"]:
+                    if rank == 0:
+                        print(f"    [Train] Early stopping at epoch {epoch+1}; best epoch {best_epoch}.", flush=True)
+                    break
+
+        if rank == 0:
+            info = {
+                "train_samples_per_sec": float(np.mean(samples_per_sec)) if samples_per_sec else None,
+                "epochs_run": epochs_run,
+                "ddp_workers": world_size,
+            }
+            if X_val is not None:
+                info.update({
+                    "best_epoch": best_epoch,
+                    "best_val_loss": float(best_val_loss) if best_epoch is not None else None,
+                    "val_samples": len(y_val),
+                })
+            torch.save({"state": best_state or model.state_dict(), "info": info}, out_path)
+    finally:
+        dist.destroy_process_group()
@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+
+from src.utils.dataset import load_area_features
+
+
+# Share of the --eval_sample_size budget drawn from the nonzero flows. They are a small
+# minority of the N^2 pairs but carry almost all of the squared error, so they are
+# oversampled; the estimate is reweighted by the stratum sizes and stays unbiased.
+NONZERO_SHARE = 0.5
+
+# Two-sided 95% normal quantile of the reported confidence interval.
+CI_Z = 1.959963984540054
+
+
+def eval_sample_suffix(args):
+    """File-name suffix of a sampled evaluation, e.g. _es20000; empty when every pair is scored."""
+    return f"_es{args.eval_sample_size}" if args.eval_sample_size else ""
+
+
+def stratum_allocation(sample_size, n_nonzero, n_zero):
+    """Pairs drawn from the (nonzero, zero) strata; a stratum smaller than its share is taken whole."""
+    take_nonzero = min(n_nonzero, max(int(sample_size * NONZERO_SHARE), sample_size - n_zero))
+    return take_nonzero, min(n_zero, sample_size - take_nonzero)
+
+
+class PairSample:
+    """
+        Stratified sample of the N^2 test pairs of one target (nonzero vs. zero flows).
+        idx holds the sampled positions in row-major (origin, destination) order, sorted.
+        estimate_mse() turns the squared errors of the sampled pairs into the stratified
+        estimate of the full-matrix MSE and its confidence interval.
+    """
+    def __init__(self, y_all, sample_size, seed=42):
+        y_all = np.asarray(y_all).reshape(-1)
+        nonzero = y_all != 0
+        nonzero_idx = np.flatnonzero(nonzero)
+        zero_idx = np.flatnonzero(~nonzero)
+        take_nonzero, take_zero = stratum_allocation(sample_size, len(nonzero_idx), len(zero_idx))
+
+        rng = np.random.default_rng(seed)
+        self.idx = np.sort(np.concatenate([
+            rng.choice(nonzero_idx, take_nonzero, replace=False),
+            rng.choice(zero_idx, take_zero, replace=False),
+        ]))
+        self.n_pairs = len(y_all)
+        self.n_nonzero = len(nonzero_idx)
+        self.is_nonzero = nonzero[self.idx]
+
+    def __len__(self):
+        return len(self.idx)
+
+    def origins_destinations(self, n_regions):
+        """(origin, destination) node indices of the sampled pairs."""
+        return np.divmod(self.idx, n_regions)
+
+    def estimate_mse(self, pred, y_sample):
+        """
+            Stratified MSE estimate from the predictions of the sampled pairs.
+            Each stratum's mean squared error is weighted by its share of all N^2 pairs;
+            the variance includes the finite-population correction, so a census of a
+            stratum contributes no uncertainty.
+            :return: (mse, info) with eval_samples, eval_samples_nonzero, mse_ci_low, mse_ci_high
+        """
+        sq_err = (np.asarray(pred, dtype=np.float64).reshape(-1) - y_sample) ** 2
+        mse, var = 0.0, 0.0
+        for in_stratum, stratum_size in ((self.is_nonzero, self.n_nonzero),
+                                         (~self.is_nonzero, self.n_pairs - self.n_nonzero)):
+            taken = int(np.count_nonzero(in_stratum))
+            if taken == 0:
+                continue
+            errors = sq_err[in_stratum]
+            weight = stratum_size / self.n_pairs
+            mse += weight * errors.mean()
+            if taken > 1:
+                var += weight ** 2 * (1 - taken / stratum_size) * errors.var(ddof=1) / taken
+        mse, half_width = float(mse), CI_Z * math.sqrt(var)
+        info = {
+            "eval_samples": len(self),
+            "eval_samples_nonzero": int(np.count_nonzero(self.is_nonzero)),
+            "mse_ci_low": max(0.0, mse - half_width),
+            "mse_ci_high": mse + half_width,
+        }
+        return mse, info
+
+
+def load_sampled_test_set(data_dir, target, sample_size, seed=42, factorized=False):
+    """
+        Load a stratified sample of the target's OD pairs as the test set.
+        Pair features are built for the sampled pairs only, in the [feat_o, feat_d, dis]
+        layout of CommutingODPairDataset. With factorized=True X_test is the node
+        representation (feat, dis) instead, for DeepGravityReg.forward_pairs.
+        :return: X_test, y_test of the sampled pairs, and the PairSample
+    """
+    feat, dis, od = load_area_features(data_dir, target)
+    y_all = od.reshape(-1).astype(np.float32)
+    sample = PairSample(y_all, sample_size, seed)
+    y_test = y_all[sample.idx]
+    if factorized:
+        return (feat, dis), y_test, sample
+
+    o_idx, d_idx = sample.origins_destinations(feat.shape[0])
+    X_test = np.concatenate([feat[o_idx], feat[d_idx], dis[o_idx, d_idx, None]], axis=1)
+    return X_test, y_test, sample
@@ -32,6 +32,79 @@ def cal_od_metrics(a, b):
     return metrics
 
 
+def cal_od_metrics_fast(a, b):
+    '''
+    b has to be the groundtruth.
+    Returns the same values as cal_od_metrics(a, b) for numpy matrices, computed from
+    intermediates that are built once and shared: the error, absolute values, the
+    nonzero mask of b, the elementwise minimum and the clipped prediction.
+    Unlike cal_od_metrics, a is not modified. There, accuracy() zeroes a[a < 1] in place,
+    so COS similarity and the JSDs see the clipped prediction; here they use a clipped copy.
+    '''
+    a, b = np.asarray(a), np.asarray(b)
+    if (a < 0).any() or (b < 0).any():
+        raise ValueError("OD flow should not be less than zero.")
+
+    diff = a - b
+    sq_err = diff ** 2
+    abs_err = np.abs(diff)
+    abs_a, abs_b = np.abs(a), np.abs(b)
+    minimum = np.minimum(a, b)
+    nz = b != 0
+
+    rmse = np.sqrt(sq_err.mean())
+    abs_err_nz, abs_a_nz, abs_b_nz = abs_err[nz], abs_a[nz], abs_b[nz]
+
+    # accuracy() semantics: flows below 1 are predicted as no flow.
+    a_clip = a.copy()
+    a_clip[a_clip < 1] = 0
+    a_clip_sq, b_sq, ab = a_clip ** 2, b ** 2, a_clip * b
+    row_sim = ab.sum(0) / (np.sqrt(a_clip_sq.sum(0)) * np.sqrt(b_sq.sum(0)) + 1e-20)
+    col_sim = ab.sum(1) / (np.sqrt(a_clip_sq.sum(1)) * np.sqrt(b_sq.sum(1)) + 1e-20)
+
+    metrics = {
+        "num_regions" : num_regions(a, b),
+        "RMSE" : float(rmse),
+        "NRMSE" : float(rmse / b.std()),
+        "MAE" : float(abs_err.mean()),
+        "MAPE" : float((abs_err / (abs_b + 1)).mean()),
+        "SMAPE" : float((abs_err / ((abs_a + abs_b) / 2 + 1e-20)).mean()),
+        "CPC" : float(2 * minimum.sum() / (a.sum() + b.sum())),
+
+        "RMSE_nonzero" : float(np.sqrt(sq_err[nz].mean())),
+        "MAE_nonzero": float(abs_err_nz.mean()),
+        "MAPE_nonzero" : float((abs_err_nz / (abs_b_nz + 1)).mean()),
+        "SMAPE_nonzero" : float((abs_err_nz / ((abs_a_nz + abs_b_nz) / 2 + 1e-20)).mean()),
+        "CPC_nonzero" : float(2 * minimum[nz].sum() / (a[nz].sum() + b[nz].sum())),
+
+        "accuracy" : float(np.count_nonzero((a_clip != 0) == nz) / (a.shape[0] **2)),
+        "matrix_COS_similarity" : float((row_sim.sum() + col_sim.sum()) / (row_sim.shape[0] * 2)),
+        "JSD_inflow" : float(bucket_JSD(a_clip.sum(0), b.sum(0))),
+        "JSD_outflow" : float(bucket_JSD(a_clip.sum(1), b.sum(1))),
+        "JSD_ODflow" : float(bucket_JSD(a_clip.reshape([-1]), b.reshape([-1])))
+    }
+    return metrics
+
+
+def od_metrics_from_pairs(pred, y_true):
+    '''
+    cal_od_metrics_fast on flattened OD pairs in row-major (origin, destination) order,
+    as produced by CommutingODPairDataset and the runners' test sets.
+    Regression models can predict negative flows, for which CPC is undefined; they are
+    clipped to 0 first and their number is reported as negative_predictions.
+    '''
+    n = int(round(np.sqrt(len(y_true))))
+    if n * n != len(y_true):
+        raise ValueError(f"{len(y_true)} test pairs do not form a square OD matrix.")
+    pred = np.asarray(pred)
+    n_negative = int(np.count_nonzero(pred < 0))
+    if n_negative:
+        pred = np.maximum(pred, 0)
+    metrics = cal_od_metrics_fast(pred.reshape(n, n), np.asarray(y_true).reshape(n, n))
+    metrics["negative_predictions"] = n_negative
+    return metrics
+
+
 def RMSE(a, b):
     if type(a) == type(np.array([1, 1])):
         return np.sqrt(((a - b) **2).mean())
@@ -181,65 +254,66 @@ def matrix_COS_similarity(a, b):
     final_sim = (row_sim.sum() + col_sim.sum()) / (row_sim.shape[0] * 2)
     return final_sim
 
+def power_of_two_buckets(values):
+    """
+    Number of buckets values_to_bucket() uses for values: [0, 1), [1, 2), [2, 4), ...
+    up to the first power of two above values.max().
+    """
+    max_ = values.max()
+    if not np.isfinite(max_):
+        raise ValueError("OD flows must be finite to be bucketed.")
+    # max_ lies in [2^(e-1), 2^e), so the last bucket is [2^(e-1), 2^e) and there are e + 1.
+    return 1 if max_ < 1 else int(np.frexp(max_)[1]) + 1
+
+def power_of_two_histogram(values, n_buckets):
+    """
+    Counts of values in the n_buckets buckets [0, 1), [1, 2), ..., [2^(n-2), 2^(n-1)).
+    Each edge costs one vectorized comparison and count_nonzero; the count of a bucket is
+    the difference of the counts at or above its two edges. Negative, non-finite and too
+    large values are not counted, exactly as with per-bucket (v >= low) & (v < high) masks.
+    """
+    values = np.asarray(values).reshape(-1)
+    edges = [0] + [2 ** i for i in range(n_buckets)]
+    at_least = np.array([np.count_nonzero(values >= edge) for edge in edges], dtype=np.int64)
+    return at_least[:-1] - at_least[1:]
+
 def values_to_bucket(values):
     # 2的指数分桶
-    max_ = values.max()
-    i = 0
-    leftright = []
-    nums = []
-    while True:
-        if i == 0:
-            left = 0
-            right = 1
-            leftright.append(left)
-            leftright.append(right)
-            i += 1
-        else:
-            left = i
-            right = i * 2
-            leftright.append(right)
-            i = i *2
-        nums.append(((values >= left) & (values <right)).sum())
-
-        if right > max_:
-            break
+    n_buckets = power_of_two_buckets(values)
+    leftright = [0] + [2 ** i for i in range(n_buckets)]
+    nums = list(power_of_two_histogram(values, n_buckets))
     return leftright, nums
 
 def JS_divergence(p, q):
     M = (p + q) / 2
     return 0.5 * entropy(p, M, base=2) + 0.5 * entropy(q, M, base=2)
 
+def bucket_JSD(a_values, b_values):
+    """
+    JSD between the power-of-two histograms of a_values and b_values.
+    b should be the label; its maximum sets the buckets.
+    """
+    n_buckets = power_of_two_buckets(b_values)
+    return histogram_JSD(power_of_two_histogram(a_values, n_buckets),
+                         power_of_two_histogram(b_values, n_buckets))
+
+def histogram_JSD(a_counts, b_counts):
+    """JSD between two bucket-count histograms over the same buckets."""
+    a_dist = a_counts / a_counts.sum()
+    b_dist = b_counts / b_counts.sum()
+    return JS_divergence(a_dist, b_dist)
+
 def JSD_in(a, b):
     """
     b should be the label.
     """
-    a_in, b_in = a.sum(0), b.sum(0)
-    sections, b_dist = values_to_bucket(b_in)
-    a_dist = []
-    for i in range(len(sections)-1):
-        low, high = sections[i], sections[i+1]
-        frequency = np.sum((a_in >= low) & (a_in < high))
-        a_dist.append(frequency)
-    a_dist = np.array(a_dist) / np.array(a_dist).sum()
-    b_dist = np.array(b_dist) / np.array(b_dist).sum()
-    
-    return JS_divergence(a_dist, b_dist)
+    return bucket_JSD(a.sum(0), b.sum(0))
 
 def JSD_out(a, b):
     """
     b should be the label.
     """
-    a_out, b_out = a.sum(1), b.sum(1)
-    sections, b_dist = values_to_bucket(b_out)
-    a_dist = []
-    for i in range(len(sections)-1):
-        low, high = sections[i], sections[i+1]
-        frequency = np.sum((a_out >= low) & (a_out < high))
-        a_dist.append(frequency)
-    a_dist = np.array(a_dist) / np.array(a_dist).sum()
-    b_dist = np.array(b_dist) / np.array(b_dist).sum()
-    
-    return JS_divergence(a_dist, b_dist)
+    return bucket_JSD(a.sum(1), b.sum(1))
 
 def JSD_indegree(a, b):
     return JSD_in(a, b)
@@ -254,17 +328,7 @@ def JSD_outflow(a, b):
     return JSD_out(a, b)
 
 def JSD_ODflow(a, b):
-    a, b = a.reshape([-1]), b.reshape([-1])
-    sections, b_dist = values_to_bucket(b)
-    a_dist = []
-    for i in range(len(sections) - 1):
-        low, high = sections[i], sections[i+1]
-        frequency = np.sum( (a >= low) & (a < high) )
-        a_dist.append(frequency)
-    a_dist = np.array(a_dist) / np.array(a_dist).sum()
-    b_dist = np.array(b_dist) / np.array(b_dist).sum()
-
-    return JS_divergence(a_dist, b_dist)
+    return bucket_JSD(a.reshape([-1]), b.reshape([-1]))
 
 def false_negative_rate(a, b):
     """
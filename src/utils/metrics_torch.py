@@ -0,0 +1,167 @@
+import math
+
+import torch
+
+
+# Order of the keys returned by od_metrics_torch, as in cal_od_metrics.
+METRIC_KEYS = (
+    "RMSE", "NRMSE", "MAE", "MAPE", "SMAPE", "CPC",
+    "RMSE_nonzero", "MAE_nonzero", "MAPE_nonzero", "SMAPE_nonzero", "CPC_nonzero",
+    "accuracy", "matrix_COS_similarity", "JSD_inflow", "JSD_outflow", "JSD_ODflow",
+)
+
+
+def _as_batch(a, b):
+    """(B, N, N) float views of a and b; half-precision inputs are promoted to float32."""
+    if a.shape != b.shape or a.dim() not in (2, 3) or a.shape[-1] != a.shape[-2]:
+        raise ValueError(f"Expected (N, N) or (B, N, N) OD matrices; got {tuple(a.shape)} and {tuple(b.shape)}.")
+    if a.dtype not in (torch.float32, torch.float64):
+        a = a.float()
+    b = b.to(device=a.device, dtype=a.dtype)
+    if a.dim() == 2:
+        return a.unsqueeze(0), b.unsqueeze(0)
+    return a, b
+
+
+def max_buckets(dtype):
+    """Upper bound of power_of_two_buckets() for any finite value of dtype."""
+    return math.frexp(torch.finfo(dtype).max)[1] + 1
+
+
+def power_of_two_buckets(values):
+    """
+    Per-row bucket count of values (B, M), as metrics.power_of_two_buckets:
+    [0, 1), [1, 2), [2, 4), ... up to the first power of two above the row maximum.
+    """
+    max_ = values.amax(-1)
+    return torch.where(max_ < 1, torch.ones_like(max_, dtype=torch.int64),
+                       torch.frexp(max_)[1].long() + 1)
+
+
+def power_of_two_histograms(values, n_buckets):
+    """
+    Per-row counts (B, max_buckets) of values (B, M) in the power-of-two buckets.
+    Buckets at or beyond a row's n_buckets stay empty, and negative, non-finite and
+    too large values are not counted, exactly as with metrics.power_of_two_histogram.
+    Every value is binned once (frexp exponent + bincount), so the whole batch is
+    counted without synchronizing with the host.
+    """
+    B = values.shape[0]
+    width = max_buckets(values.dtype)
+    # v in [2^(e-1), 2^e) has frexp exponent e and lies in bucket e; all of [0, 1) in bucket 0.
+    bucket = torch.frexp(values)[1].long().clamp_(min=0)
+    counted = (values >= 0) & torch.isfinite(values) & (bucket < n_buckets[:, None])
+    # Uncounted values go to one extra slot per row, which is dropped.
+    bucket.masked_fill_(~counted, width)
+    bucket += torch.arange(B, device=values.device)[:, None] * (width + 1)
+    counts = torch.bincount(bucket.reshape(-1), minlength=B * (width + 1))
+    return counts.reshape(B, width + 1)[:, :width]
+
+
+def histogram_JSD(a_counts, b_counts):
+    """Base-2 JSD between the rows of two bucket-count histograms (B, K), in float64."""
+    p = a_counts.double() / a_counts.sum(-1, keepdim=True)
+    q = b_counts.double() / b_counts.sum(-1, keepdim=True)
+    m = (p + q) / 2
+    # Empty buckets contribute nothing, as in scipy.stats.entropy.
+    kl_p = torch.where(p > 0, p * torch.log2(p / m), torch.zeros_like(p)).sum(-1)
+    kl_q = torch.where(q > 0, q * torch.log2(q / m), torch.zeros_like(q)).sum(-1)
+    return 0.5 * kl_p + 0.5 * kl_q
+
+
+def bucket_JSD(a_values, b_values):
+    """
+    Per-row JSD between the power-of-two histograms of a_values and b_values (B, M).
+    b should be the label; the maximum of each of its rows sets that row's buckets.
+    """
+    n_buckets = power_of_two_buckets(b_values)
+    return histogram_JSD(power_of_two_histograms(a_values, n_buckets),
+                         power_of_two_histograms(b_values, n_buckets))
+
+
+def od_metrics_torch(a, b, inplace=False):
+    '''
+    b has to be the groundtruth.
+    The cal_od_metrics suite of one (N, N) or a batch of (B, N, N) OD matrices, computed
+    on their device and returned as {name: (B,) tensor}; only the input checks reach the host.
+    With inplace=True a is clipped in place (flows below 1 set to 0, as accuracy() does in
+    cal_od_metrics) instead of into a copy, so scoring a model output needs no extra N^2 buffer.
+    '''
+    a, b = _as_batch(a, b)
+    negative, not_finite = torch.stack([(a < 0).any() | (b < 0).any(), ~torch.isfinite(b).all()]).tolist()
+    if negative:
+        raise ValueError("OD flow should not be less than zero.")
+    if not_finite:
+        raise ValueError("OD flows must be finite to be bucketed.")
+    dims = (-2, -1)
+    N = a.shape[-1]
+
+    diff = a - b
+    sq_err = diff ** 2
+    abs_err = diff.abs()
+    abs_sum = a.abs() + b.abs()
+    minimum = torch.minimum(a, b)
+    nz = b != 0
+    nz_f = nz.to(a.dtype)
+    n_nz = nz_f.sum(dims)
+
+    mape_terms = abs_err / (b.abs() + 1)
+    smape_terms = abs_err / (abs_sum / 2 + 1e-20)
+    rmse = sq_err.mean(dims).sqrt()
+    metrics = {
+        "RMSE": rmse,
+        "NRMSE": rmse / b.std(dim=dims, correction=0),
+        "MAE": abs_err.mean(dims),
+        "MAPE": mape_terms.mean(dims),
+        "SMAPE": smape_terms.mean(dims),
+        "CPC": 2 * minimum.sum(dims) / (a.sum(dims) + b.sum(dims)),
+
+        "RMSE_nonzero": ((sq_err * nz_f).sum(dims) / n_nz).sqrt(),
+        "MAE_nonzero": (abs_err * nz_f).sum(dims) / n_nz,
+        "MAPE_nonzero": (mape_terms * nz_f).sum(dims) / n_nz,
+        "SMAPE_nonzero": (smape_terms * nz_f).sum(dims) / n_nz,
+        "CPC_nonzero": 2 * (minimum * nz_f).sum(dims) / ((a * nz_f).sum(dims) + (b * nz_f).sum(dims)),
+    }
+    del diff, sq_err, abs_err, abs_sum, minimum, mape_terms, smape_terms
+
+    # accuracy() semantics: flows below 1 are predicted as no flow.
+    a_clip = a.masked_fill_(a < 1, 0) if inplace else a.masked_fill(a < 1, 0)
+    metrics["accuracy"] = ((a_clip != 0) == nz).sum(dims).double() / (N ** 2)
+    ab = a_clip * b
+    row_sim = ab.sum(-2) / ((a_clip ** 2).sum(-2).sqrt() * (b ** 2).sum(-2).sqrt() + 1e-20)
+    col_sim = ab.sum(-1) / ((a_clip ** 2).sum(-1).sqrt() * (b ** 2).sum(-1).sqrt() + 1e-20)
+    metrics["matrix_COS_similarity"] = (row_sim.sum(-1) + col_sim.sum(-1)) / (N * 2)
+    metrics["JSD_inflow"] = bucket_JSD(a_clip.sum(-2), b.sum(-2))
+    metrics["JSD_outflow"] = bucket_JSD(a_clip.sum(-1), b.sum(-1))
+    metrics["JSD_ODflow"] = bucket_JSD(a_clip.reshape(a.shape[0], -1), b.reshape(b.shape[0], -1))
+    return metrics
+
+
+def cal_od_metrics_torch(a, b, inplace=False):
+    '''
+    b has to be the groundtruth.
+    od_metrics_torch as plain floats, fetched from the device in a single transfer:
+    a dict like cal_od_metrics for (N, N) inputs, a list of them for (B, N, N).
+    '''
+    metrics = od_metrics_torch(a, b, inplace=inplace)
+    values = torch.stack([metrics[k].double() for k in METRIC_KEYS], dim=-1).tolist()
+    results = [{"num_regions": b.shape[-1], **dict(zip(METRIC_KEYS, row))} for row in values]
+    return results[0] if b.dim() == 2 else results
+
+
+def od_metrics_from_pairs_torch(pred, y_true, inplace=False):
+    '''
+    cal_od_metrics_torch on flattened OD pairs in row-major (origin, destination) order;
+    torch counterpart of metrics.od_metrics_from_pairs. Negative predictions are clipped
+    to 0 (in place with inplace=True) and their number is reported as negative_predictions.
+    '''
+    n = math.isqrt(y_true.shape[-1])
+    if n * n != y_true.shape[-1]:
+        raise ValueError(f"{y_true.shape[-1]} test pairs do not form a square OD matrix.")
+    negative = pred < 0
+    n_negative = negative.reshape(-1, n * n).sum(-1)
+    pred = pred.masked_fill_(negative, 0) if inplace else pred.masked_fill(negative, 0)
+    metrics = cal_od_metrics_torch(pred.reshape(-1, n, n), y_true.reshape(-1, n, n), inplace=inplace)
+    for item, count in zip(metrics, n_negative.tolist()):
+        item["negative_predictions"] = count
+    return metrics[0] if y_true.dim() == 1 else metrics
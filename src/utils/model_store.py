@@ -0,0 +1,152 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+
+import joblib
+
+
+STORE_FORMATS = ("compressed", "plain", "mmap")
+REF_SUFFIX = ".ref.json"
+
+
+class _HashingWriter:
+    """Write-only file object that hashes and counts the bytes joblib.dump produces."""
+    def __init__(self):
+        self.sha = hashlib.sha256()
+        self.n_bytes = 0
+
+    def write(self, data):
+        self.sha.update(data)
+        self.n_bytes += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.n_bytes
+
+
+def content_hash(model):
+    """
+        sha256 of the uncompressed joblib serialization of model, plus its size.
+        The pickle is streamed into the hash and never held in memory or on disk.
+    """
+    writer = _HashingWriter()
+    joblib.dump(model, writer)
+    return writer.sha.hexdigest(), writer.n_bytes
+
+
+def ref_path_for(model_path):
+    """Reference file written in place of a model file, e.g. x.joblib -> x.ref.json."""
+    stem, _ = os.path.splitext(model_path)
+    return stem + REF_SUFFIX
+
+
+class ModelStore:
+    """
+        Content-addressed store of fitted RF/SVR models.
+        Every model is serialized once under objects/<hash[:2]>/<hash>; identical models
+        (same configuration fitted on the same data) are written only once. Each save
+        leaves a small JSON reference where the model file used to go.
+        Formats:
+            compressed  joblib with zlib compression; smallest on disk
+            plain       uncompressed joblib
+            mmap        uncompressed joblib loaded with mmap_mode='r'. Plain numpy attributes
+                        (SVR support vectors and dual coefficients, approximate-kernel
+                        components, preprocessing and binning arrays) are paged in lazily and
+                        shared between processes. Forest node arrays are not: sklearn's Tree
+                        copies them into its own memory on load, so for RF this format
+                        behaves like plain
+    """
+    def __init__(self, root, fmt="compressed", compress=3):
+        if fmt not in STORE_FORMATS:
+            raise ValueError(f"Unknown model store format {fmt!r}; expected one of {STORE_FORMATS}.")
+        self.root = root
+        self.fmt = fmt
+        self.compress = compress
+        self.n_saved = 0
+        self.n_deduplicated = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+    def object_path(self, digest):
+        ext = ".joblib.z" if self.fmt == "compressed" else ".joblib"
+        return os.path.join(self.root, "objects", digest[:2], digest + ext)
+
+    def save(self, model, model_path, meta=None):
+        """
+            Store model and write its reference next to model_path.
+            :return: path of the reference file
+        """
+        digest, raw_size = content_hash(model)
+        obj_path = self.object_path(digest)
+        self.n_saved += 1
+        self.raw_bytes += raw_size
+
+        if os.path.exists(obj_path):
+            self.n_deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(obj_path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    joblib.dump(model, f, compress=self.compress if self.fmt == "compressed" else 0)
+                os.replace(tmp_path, obj_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self.written_bytes += os.path.getsize(obj_path)
+
+        ref = {
+            "object": os.path.relpath(obj_path, self.root),
+            "store_root": os.path.abspath(self.root),
+            "sha256": digest,
+            "format": self.fmt,
+            "raw_bytes": raw_size,
+            "stored_bytes": os.path.getsize(obj_path),
+            "created": datetime.datetime.now().isoformat(),
+        }
+        if meta:
+            ref["meta"] = meta
+        path = ref_path_for(model_path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(ref, f, indent=4)
+        return path
+
+    def stats(self):
+        """Counts and byte totals of this session; bytes_saved is raw size minus bytes written."""
+        return {
+            "format": self.fmt,
+            "models_saved": self.n_saved,
+            "models_deduplicated": self.n_deduplicated,
+            "raw_bytes": self.raw_bytes,
+            "written_bytes": self.written_bytes,
+            "bytes_saved": self.raw_bytes - self.written_bytes,
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"[ModelStore] {s['models_saved']} models saved ({s['models_deduplicated']} deduplicated), "
+              f"{s['written_bytes'] / 1024 ** 2:.1f} MB written for {s['raw_bytes'] / 1024 ** 2:.1f} MB of models; "
+              f"{s['bytes_saved'] / 1024 ** 2:.1f} MB saved.", flush=True)
+
+
+def load_model(ref_path, mmap=None):
+    """
+        Load a model from its reference file.
+        mmap: None follows the stored format; True/False forces memory mapping
+        (only possible for uncompressed objects).
+    """
+    with open(ref_path) as f:
+        ref = json.load(f)
+    obj_path = os.path.join(ref["store_root"], ref["object"])
+    if not os.path.exists(obj_path):
+        # The store may have been moved together with the references.
+        obj_path = os.path.join(os.path.dirname(ref_path), ref["object"])
+    use_mmap = ref["format"] == "mmap" if mmap is None else mmap
+    if use_mmap and ref["format"] == "compressed":
+        raise ValueError(f"{obj_path} is compressed and cannot be memory-mapped.")
+    return joblib.load(obj_path, mmap_mode="r" if use_mmap else None)
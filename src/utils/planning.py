@@ -0,0 +1,242 @@
+import math
+import os
+
+import numpy as np
+
+from src.utils.selection import build_id_index, build_selection_table, source_indices
+
+
+# Rough cost constants used by the planner. They are deliberately simple so
+# they can be re-fitted from the timings printed in job logs.
+BYTES_PER_SAMPLE_OBJECT = 800   # dict + two tensor objects per OD pair in CommutingODPairDataset
+BYTES_BASELINE = 2 * 1024 ** 3  # interpreter, torch/sklearn imports, FGW memmap pages
+FIT_COST_COEFFS = {
+    # seconds per (epoch * training sample), DataLoader overhead included
+    "dgm_train": 1.0e-5,
+    # seconds per test pair for the eager forward pass
+    "dgm_predict": 1.0e-7,
+    # seconds per (tree * sample * log2(sample) * feature), before n_jobs parallelism
+    "rf_train": 5.0e-8,
+    # seconds per (tree * test pair)
+    "rf_predict": 2.0e-7,
+    # seconds per (sample^2 * feature) for the libsvm solver
+    "svr_train": 1.0e-8,
+    # seconds per (support vector * test pair * feature); support vectors ~ half the training set
+    "svr_predict": 2.0e-9,
+}
+RF_N_ESTIMATORS = 100
+DGM_HIDDEN_DIMS = (64, 64)
+
+
+def read_area_shape(data_dir, area):
+    """
+        Return (N, F) for an area without loading the arrays.
+        Only the .npy headers are parsed through mmap_mode.
+    """
+    prefix = os.path.join(data_dir, area)
+    demos = np.load(os.path.join(prefix, "demos.npy"), mmap_mode="r")
+    pois = np.load(os.path.join(prefix, "pois.npy"), mmap_mode="r")
+    return demos.shape[0], demos.shape[1] + pois.shape[1]
+
+
+def dataset_peak_bytes(n_pairs, feat_dim):
+    """
+        Peak bytes of CommutingODPairDataset for n_pairs pairs of width feat_dim (2F+1).
+        The transient peak is the float64 repeat/concatenate in _make_feature_tensor;
+        the resident part is the float32 tensor plus one sample object per pair.
+    """
+    f = (feat_dim - 1) // 2
+    transient = n_pairs * (2 * f * 8 + feat_dim * 8 + feat_dim * 4)
+    resident = n_pairs * (feat_dim * 4 + BYTES_PER_SAMPLE_OBJECT)
+    return max(transient, resident)
+
+
+def estimate_extraction(area_shapes, max_samples):
+    """
+        Predict the size and peak memory of extract_xy over the given areas.
+        :param area_shapes: list of (N, F) per area
+        :return: (train_samples, peak_bytes, result_bytes)
+    """
+    if not area_shapes:
+        return 0, 0, 0
+    feat_dim = 2 * area_shapes[0][1] + 1
+    sizes = [n * n for n, _ in area_shapes]
+    total = sum(sizes)
+
+    if max_samples is None or total <= max_samples:
+        # All areas are materialized in a single dataset, then stacked.
+        n_samples = total
+        result_bytes = n_samples * (feat_dim + 1) * 4
+        return n_samples, dataset_peak_bytes(total, feat_dim) + result_bytes, result_bytes
+
+    # Areas are loaded one at a time; the sampled rows are concatenated and
+    # permuted, which briefly holds three copies of the output.
+    n_samples = max_samples
+    result_bytes = n_samples * (feat_dim + 1) * 4
+    return n_samples, dataset_peak_bytes(max(sizes), feat_dim) + 3 * result_bytes, result_bytes
+
+
+def estimate_test_set(n_regions, n_feat, args):
+    """
+        Predict the memory of one target's test set in the evaluation mode of args.
+        --eval_sample_size builds pair features for the sampled pairs only, after a
+        transient pass over the N^2 flows (OD matrix, masks, stratum indices);
+        --factorized_eval (DGM) keeps the node features and distances instead of pair features.
+        :return: (scored_pairs, peak_bytes, resident_bytes)
+    """
+    test_pairs = n_regions * n_regions
+    feat_dim = 2 * n_feat + 1
+    sample_size = getattr(args, "eval_sample_size", None)
+    factorized = getattr(args, "factorized_eval", False)
+    # dis (float32) + od (float64) as loaded by load_area_features.
+    area_bytes = n_regions * n_feat * 4 + test_pairs * (4 + 8)
+
+    if sample_size:
+        scored = min(sample_size, test_pairs)
+        # float32 flows, nonzero mask, int64 stratum indices and the copy made by rng.choice.
+        transient = area_bytes + test_pairs * (4 + 1 + 8 + 8)
+        if factorized:
+            resident = n_regions * n_feat * 4 + test_pairs * 4 + scored * (4 + 8)
+        else:
+            resident = scored * (feat_dim * 4 + 4 + 8)
+        return scored, transient + resident, resident
+    if factorized:
+        # (feat, dis) plus the flattened float32 flows.
+        resident = n_regions * n_feat * 4 + test_pairs * (4 + 4)
+        return test_pairs, area_bytes + resident, resident
+    _, peak, resident = estimate_extraction([(n_regions, n_feat)], None)
+    return test_pairs, peak, resident
+
+
+def dgm_inference_bytes(n_regions, n_feat, scored_pairs, args):
+    """
+        Activation memory of chunked DGM inference: at most --eval_chunk_size pairs at a
+        time, rounded up to whole origin rows on the full factorized path.
+    """
+    chunk = getattr(args, "eval_chunk_size", None) or scored_pairs
+    if getattr(args, "factorized_eval", False) and not getattr(args, "eval_sample_size", None):
+        chunk_pairs = max(1, chunk // n_regions) * n_regions
+    else:
+        chunk_pairs = chunk
+    chunk_pairs = min(scored_pairs, chunk_pairs)
+    return chunk_pairs * (sum(DGM_HIDDEN_DIMS) * 2 + 2 * n_feat + 1) * 4
+
+
+def estimate_fit_seconds(train_samples, test_pairs, feat_dim, epochs, n_jobs):
+    """Expected fit + predict time in seconds for every model family."""
+    c = FIT_COST_COEFFS
+    n = max(train_samples, 2)
+    return {
+        "dgm": c["dgm_train"] * epochs * train_samples + c["dgm_predict"] * test_pairs,
+        "rf": (c["rf_train"] * RF_N_ESTIMATORS * n * math.log2(n) * feat_dim / n_jobs
+               + c["rf_predict"] * RF_N_ESTIMATORS * test_pairs / n_jobs),
+        "svr": (c["svr_train"] * n * n * feat_dim
+                + c["svr_predict"] * (n / 2) * test_pairs * feat_dim),
+    }
+
+
+def plan_sweep(area_ids, dist_mat, source_ids, args, family, n_jobs=None, mem_limit_gb=None):
+    """
+        Print the per-target and sweep-level cost of one runner configuration.
+        Nothing is trained; only .npy headers and the FGW distances are read.
+        :param family: model family of the calling runner ('dgm', 'rf', 'svr');
+                       its peak memory also covers the model's own inference buffers.
+    """
+    if n_jobs is None:
+        n_jobs = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+    epochs = getattr(args, "epochs", 20)
+
+    with open(args.targets_path) as f:
+        targets_raw = [line.strip() for line in f if line.strip()]
+    id_index = build_id_index(area_ids)
+    targets = [t for t in targets_raw if t in id_index]
+    selection = build_selection_table(
+        area_ids, dist_mat, source_ids, targets, args.condition,
+        top_k=args.top_k, bottom_k=args.bottom_k, seed=args.seed, id_index=id_index
+    )
+
+    shape_cache = {}
+
+    def shapes_of(areas):
+        out = []
+        for area in areas:
+            if area not in shape_cache:
+                shape_cache[area] = read_area_shape(args.data_dir, area)
+            out.append(shape_cache[area])
+        return out
+
+    print(f"[PLAN] model={family}, condition={args.condition}, alpha={args.alpha}, seed={args.seed}, "
+          f"max_samples={args.max_samples}, epochs={epochs}, n_jobs={n_jobs}", flush=True)
+
+    # For 'all' the training set is extracted once and stays resident.
+    resident_train_bytes = 0
+    if args.condition == "all":
+        all_areas = area_ids[source_indices(source_ids, id_index)]
+        all_train_n, all_peak, resident_train_bytes = estimate_extraction(
+            shapes_of(all_areas), args.max_samples)
+
+    header = f"{'target':>10} {'N':>6} {'train_n':>9} {'test_n':>10} {'peak_GB':>8} {'dgm_s':>9} {'rf_s':>9} {'svr_s':>10}"
+    print(header)
+    print("-" * len(header))
+
+    rows = []
+    for target in targets:
+        n_t, f_t = read_area_shape(args.data_dir, target)
+        feat_dim = 2 * f_t + 1
+        test_pairs, test_peak, test_bytes = estimate_test_set(n_t, f_t, args)
+
+        if args.condition == "all":
+            train_n, train_peak = all_train_n, all_peak
+            peak = max(train_peak, resident_train_bytes + test_peak)
+        else:
+            train_n, train_peak, train_bytes = estimate_extraction(
+                shapes_of(selection[target]), args.max_samples)
+            peak = max(test_peak, test_bytes + train_peak)
+
+        if family == "dgm":
+            # Pre- and post-activation hidden states (and inputs) of one evaluation chunk.
+            dgm_act_bytes = dgm_inference_bytes(n_t, f_t, test_pairs, args)
+            peak = max(peak, test_bytes + resident_train_bytes + dgm_act_bytes)
+        peak += BYTES_BASELINE
+
+        secs = estimate_fit_seconds(train_n, test_pairs, feat_dim, epochs, n_jobs)
+        rows.append((target, n_t, train_n, test_pairs, peak, secs))
+        print(f"{target:>10} {n_t:>6} {train_n:>9} {test_pairs:>10} {peak / 1024 ** 3:>8.2f} "
+              f"{secs['dgm']:>9.1f} {secs['rf']:>9.1f} {secs['svr']:>10.1f}")
+
+    if not rows:
+        print("[PLAN] No targets found.", flush=True)
+        return rows
+
+    max_peak = max(r[4] for r in rows)
+    worst = max(rows, key=lambda r: r[4])
+    print("-" * len(header))
+    print(f"[PLAN] Targets: {len(rows)}")
+    print(f"[PLAN] Peak memory: {max_peak / 1024 ** 3:.2f} GB (target {worst[0]}, N={worst[1]})")
+    suggested_mem = math.ceil(max_peak * 1.25 / 1024 ** 3)
+    print(f"[PLAN] Suggested --mem: {suggested_mem}G")
+    for fam in ("dgm", "rf", "svr"):
+        total = sum(r[5][fam] for r in rows)
+        print(f"[PLAN] {fam.upper():>3} expected time: {_format_seconds(total)} "
+              f"(suggested --time={_format_slurm_time(total * 1.5)})")
+
+    if mem_limit_gb is not None:
+        over = [r for r in rows if r[4] > mem_limit_gb * 1024 ** 3]
+        if over:
+            print(f"[PLAN] {len(over)} target(s) exceed {mem_limit_gb}G: "
+                  + ", ".join(f"{r[0]} ({r[4] / 1024 ** 3:.1f}G)" for r in over), flush=True)
+    return rows
+
+
+def _format_seconds(seconds):
+    hours, rem = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}h{minutes:02d}m{secs:02d}s"
+
+
+def _format_slurm_time(seconds):
+    seconds = int(math.ceil(seconds))
+    days, rem = divmod(seconds, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{days}-{hours:02d}:{minutes:02d}:{secs:02d}"
@@ -0,0 +1,15 @@
+import torch
+
+
+PRECISIONS = ("fp32", "bf16")
+
+
+def autocast(precision, device_type="cpu"):
+    """
+        Autocast context for the given precision.
+        "bf16" runs matmuls in bfloat16 while parameters, optimizer state and
+        losses stay in float32; "fp32" is a no-op context.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}.")
+    return torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=precision == "bf16")
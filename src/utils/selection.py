@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def build_id_index(area_ids):
+    """
+        Map every area id to its row/column in the FGW distance matrix.
+        Built once so that id lookups are O(1) instead of an O(A) np.where scan.
+    """
+    return {aid: i for i, aid in enumerate(np.asarray(area_ids).tolist())}
+
+
+def source_indices(source_ids, id_index):
+    """Rows of the known source areas, in the order of the source list."""
+    return np.array([id_index[sid] for sid in source_ids if sid in id_index], dtype=np.int64)
+
+
+def build_selection_table(area_ids, dist_mat, source_ids, targets, condition,
+                          top_k=100, bottom_k=100, seed=42, id_index=None):
+    """
+        Compute the selected source areas for every target in one vectorized pass.
+        :param area_ids: (A,) area ids, in the order of the FGW distance matrix
+        :param dist_mat: (A, A) FGW distance matrix (np.memmap is fine)
+        :param source_ids: candidate source area ids (unknown ids are dropped)
+        :param targets: target area ids (must be present in area_ids)
+        :param condition: one of 'topk', 'bottomk', 'random', 'all'
+        :return: dict target_id -> (k,) array of selected source area ids.
+                 For 'topk'/'bottomk' the ids are ordered by distance exactly as
+                 np.argsort(kind="stable") orders them (equal distances by position
+                 in the source list); for 'all' every target shares the same array
+                 of all known sources.
+    """
+    if id_index is None:
+        id_index = build_id_index(area_ids)
+
+    sidx = source_indices(source_ids, id_index)
+
+    if condition == "all" or len(targets) == 0:
+        selected_all = area_ids[sidx]
+        return {t: selected_all for t in targets}
+
+    tidx = np.array([id_index[t] for t in targets], dtype=np.int64)
+
+    if condition == "random":
+        # One uniform key per (target, source); the k smallest keys form a
+        # uniform sample without replacement for each target.
+        k = _check_k(top_k)
+        if k > len(sidx):
+            # As np.random.choice(sources, k, replace=False) did before.
+            raise ValueError(f"Cannot select {k} random sources from {len(sidx)} known sources.")
+        rng = np.random.RandomState(seed)
+        keys = rng.random_sample((len(tidx), len(sidx)))
+        order = _smallest_k(keys, k)
+    elif condition in ("topk", "bottomk"):
+        # One block read of the (targets x sources) submatrix; rows are read in
+        # ascending order so the memmap is scanned sequentially.
+        row_order = np.argsort(tidx, kind="stable")
+        block = np.empty((len(tidx), len(sidx)), dtype=np.float32)
+        block[row_order] = np.asarray(dist_mat[tidx[row_order]])[:, sidx]
+
+        if condition == "topk":
+            order = _smallest_k(block, min(_check_k(top_k), len(sidx)))
+        else:
+            order = _smallest_k(-block, min(_check_k(bottom_k), len(sidx)))
+    else:
+        raise ValueError(f"Unknown condition: {condition}")
+
+    selected = area_ids[sidx[order]]  # (T, k)
+    return {t: selected[row] for row, t in enumerate(targets)}
+
+
+def _check_k(k):
+    """Validate a selection size coming from the command line."""
+    if k is None or k < 0:
+        raise ValueError(f"Selection size must be a non-negative integer, got {k}")
+    return int(k)
+
+
+def _smallest_k(values, k):
+    """
+        Column indices of the k smallest entries of every row, sorted ascending;
+        identical to np.argsort(values, axis=1, kind="stable")[:, :k], so equal values
+        keep their column order. A partition finds each row's k-th smallest value,
+        which keeps the per-row cost at O(S + k log k) instead of O(S log S).
+        Rows must not contain NaN.
+    """
+    n_rows, n_cols = values.shape
+    if k == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if k >= n_cols:
+        return np.argsort(values, axis=1, kind="stable")
+    kth = np.partition(values, k - 1, axis=1)[:, k - 1:k]
+    below = values < kth
+    # Fill up to k with the lowest-column entries equal to the k-th value.
+    at_kth = values == kth
+    keep = below | (at_kth & (np.cumsum(at_kth, axis=1) <= k - below.sum(1, keepdims=True)))
+    part = np.nonzero(keep)[1].reshape(n_rows, k)
+    part_vals = np.take_along_axis(values, part, axis=1)
+    return np.take_along_axis(part, np.argsort(part_vals, axis=1, kind="stable"), axis=1)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import re
+
+
+SHARD_FILE_RE = re.compile(r"^(?P<stem>.+)\.shard(?P<index>\d+)of(?P<count>\d+)\.json$")
+
+
+def parse_shard(spec):
+    """
+        Parse a shard specification "i/n" into (i, n) with 0 <= i < n.
+        None means no sharding.
+    """
+    if spec is None:
+        return None
+    try:
+        index_str, count_str = spec.split("/")
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected the form i/n (e.g. 0/8).")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}', need 0 <= i < n.")
+    return index, count
+
+
+def shard_targets(targets, spec):
+    """
+        Return the targets handled by one shard.
+        Targets are dealt round-robin (i, i+n, i+2n, ...) so that large and small
+        areas, which tend to cluster in the list, spread evenly across shards.
+    """
+    shard = parse_shard(spec)
+    if shard is None:
+        return list(targets)
+    index, count = shard
+    return list(targets)[index::count]
+
+
+RUN_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Metadata that legitimately differs between the shards of one run.
+SHARD_LOCAL_KEYS = ("shard", "execution_datetime")
+
+
+def shard_run_id(args):
+    """
+        Id shared by every shard of one run and part of each shard's file name.
+        --run_id when given; otherwise a digest of all arguments but --shard, so shards
+        of different configurations never share a file name (identical reruns still do).
+    """
+    if getattr(args, "run_id", None):
+        if not RUN_ID_RE.match(args.run_id):
+            raise ValueError(f"Invalid run id '{args.run_id}', use letters, digits, '_' and '-' only.")
+        return args.run_id
+    config = {k: v for k, v in vars(args).items() if k not in SHARD_LOCAL_KEYS + ("run_id",)}
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def shard_filename(stem, spec, run_id):
+    """File name of one shard's partial results, e.g. ms50000_bs32_ep20.run1a2b3c4d5e6f.shard003of008.json."""
+    index, count = parse_shard(spec)
+    return f"{stem}.run{run_id}.shard{index:03d}of{count:03d}.json"
+
+
+def interleave_shard_results(shard_results):
+    """
+        Restore the original target order from per-shard result lists.
+        :param shard_results: list of result lists, ordered by shard index
+    """
+    merged = []
+    longest = max((len(r) for r in shard_results), default=0)
+    for j in range(longest):
+        for results in shard_results:
+            if j < len(results):
+                merged.append(results[j])
+    return merged
@@ -0,0 +1,195 @@
+import atexit
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+import torch
+
+
+DEFAULT_SHM_DIR = "/dev/shm"
+ENTRY_PREFIX = "tksgsot_"
+
+
+def array_key(*parts):
+    """Stable hex key for the given parts (area ids, sampling settings, ...)."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (list, tuple, np.ndarray)):
+            part = "\x1f".join(str(p) for p in part)
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()[:32]
+
+
+def entry_dir(directory, key):
+    return os.path.join(directory, f"{ENTRY_PREFIX}{key}")
+
+
+def attach_arrays(directory, key, names):
+    """
+        Open arrays published under key as read-only memory maps.
+        Returns a tuple ordered like names, or None if the entry does not exist.
+        Every process attaching the same entry shares the same physical pages.
+    """
+    path = entry_dir(directory, key)
+    if not os.path.isdir(path):
+        return None
+    return tuple(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in names)
+
+
+def publish_arrays(directory, key, names, arrays):
+    """
+        Write arrays once into directory (tmpfs by default) and return read-only views.
+        The entry is written to a temporary directory and renamed into place, so
+        readers never see a partially written entry.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{ENTRY_PREFIX}{key}.", dir=directory)
+    try:
+        for name, arr in zip(names, arrays):
+            arr = np.ascontiguousarray(arr)
+            out = np.lib.format.open_memmap(
+                os.path.join(tmp_path, f"{name}.npy"), mode="w+", dtype=arr.dtype, shape=arr.shape)
+            out[...] = arr
+            out.flush()
+            del out
+        os.rename(tmp_path, entry_dir(directory, key))
+    except OSError:
+        # Another process published the same entry first; use theirs.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(entry_dir(directory, key)):
+            raise
+    return attach_arrays(directory, key, names)
+
+
+def get_or_publish(directory, key, names, build_fn):
+    """
+        Attach to the arrays published under key, or build them with build_fn()
+        and publish them. A per-key file lock makes concurrent processes wait for
+        the first builder instead of building their own copy.
+    """
+    arrays = attach_arrays(directory, key, names)
+    if arrays is not None:
+        return arrays
+
+    os.makedirs(directory, exist_ok=True)
+    lock_path = os.path.join(directory, f".{ENTRY_PREFIX}{key}.lock")
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            arrays = attach_arrays(directory, key, names)
+            if arrays is None:
+                built = build_fn()
+                if any(len(a) == 0 for a in built):
+                    # Nothing worth sharing; hand the empty result back untouched.
+                    return built
+                arrays = publish_arrays(directory, key, names, built)
+                del built
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return arrays
+
+
+def release_arrays(directory, key):
+    """Remove a published entry. Processes that still map it keep their pages until they exit."""
+    shutil.rmtree(entry_dir(directory, key), ignore_errors=True)
+    try:
+        os.remove(os.path.join(directory, f".{ENTRY_PREFIX}{key}.lock"))
+    except FileNotFoundError:
+        pass
+
+
+# Entries this process reads: key -> (directory, readers file holding a shared lock, keep).
+_readers = {}
+
+
+def _readers_path(directory, key):
+    return os.path.join(directory, f".{ENTRY_PREFIX}{key}.readers")
+
+
+def register_reader(directory, key, keep=False):
+    """
+        Mark the entry under key as in use by this process until it exits.
+        Every reader holds a shared lock on the entry's readers file; at exit the last
+        reader removes the entry unless some reader asked to keep it. If a releasing
+        process unlinked the file while we waited for the lock, we retry on a new one.
+    """
+    if key in _readers:
+        directory, f, kept = _readers[key]
+        _readers[key] = (directory, f, kept or keep)
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = _readers_path(directory, key)
+    while True:
+        f = open(path, "a")
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    if not _readers:
+        atexit.register(release_readers)
+    _readers[key] = (directory, f, keep)
+
+
+def release_when_unused(key):
+    """
+        Drop this process's registration of key and remove the entry if no other
+        process has it registered. Returns True if the entry was removed.
+    """
+    directory, f, keep = _readers.pop(key)
+    try:
+        if keep:
+            return False
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        release_arrays(directory, key)
+        try:
+            os.remove(_readers_path(directory, key))
+        except FileNotFoundError:
+            pass
+        return True
+    finally:
+        f.close()
+
+
+def release_readers():
+    """Release every entry registered by this process; runs at exit."""
+    for key in list(_readers):
+        directory = _readers[key][0]
+        if release_when_unused(key):
+            print(f"[INFO] Released shared arrays {entry_dir(directory, key)}.", flush=True)
+
+
+def as_tensor(arr):
+    """
+        Zero-copy torch view of a numpy array, including read-only memory maps.
+        torch warns on non-writable arrays; the views are only ever read here.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+        return torch.from_numpy(arr)
+
+
+def shared_training_set(shm_dir, extract_fn, data_dir, areas, max_samples, seed, keep=False):
+    """
+        Training matrices of extract_fn(data_dir, areas, max_samples, seed=seed),
+        published once under shm_dir and returned as read-only shared views.
+        The entry is removed when the last process using it exits, unless keep is set.
+    """
+    key = array_key("xy", os.path.abspath(data_dir), list(areas), max_samples, seed)
+    # Registered before publishing, so a process that is just exiting cannot remove
+    # the entry between our attach and our first read.
+    register_reader(shm_dir, key, keep=keep)
+    return get_or_publish(
+        shm_dir, key, ("X", "y"),
+        lambda: extract_fn(data_dir, areas, max_samples, seed=seed)
+    )
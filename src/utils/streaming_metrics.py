@@ -0,0 +1,318 @@
+import numpy as np
+
+from src.utils.metrics import (
+    bucket_JSD, histogram_JSD, power_of_two_buckets, power_of_two_histogram
+)
+
+
+def _running_col_sum(running, rows):
+    """
+    running + rows.sum(0), adding the rows one after the other as numpy's axis-0
+    reduction of the full matrix does, so the final sums are bit-identical to it.
+    """
+    if running is None:
+        return rows.sum(0)
+    return np.concatenate([running[None], rows]).sum(0)
+
+
+def _clip_below_one(a):
+    """The prediction as accuracy() leaves it: flows below 1 set to 0."""
+    a = a.copy()
+    a[a < 1] = 0
+    return a
+
+
+class PairErrorAccumulator:
+    """
+        Pointwise metrics of cal_od_metrics over row blocks: RMSE, NRMSE, MAE, MAPE,
+        SMAPE, CPC, their nonzero variants and accuracy.
+        Sums are accumulated in float64; they agree with cal_od_metrics up to the
+        rounding of its single-pass reductions (accuracy is an exact count).
+    """
+    SUMS = ("sq_err", "abs_err", "ape", "sape", "minimum", "a", "b")
+
+    def __init__(self):
+        self.n = 0
+        self.n_nonzero = 0
+        self.n_agree = 0
+        self.sums = dict.fromkeys(self.SUMS, 0.0)
+        self.sums_nonzero = dict.fromkeys(self.SUMS, 0.0)
+        # Running count, mean and sum of squared deviations of b for b.std().
+        self.b_mean = 0.0
+        self.b_m2 = 0.0
+
+    @staticmethod
+    def _block_sums(a, b):
+        diff = a - b
+        abs_err = np.abs(diff)
+        return {
+            "sq_err": float(np.dot(diff, diff)),
+            "abs_err": float(abs_err.sum()),
+            "ape": float((abs_err / (np.abs(b) + 1)).sum()),
+            "sape": float((abs_err / ((np.abs(a) + np.abs(b)) / 2 + 1e-20)).sum()),
+            "minimum": float(np.minimum(a, b).sum()),
+            "a": float(a.sum()),
+            "b": float(b.sum()),
+        }
+
+    def update(self, a, b, a_clip):
+        nz = b != 0
+        self.n_agree += int(np.count_nonzero((a_clip != 0) == nz))
+        a64 = np.asarray(a, dtype=np.float64).reshape(-1)
+        b64 = np.asarray(b, dtype=np.float64).reshape(-1)
+        nz = nz.reshape(-1)
+        b_mean = float(b64.mean())
+        self._merge_sums(len(b64), self._block_sums(a64, b64), b_mean, float(((b64 - b_mean) ** 2).sum()))
+        self.n_nonzero += int(np.count_nonzero(nz))
+        for key, value in self._block_sums(a64[nz], b64[nz]).items():
+            self.sums_nonzero[key] += value
+
+    def _merge_sums(self, n, sums, mean, m2):
+        # Chan et al.'s pairwise update of the mean and variance.
+        total = self.n + n
+        delta = mean - self.b_mean
+        self.b_mean += delta * n / total
+        self.b_m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+        for key, value in sums.items():
+            self.sums[key] += value
+
+    def merge(self, other):
+        if other.n:
+            self._merge_sums(other.n, other.sums, other.b_mean, other.b_m2)
+        self.n_nonzero += other.n_nonzero
+        self.n_agree += other.n_agree
+        for key, value in other.sums_nonzero.items():
+            self.sums_nonzero[key] += value
+        return self
+
+    @staticmethod
+    def _finalize_sums(n, sums):
+        if n == 0:
+            nan = float("nan")
+            return nan, nan, nan, nan, nan
+        return (
+            np.sqrt(sums["sq_err"] / n),
+            sums["abs_err"] / n,
+            sums["ape"] / n,
+            sums["sape"] / n,
+            2 * sums["minimum"] / (sums["a"] + sums["b"]),
+        )
+
+    def finalize(self, n_regions):
+        rmse, mae, mape, smape, cpc = self._finalize_sums(self.n, self.sums)
+        rmse_nz, mae_nz, mape_nz, smape_nz, cpc_nz = self._finalize_sums(self.n_nonzero, self.sums_nonzero)
+        return {
+            "RMSE": float(rmse),
+            "NRMSE": float(rmse / np.sqrt(self.b_m2 / self.n)),
+            "MAE": float(mae),
+            "MAPE": float(mape),
+            "SMAPE": float(smape),
+            "CPC": float(cpc),
+            "RMSE_nonzero": float(rmse_nz),
+            "MAE_nonzero": float(mae_nz),
+            "MAPE_nonzero": float(mape_nz),
+            "SMAPE_nonzero": float(smape_nz),
+            "CPC_nonzero": float(cpc_nz),
+            "accuracy": float(self.n_agree / (n_regions ** 2)),
+        }
+
+
+class CosineAccumulator:
+    """
+        matrix_COS_similarity over row blocks of the clipped prediction.
+        Column sums run in the input dtype in row order and per-row similarities are
+        kept by row, so the result equals cal_od_metrics for sequentially added blocks.
+    """
+    def __init__(self, n_regions):
+        self.col_ab = self.col_a2 = self.col_b2 = None
+        self.row_sim = np.zeros(n_regions)
+
+    def update(self, a_clip, b, row_start):
+        ab, a2, b2 = a_clip * b, a_clip ** 2, b ** 2
+        self.col_ab = _running_col_sum(self.col_ab, ab)
+        self.col_a2 = _running_col_sum(self.col_a2, a2)
+        self.col_b2 = _running_col_sum(self.col_b2, b2)
+        row_sim = ab.sum(1) / (np.sqrt(a2.sum(1)) * np.sqrt(b2.sum(1)) + 1e-20)
+        if self.row_sim.dtype != row_sim.dtype:
+            self.row_sim = self.row_sim.astype(row_sim.dtype)
+        self.row_sim[row_start:row_start + len(row_sim)] = row_sim
+
+    def merge(self, other):
+        for name in ("col_ab", "col_a2", "col_b2"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            setattr(self, name, theirs if mine is None else mine if theirs is None else mine + theirs)
+        # Blocks cover disjoint rows; the other rows are zero.
+        self.row_sim = self.row_sim + other.row_sim
+        return self
+
+    def finalize(self):
+        col_sim = self.col_ab / (np.sqrt(self.col_a2) * np.sqrt(self.col_b2) + 1e-20)
+        return {"matrix_COS_similarity": float((col_sim.sum() + self.row_sim.sum()) / (col_sim.shape[0] * 2))}
+
+
+class FlowHistogramAccumulator:
+    """
+        JSD_inflow, JSD_outflow and JSD_ODflow over row blocks of the clipped prediction.
+        In- and out-flows are O(N) vectors (column sums in row order, row sums by row).
+        OD flows are never stored: each block adds its power-of-two bucket counts, which
+        do not depend on where the histogram ends, and finalize() cuts them at the
+        bucket set by the maximum ground-truth flow. All three are exact.
+    """
+    def __init__(self, n_regions):
+        self.a_in = self.b_in = None
+        self.a_out = np.zeros(n_regions)
+        self.b_out = np.zeros(n_regions)
+        self.a_counts = np.zeros(0, dtype=np.int64)
+        self.b_counts = np.zeros(0, dtype=np.int64)
+        self.b_max = -np.inf
+
+    @staticmethod
+    def _add_counts(counts, values):
+        values = values.reshape(-1)
+        finite = values[np.isfinite(values)]
+        if finite.size == 0:
+            return counts
+        hist = power_of_two_histogram(finite, power_of_two_buckets(finite))
+        if len(hist) > len(counts):
+            counts = np.concatenate([counts, np.zeros(len(hist) - len(counts), dtype=np.int64)])
+        counts[:len(hist)] += hist
+        return counts
+
+    def update(self, a_clip, b, row_start):
+        self.a_in = _running_col_sum(self.a_in, a_clip)
+        self.b_in = _running_col_sum(self.b_in, b)
+        a_out, b_out = a_clip.sum(1), b.sum(1)
+        if self.a_out.dtype != a_out.dtype or self.b_out.dtype != b_out.dtype:
+            self.a_out, self.b_out = self.a_out.astype(a_out.dtype), self.b_out.astype(b_out.dtype)
+        self.a_out[row_start:row_start + len(a_out)] = a_out
+        self.b_out[row_start:row_start + len(b_out)] = b_out
+        self.a_counts = self._add_counts(self.a_counts, a_clip)
+        self.b_counts = self._add_counts(self.b_counts, b)
+        # np.max keeps a nan, which finalize() then rejects like bucket_JSD does.
+        self.b_max = float(np.max([self.b_max, b.max()]))
+
+    def merge(self, other):
+        self.a_in = other.a_in if self.a_in is None else self.a_in if other.a_in is None else self.a_in + other.a_in
+        self.b_in = other.b_in if self.b_in is None else self.b_in if other.b_in is None else self.b_in + other.b_in
+        self.a_out = self.a_out + other.a_out
+        self.b_out = self.b_out + other.b_out
+        for name in ("a_counts", "b_counts"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            size = max(len(mine), len(theirs))
+            merged = np.zeros(size, dtype=np.int64)
+            merged[:len(mine)] += mine
+            merged[:len(theirs)] += theirs
+            setattr(self, name, merged)
+        self.b_max = float(np.max([self.b_max, other.b_max]))
+        return self
+
+    def finalize(self):
+        n_buckets = power_of_two_buckets(np.asarray([self.b_max]))
+        a_counts = np.zeros(n_buckets, dtype=np.int64)
+        b_counts = np.zeros(n_buckets, dtype=np.int64)
+        a_counts[:min(n_buckets, len(self.a_counts))] = self.a_counts[:n_buckets]
+        b_counts[:min(n_buckets, len(self.b_counts))] = self.b_counts[:n_buckets]
+        return {
+            "JSD_inflow": float(bucket_JSD(self.a_in, self.b_in)),
+            "JSD_outflow": float(bucket_JSD(self.a_out, self.b_out)),
+            "JSD_ODflow": float(histogram_JSD(a_counts, b_counts)),
+        }
+
+
+class ODMetricsAccumulator:
+    """
+        Every metric of cal_od_metrics, accumulated over row blocks of one N x N
+        prediction so the matrices never have to be in memory at once.
+        update() takes whole origin rows, update_pairs() takes row-major pair chunks at
+        any boundaries (at most one partial row is buffered); blocks may arrive in any
+        row order and accumulators of disjoint row ranges can be merge()d.
+        Memory is O(N). As in cal_od_metrics, COS similarity and the JSDs use the
+        prediction with flows below 1 set to 0.
+        clip_negative: clip negative predictions to 0 and report their number as
+        negative_predictions instead of raising (CPC is undefined for negative flows).
+    """
+    def __init__(self, n_regions, clip_negative=False):
+        self.n_regions = n_regions
+        self.clip_negative = clip_negative
+        self.negative_predictions = 0
+        self.rows_seen = np.zeros(n_regions, dtype=bool)
+        self.errors = PairErrorAccumulator()
+        self.cosine = CosineAccumulator(n_regions)
+        self.histograms = FlowHistogramAccumulator(n_regions)
+        self._pending = None
+
+    def update(self, pred_rows, true_rows, row_start):
+        """Add rows [row_start, row_start + len(pred_rows)) of the prediction and ground truth."""
+        a, b = np.asarray(pred_rows), np.asarray(true_rows)
+        if a.ndim != 2 or a.shape != b.shape or a.shape[1] != self.n_regions:
+            raise ValueError(f"Expected (rows, {self.n_regions}) blocks, got {a.shape} and {b.shape}.")
+        rows = slice(row_start, row_start + len(a))
+        if row_start < 0 or rows.stop > self.n_regions or self.rows_seen[rows].any():
+            raise ValueError(f"Rows {row_start}..{rows.stop - 1} are out of range or were already added.")
+        if (b < 0).any():
+            raise ValueError("OD flow should not be less than zero.")
+        negative = a < 0
+        if negative.any():
+            if not self.clip_negative:
+                raise ValueError("OD flow should not be less than zero.")
+            self.negative_predictions += int(np.count_nonzero(negative))
+            a = np.maximum(a, 0)
+        self.rows_seen[rows] = True
+
+        a_clip = _clip_below_one(a)
+        self.errors.update(a, b, a_clip)
+        self.cosine.update(a_clip, b, row_start)
+        self.histograms.update(a_clip, b, row_start)
+
+    def update_pairs(self, pred, true, offset):
+        """
+        Add a chunk of flattened row-major pairs starting at pair offset. A chunk must
+        start on a row boundary or continue the previous chunk.
+        """
+        pred, true = np.asarray(pred).reshape(-1), np.asarray(true).reshape(-1)
+        if self._pending is not None:
+            pending_pred, pending_true, pending_offset = self._pending
+            if offset != pending_offset + len(pending_pred):
+                raise ValueError("Pair chunks must be contiguous while a partial row is pending.")
+            pred = np.concatenate([pending_pred, pred])
+            true = np.concatenate([pending_true, true])
+            offset = pending_offset
+            self._pending = None
+        if offset % self.n_regions:
+            raise ValueError("Pair chunks must start on a row boundary.")
+
+        n_full = len(pred) // self.n_regions * self.n_regions
+        if n_full:
+            self.update(pred[:n_full].reshape(-1, self.n_regions),
+                        true[:n_full].reshape(-1, self.n_regions), offset // self.n_regions)
+        if n_full < len(pred):
+            self._pending = (pred[n_full:].copy(), true[n_full:].copy(), offset + n_full)
+
+    def merge(self, other):
+        """Combine with an accumulator over disjoint rows of the same OD matrix."""
+        if other.n_regions != self.n_regions or (self.rows_seen & other.rows_seen).any():
+            raise ValueError("Only accumulators over disjoint rows of the same matrix can be merged.")
+        if self._pending is not None or other._pending is not None:
+            raise ValueError("Cannot merge while a partial row is pending.")
+        self.errors.merge(other.errors)
+        self.cosine.merge(other.cosine)
+        self.histograms.merge(other.histograms)
+        self.rows_seen |= other.rows_seen
+        self.negative_predictions += other.negative_predictions
+        return self
+
+    def finalize(self):
+        """The metrics dict of cal_od_metrics (plus negative_predictions with clip_negative)."""
+        if self._pending is not None or not self.rows_seen.all():
+            raise ValueError(f"Only {int(self.rows_seen.sum())} of {self.n_regions} rows were added.")
+        errors = self.errors.finalize(self.n_regions)
+        metrics = {"num_regions": self.n_regions}
+        metrics.update({key: errors[key] for key in (
+            "RMSE", "NRMSE", "MAE", "MAPE", "SMAPE", "CPC",
+            "RMSE_nonzero", "MAE_nonzero", "MAPE_nonzero", "SMAPE_nonzero", "CPC_nonzero", "accuracy")})
+        metrics.update(self.cosine.finalize())
+        metrics.update(self.histograms.finalize())
+        if self.clip_negative:
+            metrics["negative_predictions"] = self.negative_predictions
+        return metrics
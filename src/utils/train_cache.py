@@ -0,0 +1,105 @@
+import os
+
+from src.utils.shared_arrays import (
+    ENTRY_PREFIX, array_key, entry_dir, get_or_publish, release_arrays, shared_training_set
+)
+
+
+# Bump whenever CommutingODPairDataset changes the feature layout or the
+# sampling in extract_xy changes, so stale entries are never reused.
+FEATURE_VERSION = 1
+
+
+class TrainingSetCache:
+    """
+        Persistent cache of extracted (X_train, y_train) pairs.
+        Entries are keyed by a hash of the data directory, the ordered area ids,
+        max_samples, seed and feature settings; they are stored as .npy files and
+        loaded back as read-only memory maps. The total size is capped and the
+        least recently used entries are evicted first.
+    """
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, data_dir, areas, max_samples, seed, toy_flag=False):
+        return array_key(
+            "train", FEATURE_VERSION, os.path.abspath(data_dir), list(areas),
+            max_samples, seed, toy_flag
+        )
+
+    def get_or_extract(self, extract_fn, data_dir, areas, max_samples, seed):
+        """
+            Return the cached training set, extracting and storing it on a miss.
+            Empty extractions are returned without being stored.
+        """
+        key = self.key(data_dir, areas, max_samples, seed)
+        hit = os.path.isdir(entry_dir(self.cache_dir, key))
+        X, y = get_or_publish(
+            self.cache_dir, key, ("X", "y"),
+            lambda: extract_fn(data_dir, areas, max_samples, seed=seed)
+        )
+        if hit:
+            print(f"    [Cache] Hit {key} ({len(X)} samples).", flush=True)
+            self._touch(key)
+        elif os.path.isdir(entry_dir(self.cache_dir, key)):
+            print(f"    [Cache] Stored {key} ({len(X)} samples).", flush=True)
+            self.evict(keep=key)
+        else:
+            print(f"    [Cache] Not storing {key}: empty training set.", flush=True)
+        return X, y
+
+    def entries(self):
+        """List (last_used, size_bytes, path) for every cache entry."""
+        out = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not name.startswith(ENTRY_PREFIX) or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            out.append((os.stat(path).st_mtime, size, path))
+        return out
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if self.max_bytes is None:
+            return 0
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        keep_path = entry_dir(self.cache_dir, keep) if keep is not None else None
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            # Processes that still map the entry keep reading their pages.
+            release_arrays(self.cache_dir, os.path.basename(path)[len(ENTRY_PREFIX):])
+            total -= size
+            removed += 1
+        if removed:
+            print(f"    [Cache] Evicted {removed} entries; cache size {total / 1024 ** 3:.2f} GB.", flush=True)
+        return removed
+
+    def _touch(self, key):
+        try:
+            os.utime(entry_dir(self.cache_dir, key), None)
+        except FileNotFoundError:
+            pass
+
+
+def load_training_set(extract_fn, data_dir, areas, max_samples, seed, cache=None, shm_dir=None, shm_keep=False):
+    """
+        Extract (X, y) for the given source areas, going through the persistent
+        cache or the shared-memory store when one is configured. Shared-memory
+        entries are removed when the last process using them exits, unless shm_keep.
+        extract_xy reseeds and advances the global numpy RNG; a cache or shared-memory
+        hit skips it, so np.random's state afterwards differs between a hit and a miss.
+        The runners draw nothing from it after loading (models take explicit seeds).
+    """
+    if cache is not None:
+        return cache.get_or_extract(extract_fn, data_dir, areas, max_samples, seed)
+    if shm_dir:
+        return shared_training_set(shm_dir, extract_fn, data_dir, areas, max_samples, seed, keep=shm_keep)
+    return extract_fn(data_dir, areas, max_samples, seed=seed)